@@ -6,9 +6,18 @@ import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import sqlite3
+from datetime import datetime, timedelta
+from data_loader import get_sensor_loader, load_latest_readings, load_rollup_series
+from filters import sidebar_filters
+from downsample import downsample
 
 # Connect to database
 db_name = 'plant_data.db'
+# Seconds between chart refreshes in live mode
+LIVE_INTERVAL = 2
+# Ranges longer than this are charted from the hourly rollups, they hold more readings than a chart has pixels
+# and the oldest may already be pruned from sensor_data
+ROLLUP_DAYS = 14
 def get_db_path(db_name):
     # get current path
     current_dir = os.path.dirname(__file__)
@@ -22,11 +31,6 @@ def get_db_path(db_name):
 db_path = get_db_path(db_name)
 conn = sqlite3.connect(db_path)
 cursor = conn.cursor()
-df = pd.read_sql_query("SELECT * FROM sensor_data", conn)
-# Convert to datetime
-df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
-# Remove microseconds by truncating to seconds
-df['timestamp'] = df['timestamp'].dt.floor('s')
 
 # Page and title
 st.set_page_config(
@@ -121,10 +125,26 @@ st.markdown("""
 
 # Add a title
 st.title("Smart Garden Dashboard")
-last_row = df.iloc[-1]
-# Text
-st.info(
-    f"LATEST SENSOR READING: Moisture: {last_row['moisture']:.2f} | Temp: {last_row['temperature']:.1f}°C | Humidity: {last_row['humidity']:.1f}% | Light: {last_row['light_level']} | Time: {last_row['timestamp']}")
+# Only the selected plant and dates are read from sqlite, kept between reruns and topped up with new readings
+plant_id_filter, start, end = sidebar_filters(conn)
+
+# Current state of every plant straight from latest_readings, no history needed
+latest_df = load_latest_readings(conn)
+if plant_id_filter is not None:
+    banner_df = latest_df[latest_df['plant_id'] == plant_id_filter]
+else:
+    banner_df = latest_df
+if not banner_df.empty:
+    last_row = banner_df.iloc[0]
+    # Text
+    st.info(
+        f"LATEST SENSOR READING: Plant: {last_row['plant_id']} | Moisture: {last_row['moisture']:.2f} | Temp: {last_row['temperature']:.1f}°C | Humidity: {last_row['humidity']:.1f}% | Light: {last_row['light_level']} | Time: {last_row['timestamp']}")
+
+st.subheader("Fleet Status")
+fleet_df = latest_df.copy()
+# How long since each node last reported, a stale one is probably offline
+fleet_df['last_seen'] = (pd.Timestamp.now().floor('s') - fleet_df['timestamp']).astype(str)
+st.dataframe(fleet_df, hide_index=True, use_container_width=True)
 
 # Side Bar
 with st.sidebar:
@@ -146,6 +166,7 @@ with st.sidebar:
         if submit_button:
             try:
             # WE are using the existing database connection idk if good practice :D
+            # The triggers on plant_settings bump settings_version, which tells the MQTT server to drop its cached settings
                 cursor.execute("""
                 UPDATE plant_settings
                 SET moisture_threshold = ?, watering_duration = ?
@@ -157,6 +178,10 @@ with st.sidebar:
             except Exception as e:
                 st.error("Failed to update settings: {str(e)}")
 
+    st.subheader("Live Updates")
+    live = st.toggle("Live charts", value=False, key="live_charts",
+                     help=f"Append new readings to the charts every {LIVE_INTERVAL} seconds without reloading the page")
+
     st.subheader("Current Plant Settings")
     try:
         #Query settings using existing connection
@@ -173,6 +198,8 @@ with st.sidebar:
 
 # Create rounded chart function for consistent styling
 def create_rounded_chart(data, x_col, y_col, title):
+    # Only send Plotly about as many points as the chart has pixels
+    data = downsample(data, x_col, y_col)
     fig = px.line(data, x=x_col, y=y_col)
     fig.update_layout(
         title=title,
@@ -204,99 +231,118 @@ def create_rounded_chart(data, x_col, y_col, title):
     return fig
 
 
-# Main Content - First row
-col1, col2 = st.columns(2)
-
-with col1:
-    st.header("Moisture")
-    fig = create_rounded_chart(df, 'timestamp', 'moisture', "Moisture Levels")
-    st.plotly_chart(fig, use_container_width=True)
-
-with col2:
-    st.header("Temperature")
-    fig = create_rounded_chart(df, 'timestamp', 'temperature', "Temperature (°C)")
-    st.plotly_chart(fig, use_container_width=True, key= 'temp_chart')
-
-# Second row Humidity and Moisture
-col3, col4 = st.columns(2)
-
-with col3:
-    st.header("Humidity")
-    fig = create_rounded_chart(df, 'timestamp', 'humidity', "Humidity (%)")
-    st.plotly_chart(fig, use_container_width=True, key= 'humidity_chart')
-
-with col4:
-    st.header("Light Intensity & UV")
-    light_df = df[['timestamp', 'light_level']].copy()
-
-    #place holder for UV data
-    light_df['uv_placeholder'] = light_df['light_level'] * 0.4
-
-
-    #Create figure using go
-    fig = go.Figure()
-
-    #Add each Trace
-    fig.add_trace(go.Scatter(
-        x=light_df['timestamp'],
-        y=light_df['light_level'],
-        mode='lines',
-        name='Light Intensity',
-
-    ))
-
-    fig.add_trace(go.Scatter(
-        x=light_df['timestamp'],
-        y=light_df['uv_placeholder'],
-        mode='lines',
-        name='UV',
-        line=dict(color='#8A2BE2')
-
-    ))
-
-    fig.update_layout(
-        title="Light Intensity & UV",
-        plot_bgcolor='#3B6255',
-        paper_bgcolor='#3B6255',
-        font_color='#668a84',
-        margin=dict(l=10, r=10, t=30, b=10),
-        height=300,  # Consistent height
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
+# In live mode only this part reruns, every LIVE_INTERVAL seconds. The loader is fed by the process' shared
+# change feed, so each rerun appends the pushed rows without a query however many dashboards are open
+@st.fragment(run_every=LIVE_INTERVAL if live else None)
+def sensor_charts():
+    if not live and (end or datetime.now()) - start > timedelta(days=ROLLUP_DAYS):
+        rollup_conn = sqlite3.connect(db_path)
+        try:
+            df = load_rollup_series(rollup_conn, 'hour', plant_id_filter, start, end)
+        finally:
+            rollup_conn.close()
+    else:
+        df = get_sensor_loader(db_path, plant_id=plant_id_filter, start=start, end=end, live=live).load()
+    if df.empty:
+        st.warning("No sensor readings for the selected plant and dates")
+        return
+
+    # Main Content - First row
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.header("Moisture")
+        fig = create_rounded_chart(df, 'timestamp', 'moisture', "Moisture Levels")
+        st.plotly_chart(fig, use_container_width=True)
+
+    with col2:
+        st.header("Temperature")
+        fig = create_rounded_chart(df, 'timestamp', 'temperature', "Temperature (°C)")
+        st.plotly_chart(fig, use_container_width=True, key= 'temp_chart')
+
+    # Second row Humidity and Moisture
+    col3, col4 = st.columns(2)
+
+    with col3:
+        st.header("Humidity")
+        fig = create_rounded_chart(df, 'timestamp', 'humidity', "Humidity (%)")
+        st.plotly_chart(fig, use_container_width=True, key= 'humidity_chart')
+
+    with col4:
+        st.header("Light Intensity & UV")
+        # UV is derived from light, so the points picked for light work for both
+        light_df = downsample(df[['timestamp', 'light_level']], 'timestamp', 'light_level').copy()
+
+        #place holder for UV data
+        light_df['uv_placeholder'] = light_df['light_level'] * 0.4
+
+
+        #Create figure using go
+        fig = go.Figure()
+
+        #Add each Trace
+        fig.add_trace(go.Scatter(
+            x=light_df['timestamp'],
+            y=light_df['light_level'],
+            mode='lines',
+            name='Light Intensity',
+
+        ))
+
+        fig.add_trace(go.Scatter(
+            x=light_df['timestamp'],
+            y=light_df['uv_placeholder'],
+            mode='lines',
+            name='UV',
+            line=dict(color='#8A2BE2')
+
+        ))
+
+        fig.update_layout(
+            title="Light Intensity & UV",
+            plot_bgcolor='#3B6255',
+            paper_bgcolor='#3B6255',
+            font_color='#668a84',
+            margin=dict(l=10, r=10, t=30, b=10),
+            height=300,  # Consistent height
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1
+            )
         )
-    )
-
-    # Update line width for both traces
-    fig.update_traces(line=dict(width=2.5))
-
-    # Set specific color for Light Intensity (first trace)
-    fig.data[0].line.color = '#D2C49E'  # Light intensity color
-
 
+        # Update line width for both traces
+        fig.update_traces(line=dict(width=2.5))
+
+        # Set specific color for Light Intensity (first trace)
+        fig.data[0].line.color = '#D2C49E'  # Light intensity color
+
+
+
+        # Add rounded corners to the plot area
+        fig.update_layout(
+            shapes=[
+                dict(
+                    type="rect",
+                    xref="paper",
+                    yref="paper",
+                    x0=0,
+                    y0=0,
+                    x1=1,
+                    y1=1,
+                    line=dict(width=0),
+                    fillcolor='rgba(0,0,0,0)',
+                    layer="below"
+                )
+            ]
+        )
+        st.plotly_chart(fig, use_container_width=True, key= 'light_chart')
 
-    # Add rounded corners to the plot area
-    fig.update_layout(
-        shapes=[
-            dict(
-                type="rect",
-                xref="paper",
-                yref="paper",
-                x0=0,
-                y0=0,
-                x1=1,
-                y1=1,
-                line=dict(width=0),
-                fillcolor='rgba(0,0,0,0)',
-                layer="below"
-            )
-        ]
-    )
-    st.plotly_chart(fig, use_container_width=True, key= 'light_chart')
 
+sensor_charts()
 
 # Close the database connection when done
 conn.close()
@@ -0,0 +1,523 @@
+'''
+Queries shared by the dashboard pages. Streamlit puts Front_End on the path so pages/ can import this too.
+'''
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+import pandas as pd
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# Seconds a loaded frame is reused before checking the database for new rows
+SENSOR_DATA_TTL = 5.0
+
+# Every plant/date range picked in the sidebar gets its own loader, only keep the most recent few
+MAX_LOADERS = 8
+
+# Seconds between the live change feed's checks for new readings
+FEED_INTERVAL = 1.0
+
+# Rollup bucket keys are local time text, so their range bounds are compared as text in the same layout
+BOUND_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Size of the hourly ring in seasonality_hourly, same as seasonality.HOURLY_SLOTS on the server
+HOURLY_SLOTS = 24 * 28
+
+_loaders = OrderedDict()
+_loaders_lock = threading.Lock()
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def local_timezone():
+    """ The Pi's time zone, by name when we can find it so DST changes are handled, otherwise the current offset """
+    name = os.environ.get('TZ', '').lstrip(':')
+    if not name:
+        # /etc/localtime links into the zoneinfo database, the part after zoneinfo/ is the zone name
+        target = os.path.realpath('/etc/localtime')
+        if 'zoneinfo/' in target:
+            name = target.split('zoneinfo/', 1)[1]
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return datetime.now().astimezone().tzinfo
+
+
+LOCAL_TZ = local_timezone()
+
+
+def decode_timestamps(epoch_ms):
+    """
+    Stored epoch milliseconds to the Pi's local time, truncated to seconds. All vectorized, no string parsing.
+    :param epoch_ms: Series of epoch milliseconds
+    :return: Series of naive local datetimes
+    """
+    timestamps = pd.to_datetime(epoch_ms, unit='ms', utc=True).dt.tz_convert(LOCAL_TZ).dt.tz_localize(None)
+    return timestamps.dt.floor('s')
+
+
+def filter_clause(plant_id=None, start=None, end=None, time_column='timestamp'):
+    """
+    Parameterized WHERE conditions for a plant and [start, end) time range, so only that slice leaves sqlite.
+    :param plant_id: specific plant/arduino node, None for every plant
+    :param start: datetime (local time), inclusive
+    :param end: datetime (local time), exclusive
+    :param time_column: 'timestamp' holds epoch milliseconds, 'bucket_start' local time text
+    :return: (list of condition strings, list of parameters)
+    """
+    if time_column == 'bucket_start':
+        bound = lambda value: value.strftime(BOUND_FORMAT)
+    else:
+        bound = lambda value: int(value.timestamp() * 1000)
+    conditions, params = [], []
+    if plant_id is not None:
+        conditions.append('plant_id = ?')
+        params.append(str(plant_id))
+    if start is not None:
+        conditions.append(f'{time_column} >= ?')
+        params.append(bound(start))
+    if end is not None:
+        conditions.append(f'{time_column} < ?')
+        params.append(bound(end))
+    return conditions, params
+
+
+class ChangeFeed:
+    """
+    One thread per dashboard process tailing sensor_data by id, so any number of open dashboards (and their
+    live fragments) cost one cheap query per interval instead of one query per session per rerun.
+    New rows are read and decoded once and pushed to every subscribed loader.
+    """
+    def __init__(self, db_path, interval=FEED_INTERVAL):
+        """
+        :param db_path: Path to plant_data.db
+        :param interval: Seconds between checks for new rows
+        """
+        self.db_path = db_path
+        self.interval = interval
+        self.last_id = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sensor-change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def subscribe(self, loader):
+        with self._lock:
+            self._subscribers.add(loader)
+
+    def unsubscribe(self, loader):
+        with self._lock:
+            self._subscribers.discard(loader)
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            data_version = None
+            while not self._stop.is_set():
+                try:
+                    # data_version only changes when another connection (the MQTT server) commits,
+                    # so an idle garden costs a pragma per interval
+                    version = conn.execute('PRAGMA data_version').fetchone()[0]
+                    if version != data_version:
+                        data_version = version
+                        self.poll(conn)
+                except sqlite3.Error as e:
+                    print(f"Change feed failed {e}")
+                self._stop.wait(self.interval)
+        finally:
+            conn.close()
+
+    def poll(self, conn):
+        """ Read rows past the last id seen and push them to the subscribers """
+        if self.last_id is None:
+            # Loaders read what was there before they subscribed themselves, the feed only carries what comes after
+            self.last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM sensor_data').fetchone()[0]
+            return
+        new_rows = pd.read_sql_query(
+            'SELECT * FROM sensor_data WHERE id > ? ORDER BY id', conn, params=[self.last_id]
+        )
+        first_id = conn.execute('SELECT MIN(id) FROM sensor_data').fetchone()[0]
+        epoch_ms = new_rows['timestamp'].to_numpy()
+        new_rows['timestamp'] = decode_timestamps(new_rows['timestamp'])
+        if len(new_rows):
+            self.last_id = int(new_rows['id'].iloc[-1])
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loader in subscribers:
+            loader.push(new_rows, epoch_ms, first_id)
+
+
+def get_change_feed(db_path, interval=FEED_INTERVAL):
+    """ The shared, started ChangeFeed for a database file """
+    key = os.path.abspath(db_path)
+    with _feeds_lock:
+        feed = _feeds.get(key)
+        if feed is None:
+            feed = ChangeFeed(db_path, interval)
+            # Takes the starting id now, so rows stored from here on reach the loaders subscribed later
+            conn = sqlite3.connect(db_path)
+            try:
+                feed.poll(conn)
+            finally:
+                conn.close()
+            feed.start()
+            _feeds[key] = feed
+        return feed
+
+
+class SensorDataLoader:
+    """
+    Keeps sensor_data in memory between Streamlit reruns. Every slider move or form submit reruns the
+    page, so instead of SELECT * and re-parsing every timestamp each time, only rows with an id past the
+    last one loaded are read (at most once per ttl) and appended to the frame we already have.
+    With a ChangeFeed the loader never queries again after the first load, new rows are pushed to it.
+    """
+    def __init__(self, db_path, ttl=SENSOR_DATA_TTL, plant_id=None, start=None, end=None, feed=None):
+        """
+        :param db_path: Path to plant_data.db
+        :param ttl: Seconds to reuse the loaded frame before looking for new rows, 0 checks on every load
+        :param plant_id: only load this plant, None loads every plant
+        :param start: only load readings from this datetime on
+        :param end: only load readings before this datetime
+        :param feed: ChangeFeed to take new rows from instead of polling, see get_change_feed
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.conditions, self.params = filter_clause(plant_id, start, end)
+        self.plant_id = None if plant_id is None else str(plant_id)
+        self.start_ms = None if start is None else int(start.timestamp() * 1000)
+        self.end_ms = None if end is None else int(end.timestamp() * 1000)
+        self.frame = None
+        self.last_id = 0
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        # Rows pushed by the feed since the last load, (frame, first_id) pairs
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self.feed = feed
+        if feed is not None:
+            # Before the first query, so nothing stored in between is missed
+            feed.subscribe(self)
+
+    def close(self):
+        if self.feed is not None:
+            self.feed.unsubscribe(self)
+
+    def load(self, refresh=False):
+        """
+        :param refresh: Look for new rows even if the ttl hasn't run out
+        :return: DataFrame of sensor_data ordered by id. It is shared between reruns, copy it before changing it.
+        """
+        with self._lock:
+            if self.feed is not None and self.loaded_at is not None:
+                self._apply_pushed_rows()
+            elif refresh or self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl:
+                self._fetch_new_rows()
+            return self.frame
+
+    def push(self, new_rows, epoch_ms, first_id):
+        """
+        Called from the ChangeFeed thread with every new row, keeps the ones matching this loader's filter.
+        :param new_rows: sensor_data rows with timestamps already decoded
+        :param epoch_ms: their timestamps as stored, for the range check
+        :param first_id: lowest id still in sensor_data after pruning
+        """
+        keep = np.ones(len(new_rows), dtype=bool)
+        if self.plant_id is not None:
+            keep &= (new_rows['plant_id'] == self.plant_id).to_numpy()
+        if self.start_ms is not None:
+            keep &= epoch_ms >= self.start_ms
+        if self.end_ms is not None:
+            keep &= epoch_ms < self.end_ms
+        with self._pending_lock:
+            self._pending.append((new_rows[keep], first_id))
+
+    def _apply_pushed_rows(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for new_rows, first_id in pending:
+            # The first load may already have read some of what the feed pushes
+            self._merge(new_rows[new_rows['id'] > self.last_id], first_id)
+
+    def _fetch_new_rows(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conditions, params = self.conditions, self.params
+            if self.frame is not None:
+                # Later loads only want what came after the last id, the rowid range finds it fastest.
+                # The first load leaves it out so a date range is answered from the timestamp index
+                conditions, params = ['id > ?'] + conditions, [self.last_id] + params
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            new_rows = pd.read_sql_query(f'SELECT * FROM sensor_data {where} ORDER BY id', conn, params=params)
+            # Retention pruning deletes from the front, drop whatever is gone from the database.
+            # MIN(id) over the whole table is answered from the rowid b-tree without a scan
+            first_id = conn.execute('SELECT MIN(id) FROM sensor_data').fetchone()[0]
+        finally:
+            conn.close()
+
+        # Only the new rows get their timestamps decoded
+        new_rows['timestamp'] = decode_timestamps(new_rows['timestamp'])
+        self._merge(new_rows, first_id)
+
+    def _merge(self, new_rows, first_id):
+        frame = self.frame
+        if frame is None:
+            frame = new_rows.reset_index(drop=True)
+        else:
+            # Filtering and concat build new frames, so a page still holding the old one never sees it change
+            if first_id is None:
+                frame = frame.iloc[0:0]
+            elif len(frame) and frame['id'].iloc[0] < first_id:
+                frame = frame[frame['id'] >= first_id].reset_index(drop=True)
+            if len(new_rows):
+                frame = pd.concat([frame, new_rows], ignore_index=True)
+        self.frame = frame
+        if len(self.frame):
+            self.last_id = int(self.frame['id'].iloc[-1])
+        self.loaded_at = time.monotonic()
+
+
+def get_sensor_loader(db_path, ttl=SENSOR_DATA_TTL, plant_id=None, start=None, end=None, live=False):
+    """
+    Returns the shared loader for a database file and filter, creating it on first use. Streamlit reruns
+    the page scripts but keeps imported modules, so the loader (and its frame) outlives each rerun.
+    :param db_path: Path to plant_data.db
+    :param ttl: Seconds to reuse the loaded frame, only used when the loader is created
+    :param plant_id: see SensorDataLoader
+    :param start: see SensorDataLoader
+    :param end: see SensorDataLoader
+    :param live: Take new rows from the process' shared ChangeFeed instead of polling sqlite
+    :return: SensorDataLoader
+    """
+    key = (os.path.abspath(db_path), None if plant_id is None else str(plant_id), start, end, live)
+    with _loaders_lock:
+        loader = _loaders.get(key)
+        if loader is None:
+            feed = get_change_feed(db_path) if live else None
+            loader = SensorDataLoader(db_path, ttl, plant_id, start, end, feed=feed)
+            _loaders[key] = loader
+            if len(_loaders) > MAX_LOADERS:
+                _loaders.popitem(last=False)[1].close()
+        else:
+            _loaders.move_to_end(key)
+        return loader
+
+
+def load_latest_readings(conn):
+    """
+    Newest reading of every plant from latest_readings, kept at ingest so this is one row per plant
+    however long the history is.
+    :param conn: sqlite connection
+    :return: DataFrame with plant_id, the sensor columns and timestamp, most recently heard from first
+    """
+    df = pd.read_sql_query(
+        f"SELECT plant_id, {', '.join(SENSORS)}, timestamp FROM latest_readings ORDER BY timestamp DESC", conn
+    )
+    df['timestamp'] = decode_timestamps(df['timestamp'])
+    return df
+
+
+def load_analytics(conn, kind, plant_id=None):
+    """
+    Finished series ML_Service/analytics_job.py stored for the ML Models page.
+    :param conn: sqlite connection
+    :param kind: 'correlation' or 'qq'
+    :param plant_id: specific plant/arduino node, None for the whole fleet
+    :return: (payload, watermark, computed_at datetime) or None if the job hasn't produced it yet
+    """
+    row = conn.execute(
+        'SELECT payload, watermark, computed_at FROM analytics WHERE plant_id = ? AND kind = ?',
+        ('' if plant_id is None else str(plant_id), kind)
+    ).fetchone()
+    if row is None:
+        return None
+    payload, watermark, computed_at = row
+    return json.loads(payload), watermark, datetime.fromtimestamp(computed_at / 1000)
+
+
+def load_range_correlation(conn, plant_id=None, start=None, end=None):
+    """
+    Correlation matrix of the readings in a time range, for when the page's filters are narrower than the
+    all-history one analytics_job.py keeps. Two aggregate queries, the sums are taken around the range's means
+    so nothing is lost to cancellation, and no reading leaves sqlite.
+    :param plant_id: specific plant/arduino node, None for every plant
+    :param start: datetime, inclusive
+    :param end: datetime, exclusive
+    :return: {'sensors', 'matrix'} like the analytics payload (None where a sensor never varied), None without readings
+    """
+    conditions, params = filter_clause(plant_id, start, end)
+    # Same rows the analytics job uses, only readings with every sensor
+    conditions += [f'{sensor} IS NOT NULL' for sensor in SENSORS]
+    where = ' AND '.join(conditions)
+    means = conn.execute(
+        f"SELECT COUNT(*), {', '.join(f'AVG({sensor})' for sensor in SENSORS)} FROM sensor_data WHERE {where}", params
+    ).fetchone()
+    if means[0] < 2:
+        return None
+    pairs = [(i, j) for i in range(len(SENSORS)) for j in range(i, len(SENSORS))]
+    sums = conn.execute(
+        f"SELECT {', '.join(f'SUM(({SENSORS[i]} - ?) * ({SENSORS[j]} - ?))' for i, j in pairs)} "
+        f"FROM sensor_data WHERE {where}",
+        [value for i, j in pairs for value in (means[i + 1], means[j + 1])] + params
+    ).fetchone()
+    m2 = np.zeros((len(SENSORS), len(SENSORS)))
+    for (i, j), value in zip(pairs, sums):
+        m2[i, j] = m2[j, i] = value
+    std = np.sqrt(np.diag(m2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = m2 / np.outer(std, std)
+    matrix = [[None if not np.isfinite(value) else round(float(value), 4) for value in row] for row in corr]
+    return {'sensors': list(SENSORS), 'matrix': matrix}
+
+
+def load_drift_history(conn, plant_id=None, start=None, end=None):
+    """
+    Closed days from the drift engine (drift_engine.py), each with the window band it was checked against.
+    :param conn: sqlite connection
+    :param plant_id: specific plant/arduino node, None for the whole fleet
+    :param start: only days from this datetime on
+    :param end: only days before this datetime
+    :return: DataFrame with sensor, timestamp (the day), mean, count, window_mean, window_std, window_days, alert
+    """
+    conditions, params = ['plant_id = ?'], ['' if plant_id is None else str(plant_id)]
+    if start is not None:
+        conditions.append('day >= ?')
+        params.append(start.strftime('%Y-%m-%d'))
+    if end is not None:
+        conditions.append('day < ?')
+        params.append(end.strftime('%Y-%m-%d'))
+    df = pd.read_sql_query(f'''
+        SELECT sensor, day AS timestamp, mean, count, window_mean, window_std, window_days, alert
+        FROM drift_history WHERE {' AND '.join(conditions)} ORDER BY sensor, day
+    ''', conn, params=params)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d')
+    df['alert'] = df['alert'].astype(bool)
+    return df
+
+
+def load_seasonality_cube(conn, plant_id=None):
+    """
+    The hour of day x day of week sums the MQTT server keeps in seasonality_cube.
+    :param conn: sqlite connection
+    :param plant_id: specific plant/arduino node, None adds every plant up
+    :return: {sensor: (sums, counts)}, both 24 x 7 arrays indexed [hour, weekday], weekday 0 is Monday
+    """
+    where, params = ('WHERE plant_id = ?', [str(plant_id)]) if plant_id is not None else ('', [])
+    cube = {sensor: (np.zeros((24, 7)), np.zeros((24, 7), dtype=np.int64)) for sensor in SENSORS}
+    for sensor, weekday, hour, total, count in conn.execute(f'''
+        SELECT sensor, weekday, hour, SUM(sum), SUM(count) FROM seasonality_cube {where}
+        GROUP BY sensor, weekday, hour
+    ''', params):
+        if sensor in cube:
+            cube[sensor][0][hour, weekday] = total
+            cube[sensor][1][hour, weekday] = count
+    return cube
+
+
+def load_hourly_series(conn, plant_id=None):
+    """
+    The last HOURLY_SLOTS hourly means from the seasonality_hourly ring, for the autocorrelation.
+    :param conn: sqlite connection
+    :param plant_id: specific plant/arduino node, None combines every plant per hour
+    :return: {sensor: array of hourly means, oldest first, NaN for hours without readings}
+    """
+    where, params = ('WHERE plant_id = ?', [str(plant_id)]) if plant_id is not None else ('', [])
+    rows = conn.execute(f'''
+        SELECT sensor, hour_index, SUM(sum), SUM(count) FROM seasonality_hourly {where}
+        GROUP BY sensor, hour_index
+    ''', params).fetchall()
+    newest = {}
+    for sensor, index, _, _ in rows:
+        newest[sensor] = max(newest.get(sensor, index), index)
+    series = {sensor: np.full(HOURLY_SLOTS, np.nan) for sensor in SENSORS}
+    for sensor, index, total, count in rows:
+        # Slots still holding an hour from before the ring came round are skipped
+        age = newest[sensor] - index
+        if sensor in series and age < HOURLY_SLOTS and count:
+            series[sensor][HOURLY_SLOTS - 1 - age] = total / count
+    # Trim the hours before the first reading
+    for sensor, values in series.items():
+        seen = np.flatnonzero(~np.isnan(values))
+        series[sensor] = values[seen[0]:] if len(seen) else values[:0]
+    return series
+
+
+def list_plants(conn):
+    """ Plant ids with stored readings, from the small daily rollups instead of a sensor_data scan """
+    rows = conn.execute(
+        "SELECT DISTINCT plant_id FROM sensor_rollups WHERE resolution = 'day' ORDER BY plant_id"
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def data_date_range(conn):
+    """ (first day, last day) with stored readings as dates, (None, None) if there are none """
+    first, last = conn.execute(
+        "SELECT MIN(bucket_start), MAX(bucket_start) FROM sensor_rollups WHERE resolution = 'day'"
+    ).fetchone()
+    if first is None:
+        return None, None
+    return pd.Timestamp(first).date(), pd.Timestamp(last).date()
+
+
+def load_rollups(conn, resolution, plant_id=None, start=None, end=None):
+    """
+    Load the minute/hour/day aggregates the MQTT server keeps in sensor_rollups, instead of resampling raw readings.
+    :param conn: sqlite connection
+    :param resolution: 'minute', 'hour' or 'day'
+    :param plant_id: specific plant/arduino node, None combines every plant per bucket
+    :param start: only buckets starting from this datetime on
+    :param end: only buckets starting before this datetime
+    :return: DataFrame with timestamp (bucket start), count and <sensor>_min/_max/_sum/_count/_mean columns.
+    A sensor's mean only counts its own readings, NaN for a bucket where it only sent nulls
+    """
+    conditions, filter_params = filter_clause(plant_id, start, end, time_column='bucket_start')
+    where = ' AND '.join(['resolution = ?'] + conditions)
+    aggregates = ', '.join(
+        f'MIN({s}_min) AS {s}_min, MAX({s}_max) AS {s}_max, SUM({s}_sum) AS {s}_sum, SUM({s}_count) AS {s}_count'
+        for s in SENSORS
+    )
+    if plant_id is None:
+        query = f'''
+            SELECT bucket_start AS timestamp, SUM(count) AS count, {aggregates}
+            FROM sensor_rollups WHERE {where}
+            GROUP BY bucket_start ORDER BY bucket_start
+        '''
+    else:
+        columns = ', '.join(f'{s}_min, {s}_max, {s}_sum, {s}_count' for s in SENSORS)
+        query = f'''
+            SELECT bucket_start AS timestamp, count, {columns}
+            FROM sensor_rollups WHERE {where}
+            ORDER BY bucket_start
+        '''
+    df = pd.read_sql_query(query, conn, params=[resolution] + filter_params)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d %H:%M:%S')
+    for sensor in SENSORS:
+        df[f'{sensor}_mean'] = df[f'{sensor}_sum'] / df[f'{sensor}_count'].where(df[f'{sensor}_count'] > 0)
+    return df
+
+
+def load_rollup_series(conn, resolution, plant_id=None, start=None, end=None):
+    """
+    Bucket means from load_rollups in the shape of the sensor_data frame the charts take: timestamp (bucket start)
+    and one column per sensor. Long date ranges are drawn from these, however many raw readings they cover.
+    """
+    rollups = load_rollups(conn, resolution, plant_id, start, end)
+    return rollups[['timestamp']].assign(**{sensor: rollups[f'{sensor}_mean'] for sensor in SENSORS})
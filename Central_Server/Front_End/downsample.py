@@ -0,0 +1,87 @@
+'''
+Shrinks time series before they go to Plotly. Every point we hand a figure ends up in the browser payload,
+months of raw readings make the page huge and slow to draw when the chart is only ~800 pixels wide anyway.
+'''
+import numpy as np
+import pandas as pd
+
+# Roughly the pixel width of a chart in one of the dashboard's two columns
+CHART_POINTS = 800
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last point, split the time in between into threshold - 2
+    equal width buckets and from each keep the point making the largest triangle with the previous kept point
+    and the next bucket's average. Peaks and troughs survive because they make the big triangles. Buckets
+    falling in a gap between readings are empty and skipped, so fewer points come back then.
+    :param x: sorted x values as floats
+    :param y: y values as floats, no NaN
+    :param threshold: most points to keep
+    :return: indices of the kept points, ascending
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # edges[i] is the first point at or after bucket i's start time, the last edge is the final point
+    edges = np.searchsorted(x, np.linspace(x[1], x[-1], threshold - 1))
+    edges[0], edges[-1] = 1, n - 1
+    buckets = [(start, end) for start, end in zip(edges[:-1], edges[1:]) if end > start]
+    selected = np.empty(len(buckets) + 2, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i, (start, end) in enumerate(buckets):
+        next_start, next_end = buckets[i + 1] if i + 1 < len(buckets) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the triangle area, the constant factor doesn't change the argmax
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def min_max_indices(x, y, threshold):
+    """
+    Split the x range into threshold / 2 equal width buckets and keep each bucket's lowest and highest point.
+    Cheaper than LTTB and never misses an extreme, but the line looks busier.
+    :return: indices of the kept points, ascending
+    """
+    n = len(x)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return np.arange(n)
+    span = x[-1] - x[0]
+    bucket = np.zeros(n, dtype=np.int64) if span == 0 else \
+        np.minimum(((x - x[0]) / span * buckets).astype(np.int64), buckets - 1)
+    grouped = pd.Series(y).groupby(bucket)
+    return np.unique(np.concatenate([grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy()]))
+
+
+def downsample(data, x_col, y_col, points=CHART_POINTS, method='lttb'):
+    """
+    Rows of data to plot for y_col against x_col, at most about points of them.
+    The buckets are an even share of whatever time range data covers, so a longer selected range
+    automatically gets coarser buckets and a short one is drawn raw.
+    :param data: DataFrame with the series, any order
+    :param x_col: timestamp column
+    :param y_col: column choosing the points, other columns come along for the same rows
+    :param points: about how many points to keep, the chart's width in pixels
+    :param method: 'lttb' or 'minmax'
+    :return: DataFrame sorted by x_col
+    """
+    data = data.dropna(subset=[y_col]).sort_values(x_col, kind='stable')
+    if len(data) <= points:
+        return data
+    x = data[x_col]
+    if pd.api.types.is_datetime64_any_dtype(x):
+        x = x.astype('int64')
+    x = x.to_numpy(dtype=np.float64)
+    y = data[y_col].to_numpy(dtype=np.float64)
+    if method == 'minmax':
+        indices = min_max_indices(x, y, points)
+    else:
+        indices = lttb_indices(x, y, points)
+    return data.iloc[indices]
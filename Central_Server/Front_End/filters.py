@@ -0,0 +1,46 @@
+'''
+Sidebar plant and date range controls shared by the dashboard pages.
+'''
+from datetime import date, datetime, time, timedelta
+
+import streamlit as st
+from data_loader import list_plants, data_date_range
+
+ALL_PLANTS = "All plants"
+# Days shown until a range is picked, ending at the newest reading
+DEFAULT_DAYS = 7
+
+
+def sidebar_filters(conn):
+    """
+    Draw the plant and date range pickers in the sidebar.
+    Streamlit keeps widget values per key, so the choice carries over between pages.
+    :param conn: sqlite connection
+    :return: (plant_id or None for every plant, start datetime, end datetime exclusive). end is None when the
+    range runs to the newest reading's day, so live charts keep taking new readings after midnight.
+    """
+    first_day, last_day = data_date_range(conn)
+    if first_day is None:
+        first_day = last_day = date.today()
+
+    with st.sidebar:
+        st.header("Filters")
+        plant = st.selectbox("Plant", [ALL_PLANTS] + list_plants(conn), key="filter_plant")
+        picked = st.date_input(
+            "Date range",
+            value=(max(first_day, last_day - timedelta(days=DEFAULT_DAYS - 1)), last_day),
+            min_value=first_day,
+            max_value=max(last_day, date.today()),
+            key="filter_dates"
+        )
+
+    # While the second date is being picked date_input only has the first one
+    if isinstance(picked, (tuple, list)):
+        start_day = picked[0]
+        end_day = picked[1] if len(picked) > 1 else picked[0]
+    else:
+        start_day = end_day = picked
+    start = datetime.combine(start_day, time.min)
+    end = datetime.combine(end_day + timedelta(days=1), time.min) if end_day < last_day else None
+    plant_id = None if plant == ALL_PLANTS else plant
+    return plant_id, start, end
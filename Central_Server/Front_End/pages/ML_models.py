@@ -9,6 +9,9 @@ import sqlite3
 from plotly.subplots import make_subplots
 from statsmodels.tsa.stattools import acf
 from scipy import stats
+from data_loader import (load_analytics, load_drift_history, load_seasonality_cube, load_hourly_series,
+                         load_range_correlation, data_date_range)
+from filters import sidebar_filters
 
 db_name = 'plant_data.db'
 def get_db_path(db_name):
@@ -25,13 +28,34 @@ def get_db_path(db_name):
 db_path = get_db_path(db_name)
 conn = sqlite3.connect(db_path)
 cursor = conn.cursor()
-df = pd.read_sql_query("SELECT * FROM sensor_data", conn)
-# Convert to datetime
-df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
-# Remove microseconds by truncating to seconds
-df['timestamp'] = df['timestamp'].dt.floor('s')
+# Same filters as the dashboard page
+plant_id_filter, start, end = sidebar_filters(conn)
 st.title('Models & Machine Learning Service')
 
+# Everything below is precomputed by ML_Service/analytics_job.py, the page only reads the finished series
+correlation_result = load_analytics(conn, 'correlation', plant_id_filter)
+qq_result = load_analytics(conn, 'qq', plant_id_filter)
+# The job's series cover all history, a narrower date range gets its correlation straight from sensor_data.
+# Q-Q quantiles come from the t-digests, those can't be cut to a date range
+first_day, _ = data_date_range(conn)
+all_history = end is None and (first_day is None or start.date() <= first_day)
+if all_history:
+    correlation = correlation_result[0] if correlation_result is not None else None
+else:
+    correlation = load_range_correlation(conn, plant_id_filter, start, end)
+# Drift is tracked at ingest by drift_engine.py, one row per sensor and closed day
+drift_history = load_drift_history(conn, plant_id_filter, start, end)
+recent_alerts = drift_history[drift_history['alert']].sort_values('timestamp')
+if not recent_alerts.empty:
+    st.warning("Drift alerts: " + ", ".join(
+        f"{row.sensor} on {row.timestamp:%Y-%m-%d} (mean {row.mean:.2f}, band {row.window_mean:.2f} ± {2 * row.window_std:.2f})"
+        for row in recent_alerts.tail(5).itertuples()
+    ))
+if correlation_result is None:
+    st.info("Analytics haven't been computed yet, run: python -m ML_Service.analytics_job")
+else:
+    st.caption(f"Analytics up to reading #{correlation_result[1]}, computed {correlation_result[2]:%Y-%m-%d %H:%M:%S}")
+
 st.success(f"Recent watering event Moisture before: | 00 Moisture After: 10 | watering duration: 15 seconds. Please provide feedback below")
 st.warning("Model is recommending irrigation. Confirm or adjust action")
 
@@ -59,52 +83,51 @@ with col1:
     # st.plotly_chart(fig, use_container_width=True)
 # Helper function for correlation matrix
 
-def get_corr_matrix(df):
-    corr = df[['moisture', 'temperature', 'humidity', 'light_level']].corr()
-    return corr
+def get_corr_matrix(correlation):
+    """ Correlation matrix DataFrame from the analytics job's payload """
+    return pd.DataFrame(correlation['matrix'], index=correlation['sensors'], columns=correlation['sensors'],
+                        dtype=float)
 
 with col2:
-    corr_matrix = get_corr_matrix(df)
-
-    st.header("Correlation Matrix")
-    # fig = create_rounded_chart(corr_matrix, df['timestamp'], 'temperature', 'Temperature (°C)')
-    fig = go.Figure(data=go.Heatmap(z=corr_matrix.values,
-                                    x=corr_matrix.columns,
-                                    y=corr_matrix.index,
-                                    text= corr_matrix.values,
-                                    texttemplate='%{text}', # Display text
-                                    showscale=True, # Show Scale
-                                    colorscale= 'tealgrn'
-                                    ))
-    fig.update_layout(title="Correlation Matrix",
-                      width=800,
-                      height=400,
-                      xaxis_showgrid=False,
-                      yaxis_showgrid=False,
-                      yaxis_autorange= 'reversed')
-
-    st.plotly_chart(fig, use_container_width=True, key="corr_matrix")
+    if correlation is not None:
+        corr_matrix = get_corr_matrix(correlation)
+
+        st.header("Correlation Matrix")
+        st.caption("All history" if all_history else "Only the readings in the selected dates")
+        # fig = create_rounded_chart(corr_matrix, df['timestamp'], 'temperature', 'Temperature (°C)')
+        fig = go.Figure(data=go.Heatmap(z=corr_matrix.values,
+                                        x=corr_matrix.columns,
+                                        y=corr_matrix.index,
+                                        text= corr_matrix.values,
+                                        texttemplate='%{text}', # Display text
+                                        showscale=True, # Show Scale
+                                        colorscale= 'tealgrn'
+                                        ))
+        fig.update_layout(title="Correlation Matrix",
+                          width=800,
+                          height=400,
+                          xaxis_showgrid=False,
+                          yaxis_showgrid=False,
+                          yaxis_autorange= 'reversed')
+
+        st.plotly_chart(fig, use_container_width=True, key="corr_matrix")
 # Functions to create graphs
-def create_qq_plot(df, sensor_column, plant_id=None):
+def create_qq_plot(qq, sensor_column, plant_id=None):
     """
-    Create a QQ Plot for a specific column in df
-    :param df: - pd dataframe
+    Create a QQ Plot for a specific sensor from precomputed quantiles
+    :param qq: the analytics job's qq payload, sample quantiles per sensor
     :param sensor_column: Column name of sensor
-    :param plant_id: specific plant/arduino node
+    :param plant_id: specific plant/arduino node the quantiles are for
     :return: fig
     """
-    # filter if plant_id is specificied.
-    if plant_id:
-        data = df[df['plant_id'] == plant_id][sensor_column].dropna()
-    else:
-        data = df[sensor_column].dropna()
-    #Calculate Quantiles
-    column_quantiles = np.linspace(0.01, 0.99, len(data))
-
-    #sort the data
-    sorted_data = np.sort(data)
-
-    theoretical_values = stats.norm.ppf(column_quantiles, loc=np.mean(data), scale=np.std(data))
+    sensor_qq = qq.get(sensor_column)
+    if not sensor_qq:
+        return go.Figure()
+    #Quantiles were computed at fixed probabilities, no need for the raw readings
+    column_quantiles = np.array(sensor_qq['probabilities'])
+    sorted_data = np.array(sensor_qq['quantiles'])
+
+    theoretical_values = stats.norm.ppf(column_quantiles, loc=sensor_qq['mean'], scale=sensor_qq['std'])
     #Create Plot
     fig = go.Figure()
     fig.add_trace(go.Scatter(
@@ -143,31 +166,21 @@ def create_qq_plot(df, sensor_column, plant_id=None):
     )
     return fig
 # function to create seasonality plot
-def create_seasonality_plot(df, sensor_column, max_lags=60, plant_id=None):
+def create_seasonality_plot(cube, hourly, sensor_column, max_lags=60, plant_id=None):
     """
     Create seasonality check plots using autocorrelation.
 
     Parameters:
-    - df: Pandas DataFrame containing the sensor data
+    - cube: (sums, counts) 24 x 7 arrays for the sensor from load_seasonality_cube
+    - hourly: hourly means for the sensor from load_hourly_series, oldest first
     - sensor_column: Column name of the sensor (e.g., 'temperature', 'humidity')
     - max_lags: Maximum number of lags to calculate for ACF
-    - plant_id: Optional filter for specific plant_id
+    - plant_id: plant_id the aggregates were loaded for, used in the title
 
     Returns:
     - Plotly figure object with ACF and daily/weekly heatmaps
     """
-    # Ensure timestamp is datetime
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-    # Filter data if plant_id is specified
-    if plant_id:
-        data = df[df['plant_id'] == plant_id].copy()
-    else:
-        data = df.copy()
-
-    # Extract time components
-    data['hour'] = data['timestamp'].dt.hour
-    data['day_of_week'] = data['timestamp'].dt.dayofweek  # 0 = Monday, 6 = Sunday
+    sums, counts = cube
 
     # Create figure with subplots
     fig = make_subplots(
@@ -179,41 +192,44 @@ def create_seasonality_plot(df, sensor_column, max_lags=60, plant_id=None):
     )
 
     # 1. Autocorrelation plot
-    # Resample to hourly data to handle irregular timestamps
-    hourly_data = data.set_index('timestamp')[sensor_column].resample('H').mean().dropna()
-
-    # Calculate ACF
-    acf_values = acf(hourly_data, nlags=max_lags)
-    confidence_interval = 1.96 / np.sqrt(len(hourly_data))
-
-    # Add ACF plot
-    fig.add_trace(
-        go.Scatter(x=list(range(len(acf_values))), y=acf_values,
-                   mode='lines+markers', name='ACF',
-                   line=dict(color='blue')),
-        row=1, col=1
-    )
-
-    # Add confidence intervals
-    fig.add_trace(
-        go.Scatter(x=list(range(len(acf_values))), y=[confidence_interval] * len(acf_values),
-                   mode='lines', name='95% Confidence',
-                   line=dict(color='red', dash='dash')),
-        row=1, col=1
-    )
-
-    fig.add_trace(
-        go.Scatter(x=list(range(len(acf_values))), y=[-confidence_interval] * len(acf_values),
-                   mode='lines', showlegend=False,
-                   line=dict(color='red', dash='dash')),
-        row=1, col=1
-    )
+    # Hours without readings stay in the series as NaN so the lags still line up
+    observed = np.count_nonzero(~np.isnan(hourly))
+    if observed > 2:
+        acf_values = acf(hourly, nlags=min(max_lags, len(hourly) - 1), missing='conservative')
+        confidence_interval = 1.96 / np.sqrt(observed)
+
+        # Add ACF plot
+        fig.add_trace(
+            go.Scatter(x=list(range(len(acf_values))), y=acf_values,
+                       mode='lines+markers', name='ACF',
+                       line=dict(color='blue')),
+            row=1, col=1
+        )
+
+        # Add confidence intervals
+        fig.add_trace(
+            go.Scatter(x=list(range(len(acf_values))), y=[confidence_interval] * len(acf_values),
+                       mode='lines', name='95% Confidence',
+                       line=dict(color='red', dash='dash')),
+            row=1, col=1
+        )
+
+        fig.add_trace(
+            go.Scatter(x=list(range(len(acf_values))), y=[-confidence_interval] * len(acf_values),
+                       mode='lines', showlegend=False,
+                       line=dict(color='red', dash='dash')),
+            row=1, col=1
+        )
+
+    # The cube keeps sums and counts, so every average below is the mean of the raw readings
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hourly_avg = sums.sum(axis=1) / counts.sum(axis=1)
+        dow_avg = sums.sum(axis=0) / counts.sum(axis=0)
+        hour_day = sums / counts
 
     # 2. Hourly pattern - average by hour of day
-    hourly_avg = data.groupby('hour')[sensor_column].mean().reset_index()
-
     fig.add_trace(
-        go.Bar(x=hourly_avg['hour'], y=hourly_avg[sensor_column],
+        go.Bar(x=list(range(24)), y=hourly_avg,
                name='Hourly Average',
                marker_color='teal'),
         row=1, col=2
@@ -221,28 +237,20 @@ def create_seasonality_plot(df, sensor_column, max_lags=60, plant_id=None):
 
     # 3. Day of week pattern - average by day of week
     day_names = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-    dow_avg = data.groupby('day_of_week')[sensor_column].mean().reset_index()
 
     fig.add_trace(
-        go.Bar(x=[day_names[i] for i in dow_avg['day_of_week']],
-               y=dow_avg[sensor_column],
+        go.Bar(x=day_names,
+               y=dow_avg,
                name='Day of Week Average',
                marker_color='orange'),
         row=2, col=1
     )
 
     # 4. Hour-Day heatmap
-    hour_day_pivot = data.pivot_table(
-        index='hour',
-        columns='day_of_week',
-        values=sensor_column,
-        aggfunc='mean'
-    )
-
     fig.add_trace(
         go.Heatmap(
-            z=hour_day_pivot.values,
-            x=[day_names[i] for i in range(7)],
+            z=hour_day,
+            x=day_names,
             y=list(range(24)),
             colorscale='Viridis',
             name='Hour-Day Heatmap'
@@ -276,50 +284,28 @@ def create_seasonality_plot(df, sensor_column, max_lags=60, plant_id=None):
     return fig
 
 
-def create_concept_drift_plot(df, sensor_column, window_size=14, plant_id=None):
+def create_concept_drift_plot(history, sensor_column, plant_id=None):
     """
     Create temporal stability plot to detect concept drift in sensor data.
 
     Parameters:
-    - df: Pandas DataFrame containing the sensor data
+    - history: drift history from load_drift_history, daily means with the window band each day was checked against
     - sensor_column: Column name of the sensor (e.g., 'temperature', 'humidity')
-    - window_size: Size of the rolling window (in days)
-    - plant_id: Optional filter for specific plant_id
+    - plant_id: plant_id the history is for, used in the title
 
     Returns:
     - Plotly figure object
     """
-    # Ensure timestamp is datetime
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-    # Filter data if plant_id is specified
-    if plant_id:
-        data = df[df['plant_id'] == plant_id].copy()
-    else:
-        data = df.copy()
-
-    # Sort by timestamp
-    data = data.sort_values('timestamp')
+    history = history[history['sensor'] == sensor_column]
+    window_size = int(history['window_days'].max()) if not history.empty else 0
 
-    # Set timestamp as index for resampling
-    data.set_index('timestamp', inplace=True)
-
-    # Resample to daily mean
-    daily_data = data[sensor_column].resample('D').mean()
-
-    # Calculate rolling statistics
-    rolling_mean = daily_data.rolling(window=window_size).mean()
-    rolling_std = daily_data.rolling(window=window_size).std()
-
-    # Calculate upper and lower bounds (2 standard deviations)
-    upper_bound = rolling_mean + 2 * rolling_std
-    lower_bound = rolling_mean - 2 * rolling_std
-
-    # Reset index for plotting
-    daily_data = daily_data.reset_index()
-    rolling_mean = rolling_mean.reset_index()
-    upper_bound = upper_bound.reset_index()
-    lower_bound = lower_bound.reset_index()
+    # Same shapes the plot always used, the engine already kept the rolling statistics
+    daily_data = history[['timestamp']].assign(**{sensor_column: history['mean']})
+    rolling_mean = history[['timestamp']].assign(**{sensor_column: history['window_mean']})
+    rolling_std = history[['timestamp']].assign(**{sensor_column: history['window_std']}).set_index('timestamp')
+    upper_bound = history[['timestamp']].assign(**{sensor_column: history['window_mean'] + 2 * history['window_std']})
+    lower_bound = history[['timestamp']].assign(**{sensor_column: history['window_mean'] - 2 * history['window_std']})
+    alerts = history[history['alert']]
 
     # Create figure with secondary y-axis
     fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -362,6 +348,14 @@ def create_concept_drift_plot(df, sensor_column, window_size=14, plant_id=None):
         secondary_y=True,
     )
 
+    # Days that left the band when they closed
+    fig.add_trace(
+        go.Scatter(x=alerts['timestamp'], y=alerts['mean'],
+                   mode='markers', name='Drift Alert',
+                   marker=dict(color='orange', size=10, symbol='x')),
+        secondary_y=False,
+    )
+
     # Set titles
     title = f"Temporal Stability for {sensor_column}"
     if plant_id:
@@ -378,46 +372,58 @@ def create_concept_drift_plot(df, sensor_column, window_size=14, plant_id=None):
 
     return fig
 
-col3, col4 = st.columns(2)
-with col3:
-    st.header("Q-Q Moisture")
-    qq_fig = create_qq_plot(df, sensor_column='moisture')
-    st.plotly_chart(qq_fig, use_container_width=False, key="qq_moisture")
-
-with col4:
-    st.header("Q-Q Temperature")
-    qq_fig = create_qq_plot(df, sensor_column='temperature')
-    st.plotly_chart(qq_fig, use_container_width=False, key="qq_temp")
-
-# humidity and light level columns
-col5, col6 = st.columns(2)
-with col5:
-    st.header("Q-Q Humidity")
-    qq_fig = create_qq_plot(df, sensor_column='humidity')
-    st.plotly_chart(qq_fig, use_container_width=False, key="qq_humidity")
-with col6:
-    st.header("Q-Q Light")
-    qq_fig = create_qq_plot(df, sensor_column='light_level')
-    st.plotly_chart(qq_fig, use_container_width=False, key="qq_light")
+# Without the job's Q-Q series only these panels are skipped, drift and seasonality come from the server's tables
+if qq_result is not None:
+    st.caption(f"Q-Q plots cover all history up to reading #{qq_result[1]}, not only the selected dates")
+    col3, col4 = st.columns(2)
+    with col3:
+        st.header("Q-Q Moisture")
+        qq_fig = create_qq_plot(qq_result[0], sensor_column='moisture', plant_id=plant_id_filter)
+        st.plotly_chart(qq_fig, use_container_width=False, key="qq_moisture")
+
+    with col4:
+        st.header("Q-Q Temperature")
+        qq_fig = create_qq_plot(qq_result[0], sensor_column='temperature', plant_id=plant_id_filter)
+        st.plotly_chart(qq_fig, use_container_width=False, key="qq_temp")
+
+    # humidity and light level columns
+    col5, col6 = st.columns(2)
+    with col5:
+        st.header("Q-Q Humidity")
+        qq_fig = create_qq_plot(qq_result[0], sensor_column='humidity', plant_id=plant_id_filter)
+        st.plotly_chart(qq_fig, use_container_width=False, key="qq_humidity")
+    with col6:
+        st.header("Q-Q Light")
+        qq_fig = create_qq_plot(qq_result[0], sensor_column='light_level', plant_id=plant_id_filter)
+        st.plotly_chart(qq_fig, use_container_width=False, key="qq_light")
 # Concept Drift
 col7, col8 = st.columns(2)
 with col7:
     st.header("Drift Moisture")
-    drift_fig = create_concept_drift_plot(df, sensor_column='moisture')
+    drift_fig = create_concept_drift_plot(drift_history, sensor_column='moisture', plant_id=plant_id_filter)
     st.plotly_chart(drift_fig, use_container_width=False, key="drift_moisture")
 with col8:
     st.header("Drift Temperature")
-    drift_fig = create_concept_drift_plot(df, sensor_column='temperature')
+    drift_fig = create_concept_drift_plot(drift_history, sensor_column='temperature', plant_id=plant_id_filter)
     st.plotly_chart(drift_fig, use_container_width=False, key="drift_temp")
 col9, col10 = st.columns(2)
 with col9:
     st.header("Drift Humidity")
-    drift_fig = create_concept_drift_plot(df, sensor_column='humidity')
+    drift_fig = create_concept_drift_plot(drift_history, sensor_column='humidity', plant_id=plant_id_filter)
     st.plotly_chart(drift_fig, use_container_width=False, key="drift_humidity")
 with col10:
     st.header("Drift Light")
-    drift_fig = create_concept_drift_plot(df, sensor_column='light_level')
+    drift_fig = create_concept_drift_plot(drift_history, sensor_column='light_level', plant_id=plant_id_filter)
     st.plotly_chart(drift_fig, use_container_width=False, key="drift_light")
 
+# Seasonality
+st.header("Seasonality")
+season_sensor = st.selectbox("Sensor", ('moisture', 'temperature', 'humidity', 'light_level'), key="season_sensor")
+season_fig = create_seasonality_plot(
+    load_seasonality_cube(conn, plant_id_filter)[season_sensor],
+    load_hourly_series(conn, plant_id_filter)[season_sensor],
+    sensor_column=season_sensor, plant_id=plant_id_filter
+)
+st.plotly_chart(season_fig, use_container_width=True, key="seasonality")
 
 conn.close()
\ No newline at end of file
@@ -1,22 +1,210 @@
-class MLInference:
-    def __init__(self):
-        self.models = {}
+'''
+Model inference for the automation decisions. Models live on disk in a registry directory, one file per plant
+(plant_<plant_id>.pkl) or per plant type (type_<plant_type>.pkl) for plants without their own. They are loaded
+the first time a plant needs them and kept in an LRU cache with a memory cap, so the Pi never holds every model.
+A .npz export (npz_model.py, written by ML_Service/export.py) is used over the .pkl of the same name, it loads
+without importing the framework the model was trained with.
+'''
+import os
+import pickle
+import threading
+from collections import OrderedDict
+import numpy as np
+from npz_model import load_npz
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+# Bytes of model files kept loaded, going by their size on disk
+CACHE_BYTES = 64 * 1024 * 1024
+
+# Outputs a model predicts when its file doesn't say, probabilities of needing water and needing light
+OUTPUTS = ('needs_water', 'needs_light')
+
+
+class ModelRegistry:
+    """
+    Finds the model file for a plant. The directory listing is cached and only read again when the directory
+    changes, so a lookup is a dict get and a stat.
+    """
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self._files = set()
+        self._listed_mtime = None
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.model_dir).st_mtime_ns
+        except FileNotFoundError:
+            self._files, self._listed_mtime = set(), None
+            return
+        if mtime != self._listed_mtime:
+            self._files = set(os.listdir(self.model_dir))
+            self._listed_mtime = mtime
 
-    def predict(self, plant_id, sensor_data):
+    def resolve(self, plant_id, plant_type=None):
         """
-        placeholder for now
-        :param plant_id:
-        :param sensor_data:
-        :return:
+        :return: path of the plant's own model, else its plant type's, else None. .npz before .pkl for each
         """
+        self._refresh()
+        stems = [f'plant_{plant_id}'] + ([f'type_{plant_type}'] if plant_type else [])
+        for stem in stems:
+            for name in (stem + '.npz', stem + '.pkl'):
+                if name in self._files:
+                    return os.path.join(self.model_dir, name)
         return None
 
-    def confidence(self, plant_id, sensor_data):
+    def save(self, model, plant_id=None, plant_type=None, features=SENSORS, outputs=OUTPUTS):
+        """
+        Write a model to the registry, replacing the file atomically so a running server never reads half of it.
+        A .npz of the same name is an export of the model being replaced, it is removed so this one gets served.
+        :param model: anything with predict_proba (scikit-learn style) or predict returning probabilities
+        :param features: reading or feature names the model takes, in order (SENSORS, ML_Service.feature_store.FEATURES)
+        :param outputs: what each predicted column means
+        :return: path written
+        """
+        name = f'plant_{plant_id}.pkl' if plant_id is not None else f'type_{plant_type}.pkl'
+        os.makedirs(self.model_dir, exist_ok=True)
+        path = os.path.join(self.model_dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'model': model, 'features': tuple(features), 'outputs': tuple(outputs)}, f)
+        os.replace(path + '.tmp', path)
+        try:
+            os.remove(os.path.splitext(path)[0] + '.npz')
+        except FileNotFoundError:
+            pass
+        return path
+
+
+class MLInference:
+    def __init__(self, model_dir=MODEL_DIR, cache_bytes=CACHE_BYTES):
+        """
+        :param model_dir: Registry directory with the plant_<id> / type_<plant_type> .npz or .pkl model files
+        :param cache_bytes: Most bytes of model files kept loaded, least recently used ones are dropped past it
+        """
+        self.registry = ModelRegistry(model_dir)
+        self.cache_bytes = cache_bytes
+        # path -> (model artifact, file size, file mtime), least recently used first
+        self.models = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        # Plants whose readings drifted away from what their model was trained on, filled by the drift engine
+        self.retrain_requested = set()
+        # (plant_id, reading, timestamp) -> dict of the plant's features including that reading (FeatureStore.current),
+        # merged into readings for models using them
+        self.feature_source = None
+
+    def on_drift(self, alert):
+        """
+        DriftEngine listener, a drift alert means the plant's model should be retrained
+        :param alert: dict with plant_id, sensor, day, mean, window_mean, window_std. plant_id is '' for the fleet
+        """
+        self.retrain_requested.add(alert['plant_id'])
+
+    def needs_retrain(self, plant_id):
+        """ True when the plant (or the whole fleet) drifted since its model was last trained """
+        return str(plant_id) in self.retrain_requested or '' in self.retrain_requested
+
+    def mark_retrained(self, plant_id):
+        self.retrain_requested.discard(str(plant_id))
+
+    def load_model(self, path):
+        """
+        The model artifact at path from the cache, read from disk on a miss or when the file was replaced.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            cached = self.models.get(path)
+            if cached is not None and cached[2] == stat.st_mtime_ns:
+                self.models.move_to_end(path)
+                return cached[0]
+        if path.endswith('.npz'):
+            artifact = load_npz(path)
+        else:
+            with open(path, 'rb') as f:
+                artifact = pickle.load(f)
+        with self._lock:
+            old = self.models.pop(path, None)
+            if old is not None:
+                self._cached_bytes -= old[1]
+            self.models[path] = (artifact, stat.st_size, stat.st_mtime_ns)
+            self._cached_bytes += stat.st_size
+            # Always keep the one just loaded, even if it alone is over the cap
+            while self._cached_bytes > self.cache_bytes and len(self.models) > 1:
+                _, (_, size, _) = self.models.popitem(last=False)
+                self._cached_bytes -= size
+        return artifact
+
+    def predict_batch(self, sensor_data, settings, timestamps=None):
+        """
+        Score many plants, one model call per model file however many plants share it.
+        :param sensor_data: list of reading dicts
+        :param settings: list of plant settings dicts (plant_id, plant_type), same order as sensor_data
+        :param timestamps: when each reading was taken (datetime or epoch ms), for the features computed from it
+        :return: ml_predictions for PlantController.get_ml_based_automation,
+        {plant_id: {'needs_water': bool, 'needs_light': bool, 'water_probability': float, 'light_probability': float,
+        'confidence': float, 'retrain': bool}}. Plants without a model are left out.
+        """
+        groups = {}
+        timestamps = timestamps or [None] * len(sensor_data)
+        for reading, plant_settings, timestamp in zip(sensor_data, settings, timestamps):
+            path = self.registry.resolve(plant_settings.get('plant_id'), plant_settings.get('plant_type'))
+            if path is not None:
+                features = None
+                if self.feature_source:
+                    features = self.feature_source(plant_settings.get('plant_id'), reading, timestamp)
+                if features:
+                    # The raw reading wins, the features include it when its timestamp is known
+                    reading = dict(features, **reading)
+                groups.setdefault(path, []).append((reading, plant_settings))
+
+        ml_predictions = {}
+        for path, members in groups.items():
+            try:
+                artifact = self.load_model(path)
+                features = np.array(
+                    [[reading.get(sensor, np.nan) for sensor in artifact['features']] for reading, _ in members],
+                    dtype=np.float64
+                )
+                probabilities = self._probabilities(artifact['model'], features)
+            except Exception as e:
+                print(f"Inference failed for {path} {e}")
+                continue
+            for (_, plant_settings), row in zip(members, probabilities):
+                plant_id = plant_settings.get('plant_id')
+                prediction = {'retrain': self.needs_retrain(plant_id)}
+                for output, probability in zip(artifact['outputs'], row.tolist()):
+                    prediction[output] = probability >= 0.5
+                    prediction[output.replace('needs_', '') + '_probability'] = probability
+                # How far the outputs are from a coin flip, 0 unsure to 1 certain
+                prediction['confidence'] = float(np.mean(np.abs(row - 0.5)) * 2)
+                ml_predictions[plant_id] = prediction
+        return ml_predictions
+
+    def _probabilities(self, model, features):
+        """ (plants, outputs) probabilities from a scikit-learn style model """
+        if hasattr(model, 'predict_proba'):
+            result = model.predict_proba(features)
+            # Multi-output classifiers give one (plants, 2) array per output
+            if isinstance(result, list):
+                return np.column_stack([r[:, -1] for r in result])
+            return result[:, -1:] if result.ndim == 2 and result.shape[1] == 2 else result
+        result = np.asarray(model.predict(features), dtype=np.float64)
+        return result.reshape(len(features), -1)
+
+    def predict(self, plant_id, sensor_data, settings=None):
+        """
+        Predictions for a single reading, see predict_batch
+        :param settings: the plant's settings, used to fall back to its plant type's model
+        :return: prediction dict, or None when the plant has no model
+        """
+        settings = dict(settings or {}, plant_id=str(plant_id))
+        return self.predict_batch([sensor_data], [settings]).get(str(plant_id))
+
+    def confidence(self, plant_id, sensor_data, settings=None):
         """
-        placeholder for now, return confidence to maybe create some logic based ontop?
-        or for later implementation of model health analytics
-        :param plant_id:
-        :param sensor_data:
-        :return:
+        Confidence (0 to 1) of the prediction for a reading, None when the plant has no model
         """
-        return None
\ No newline at end of file
+        prediction = self.predict(plant_id, sensor_data, settings)
+        return prediction['confidence'] if prediction else None
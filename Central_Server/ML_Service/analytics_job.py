@@ -0,0 +1,205 @@
+'''
+Background job precomputing what the ML Models page shows (correlation matrix, Q-Q quantiles) per plant and
+for the whole fleet, into the analytics table. The page only reads finished series, so it loads in the same
+time however long the history gets. Concept drift is tracked at ingest instead, see drift_engine.py.
+Run it next to the MQTT server, from Central_Server: python -m ML_Service.analytics_job
+'''
+import json
+import threading
+import time
+import numpy as np
+from db_handler import DataBaseHandler
+from quantile_sketch import load_sketch, fleet_sketch
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# plant_id of the rows covering every plant
+FLEET = ''
+
+# Probabilities the Q-Q plots are drawn at
+QQ_PROBABILITIES = np.linspace(0.01, 0.99, 99)
+
+
+def merge_moments(a, b):
+    """
+    Combine two (count, mean vector, co-moment matrix) summaries (Chan et al.), so correlations are
+    kept up to date from only the new rows without the cancellation problems of raw sums of squares.
+    """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    if n_a == 0:
+        return b
+    if n_b == 0:
+        return a
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + np.outer(delta, delta) * (n_a * n_b / n)
+    return n, mean, m2
+
+
+def chunk_moments(values):
+    """ (count, mean vector, co-moment matrix) of a 2D array of readings, one column per sensor """
+    if len(values) == 0:
+        return empty_moments()
+    mean = values.mean(axis=0)
+    centered = values - mean
+    return len(values), mean, centered.T @ centered
+
+
+def empty_moments():
+    return 0, np.zeros(len(SENSORS)), np.zeros((len(SENSORS), len(SENSORS)))
+
+
+def correlation(moments):
+    """ Correlation matrix (list of lists, None where a sensor never varied) from a moments summary """
+    n, mean, m2 = moments
+    std = np.sqrt(np.diag(m2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = m2 / np.outer(std, std)
+    return [[None if not np.isfinite(value) else round(float(value), 4) for value in row] for row in corr]
+
+
+class AnalyticsJob:
+    def __init__(self, db_name='plant_data.db', interval=300, chunk_size=5000):
+        """
+        :param db_name: Path to plant_data.db
+        :param interval: Seconds between runs in run_forever
+        :param chunk_size: Rows fetched at a time when reading sensor_data
+        """
+        self.interval = interval
+        self.chunk_size = chunk_size
+        # Brings the schema (including the analytics table) up to date
+        self.db = DataBaseHandler(db_name)
+        self._stop = threading.Event()
+
+    def close(self):
+        self.db.close()
+
+    def stop(self):
+        """ Ask run_forever to finish after the current run """
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Analytics job failed {e}")
+            self._stop.wait(self.interval)
+
+    def run_once(self):
+        """
+        Recompute the analytics of every plant with readings past the stored watermark (the last sensor_data id
+        seen), then the fleet rows. Nothing is read when no new readings arrived.
+        :return: List of plant ids that were recomputed
+        """
+        conn = self.db.pool.connection()
+        watermark = conn.execute('SELECT MAX(id) FROM sensor_data').fetchone()[0] or 0
+        previous = self.stored_watermark(conn)
+        if watermark <= previous:
+            return []
+        plant_ids = [row[0] for row in conn.execute(
+            'SELECT DISTINCT plant_id FROM sensor_data WHERE id > ? AND id <= ?', (previous, watermark)
+        )]
+
+        results = {}
+        moments = {}
+        for plant_id in plant_ids:
+            moments[plant_id] = self.update_moments(conn, plant_id, watermark)
+            results[(plant_id, 'moments')] = self.encode_moments(moments[plant_id])
+            results[(plant_id, 'correlation')] = {'sensors': SENSORS, 'matrix': correlation(moments[plant_id])}
+            results[(plant_id, 'qq')] = self.qq_quantiles(conn, plant_id)
+
+        # The fleet correlation merges every plant's moments, the ones just updated and the ones stored before
+        for plant_id, payload in self.stored(conn, 'moments').items():
+            moments.setdefault(plant_id, self.decode_moments(payload))
+        fleet = empty_moments()
+        for plant_moments in moments.values():
+            fleet = merge_moments(fleet, plant_moments)
+        results[(FLEET, 'correlation')] = {'sensors': SENSORS, 'matrix': correlation(fleet)}
+        results[(FLEET, 'qq')] = self.qq_quantiles(conn, None)
+
+        rows = []
+        computed_at = int(time.time() * 1000)
+        for (plant_id, kind), payload in results.items():
+            rows.append((plant_id, kind, watermark, computed_at, json.dumps(payload)))
+        # Fleet watermark is what the next run starts from
+        rows.append((FLEET, 'watermark', watermark, computed_at, 'null'))
+        with conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO analytics (plant_id, kind, watermark, computed_at, payload)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+        return plant_ids
+
+    def stored_watermark(self, conn):
+        row = conn.execute(
+            "SELECT watermark FROM analytics WHERE plant_id = ? AND kind = 'watermark'", (FLEET,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def stored(self, conn, kind):
+        """ {plant_id: payload} of what the last run stored for kind """
+        return {
+            plant_id: json.loads(payload)
+            for plant_id, payload in conn.execute('SELECT plant_id, payload FROM analytics WHERE kind = ?', (kind,))
+        }
+
+    def encode_moments(self, moments):
+        n, mean, m2 = moments
+        return {'count': int(n), 'mean': mean.tolist(), 'm2': m2.tolist()}
+
+    def decode_moments(self, payload):
+        return payload['count'], np.array(payload['mean']), np.array(payload['m2'])
+
+    def update_moments(self, conn, plant_id, watermark):
+        """ The plant's stored moments plus only its rows past the watermark they were computed at """
+        row = conn.execute(
+            "SELECT watermark, payload FROM analytics WHERE plant_id = ? AND kind = 'moments'", (plant_id,)
+        ).fetchone()
+        previous, moments = (row[0], self.decode_moments(json.loads(row[1]))) if row else (0, empty_moments())
+        cursor = conn.execute(f'''
+            SELECT {', '.join(SENSORS)} FROM sensor_data
+            WHERE plant_id = ? AND id > ? AND id <= ?
+        ''', (plant_id, previous, watermark))
+        while True:
+            chunk = cursor.fetchmany(self.chunk_size)
+            if not chunk:
+                break
+            values = np.array(chunk, dtype=np.float64)
+            values = values[~np.isnan(values).any(axis=1)]
+            moments = merge_moments(moments, chunk_moments(values))
+        return moments
+
+    def qq_quantiles(self, conn, plant_id):
+        """
+        Quantiles at QQ_PROBABILITIES plus mean and std for the normal reference, per sensor. They come from
+        the t-digests kept at ingest, merged across plants for the fleet, never from the raw readings.
+        """
+        qq = {}
+        for sensor in SENSORS:
+            if plant_id is None:
+                sketch = fleet_sketch(conn, sensor)
+            else:
+                sketch = load_sketch(conn, plant_id, sensor)
+            if not sketch.count:
+                continue
+            qq[sensor] = {
+                'probabilities': QQ_PROBABILITIES.tolist(),
+                'quantiles': sketch.quantile(QQ_PROBABILITIES).tolist(),
+                'mean': float(sketch.mean),
+                'std': sketch.std,
+                'count': int(sketch.count)
+            }
+        return qq
+
+
+if __name__ == "__main__":
+    job = AnalyticsJob()
+    try:
+        job.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        job.close()
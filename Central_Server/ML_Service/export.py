@@ -0,0 +1,132 @@
+'''
+Convert trained models into the .npz format npz_model.py serves, so the MQTT server never imports the
+framework a model was trained with. Handles OnlineLogisticModel, scikit-learn linear models, MLPs, decision
+trees and random forests (optionally behind a StandardScaler in a Pipeline) and Keras Sequential models
+made of Dense layers. Models are inspected by their attributes, nothing here imports those frameworks.
+Run from Central_Server to convert registry pickles: python -m ML_Service.export models/plant_101.pkl
+'''
+import argparse
+import os
+import pickle
+import numpy as np
+from npz_model import save_npz
+
+
+def export_model(model, path, features, outputs):
+    """
+    Write model as .npz.
+    :param model: trained model, see the module docstring for what is supported
+    :param path: .npz file to write
+    :param features: input names in column order
+    :param outputs: what each predicted column means
+    :return: path
+    """
+    mean, scale = None, None
+    if hasattr(model, 'steps'):
+        # scikit-learn Pipeline, only a scaler in front of the estimator is supported
+        if len(model.steps) > 2 or (len(model.steps) == 2 and not hasattr(model.steps[0][1], 'scale_')):
+            raise ValueError("Only a StandardScaler followed by the model can be exported from a Pipeline")
+        if len(model.steps) == 2:
+            scaler = model.steps[0][1]
+            mean = getattr(scaler, 'mean_', None)
+            scale = scaler.scale_
+        model = model.steps[-1][1]
+    arrays = {}
+    if mean is not None:
+        arrays['mean'] = mean
+    if scale is not None:
+        arrays['scale'] = scale
+
+    if hasattr(model, 'm2') and hasattr(model, 'weights'):
+        # OnlineLogisticModel standardizes itself
+        kind = 'linear'
+        arrays.update(mean=model.mean, scale=model.scale, weights=model.weights[:, None],
+                      bias=np.array([model.bias]), link='logistic')
+    elif hasattr(model, 'coefs_'):
+        kind = 'mlp'
+        activations = [model.activation] * (len(model.coefs_) - 1) + [model.out_activation_]
+        for i, (W, b) in enumerate(zip(model.coefs_, model.intercepts_)):
+            arrays[f'W{i}'], arrays[f'b{i}'] = W, b
+        arrays.update(n_layers=len(model.coefs_), activations=np.array(activations, dtype=str))
+    elif hasattr(model, 'coef_'):
+        kind = 'linear'
+        coef = np.atleast_2d(model.coef_)
+        if not hasattr(model, 'classes_'):
+            link = 'identity'
+        else:
+            link = 'logistic' if coef.shape[0] == 1 else 'softmax'
+        arrays.update(weights=coef.T, bias=np.atleast_1d(model.intercept_), link=link)
+    elif hasattr(model, 'tree_') or hasattr(model, 'estimators_'):
+        kind = 'trees'
+        if mean is not None:
+            raise ValueError("Trees split on raw values, export them without a scaler")
+        trees = [model] if hasattr(model, 'tree_') else list(model.estimators_)
+        if not all(hasattr(tree, 'tree_') for tree in trees):
+            raise ValueError("Only single trees and forests of trees can be exported")
+        arrays.update(_flatten_trees([tree.tree_ for tree in trees], hasattr(model, 'classes_')))
+    elif hasattr(model, 'layers'):
+        kind = 'mlp'
+        layers = [layer for layer in model.layers if layer.get_weights()]
+        for i, layer in enumerate(layers):
+            weights = layer.get_weights()
+            if len(weights) != 2:
+                raise ValueError(f"Only Dense layers can be exported, not {layer.name}")
+            arrays[f'W{i}'], arrays[f'b{i}'] = weights
+        activations = [layer.get_config().get('activation', 'linear') for layer in layers]
+        arrays.update(n_layers=len(layers), activations=np.array(activations, dtype=str))
+    else:
+        raise ValueError(f"Don't know how to export {type(model).__name__}")
+    return save_npz(path, kind, features, outputs, **arrays)
+
+
+def _flatten_trees(trees, classifier):
+    """
+    Concatenate scikit-learn tree_ arrays into one set of node arrays, child indices offset to match.
+    Classifier leaves hold the probability of the last class, regressor leaves their value. Where NaN goes
+    comes from missing_go_to_left on scikit-learn versions that have it.
+    """
+    left, right, feature, threshold, value, missing_left, roots = [], [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        n = len(tree.children_left)
+        roots.append(offset)
+        left.append(np.where(tree.children_left >= 0, tree.children_left + offset, -1))
+        right.append(np.where(tree.children_right >= 0, tree.children_right + offset, -1))
+        feature.append(tree.feature)
+        threshold.append(tree.threshold)
+        counts = np.asarray(tree.value, dtype=np.float64)
+        if classifier:
+            total = counts.sum(axis=2)
+            # A node without samples gets 0 instead of a division by zero
+            counts = np.divide(counts[:, :, -1], total, out=np.zeros_like(total), where=total > 0)
+        else:
+            counts = counts[:, :, 0]
+        value.append(counts)
+        missing = getattr(tree, 'missing_go_to_left', None)
+        missing_left.append(np.zeros(n, dtype=bool) if missing is None else np.asarray(missing, dtype=bool))
+        offset += n
+    return {
+        'roots': np.array(roots), 'left': np.concatenate(left), 'right': np.concatenate(right),
+        'feature': np.concatenate(feature), 'threshold': np.concatenate(threshold), 'value': np.concatenate(value),
+        'missing_left': np.concatenate(missing_left)
+    }
+
+
+def export_artifact(pkl_path):
+    """ Convert a pickled registry model (see MLInference.ModelRegistry.save) to the .npz next to it """
+    with open(pkl_path, 'rb') as f:
+        artifact = pickle.load(f)
+    return export_model(artifact['model'], os.path.splitext(pkl_path)[0] + '.npz',
+                        artifact['features'], artifact['outputs'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert registry .pkl models to .npz for inference')
+    parser.add_argument('paths', nargs='+', help='plant_<id>.pkl / type_<plant_type>.pkl files')
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        print(f"Exported {export_artifact(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+'''
+Per plant ML features kept up to date as readings are stored, so predicting never runs window queries against
+sensor_data. Every feature is a small piece of state updated in O(1) per reading by FeatureState.update, the
+same code replay() runs over the stored history for training, so training and serving can't disagree.
+Bump FEATURE_VERSION whenever a definition changes, stored states of another version are rebuilt.
+'''
+import json
+import math
+import sqlite3
+import threading
+from timestamps import from_epoch_ms, to_epoch_ms
+
+FEATURE_VERSION = 1
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# In the order models get them
+FEATURES = SENSORS + (
+    'moisture_ewma',            # moisture smoothed with an EWMA_HOURS time constant
+    'moisture_slope_1h',        # moisture change per hour, exponentially weighted over about an hour
+    'moisture_slope_6h',        # same over about six hours
+    'degree_hours',             # hours x degrees above BASE_TEMPERATURE since local midnight
+    'light_integral',           # hours x light level since local midnight
+    'hours_since_watering',     # since the last watering_events row, NaN if never watered
+)
+
+EWMA_HOURS = 0.5
+SLOPE_HOURS = (1.0, 6.0)
+BASE_TEMPERATURE = 10.0
+# A node that was offline isn't assumed to have kept its last reading for longer than this
+MAX_GAP_HOURS = 1.0
+# History replayed to build the state of a plant seen for the first time, long enough for the
+# EWMA and slopes to forget where they started
+WARMUP_HOURS = 48
+
+UPSERT_SQL = 'INSERT OR REPLACE INTO plant_features (plant_id, version, timestamp, state) VALUES (?, ?, ?, ?)'
+
+
+def create_feature_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS plant_features (
+            plant_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            state TEXT NOT NULL
+        )
+    ''')
+
+
+class FeatureState:
+    """ Feature state of one plant """
+    def __init__(self):
+        self.timestamp = None
+        self.last = {sensor: None for sensor in SENSORS}
+        self.ewma = None
+        # Exponentially decayed least squares sums per slope horizon, times in hours relative to the last reading
+        self.slopes = [[0.0] * 5 for _ in SLOPE_HOURS]
+        self.day = None
+        self.degree_hours = 0.0
+        self.light_integral = 0.0
+        self.last_watering = None
+
+    def update(self, timestamp, reading):
+        """
+        Add one reading, O(1).
+        :param timestamp: epoch milliseconds
+        :param reading: sensor reading dict
+        :return: False if it was older than the last reading and ignored
+        """
+        if self.timestamp is not None and timestamp < self.timestamp:
+            return False
+        day = from_epoch_ms(timestamp).date().isoformat()
+        hours = 0.0 if self.timestamp is None else (timestamp - self.timestamp) / 3600000.0
+        moisture = reading.get('moisture')
+
+        # Daily integrals use the previous reading for the time since it, capped for gaps
+        if day != self.day:
+            self.day, self.degree_hours, self.light_integral = day, 0.0, 0.0
+        else:
+            held = min(hours, MAX_GAP_HOURS)
+            if self.last['temperature'] is not None:
+                self.degree_hours += max(self.last['temperature'] - BASE_TEMPERATURE, 0.0) * held
+            if self.last['light_level'] is not None:
+                self.light_integral += self.last['light_level'] * held
+
+        if moisture is not None:
+            if self.ewma is None:
+                self.ewma = moisture
+            else:
+                self.ewma += (1 - math.exp(-hours / EWMA_HOURS)) * (moisture - self.ewma)
+            for sums, horizon in zip(self.slopes, SLOPE_HOURS):
+                decay_sums(sums, hours, horizon)
+                # The new point sits at t = 0
+                sums[0] += 1.0
+                sums[2] += moisture
+        else:
+            for sums, horizon in zip(self.slopes, SLOPE_HOURS):
+                decay_sums(sums, hours, horizon)
+
+        for sensor in SENSORS:
+            if reading.get(sensor) is not None:
+                self.last[sensor] = reading[sensor]
+        self.timestamp = timestamp
+        return True
+
+    def water(self, timestamp):
+        """ Record a watering at epoch milliseconds """
+        if self.last_watering is None or timestamp > self.last_watering:
+            self.last_watering = timestamp
+
+    def features(self):
+        """ Current values, in FEATURES order as a dict. Anything not known yet is NaN """
+        values = {sensor: nan_if_none(self.last[sensor]) for sensor in SENSORS}
+        values['moisture_ewma'] = nan_if_none(self.ewma)
+        for sums, horizon in zip(self.slopes, SLOPE_HOURS):
+            values[f'moisture_slope_{int(horizon)}h'] = slope(sums)
+        values['degree_hours'] = self.degree_hours
+        values['light_integral'] = self.light_integral
+        if self.last_watering is None or self.timestamp is None:
+            values['hours_since_watering'] = math.nan
+        else:
+            values['hours_since_watering'] = max(self.timestamp - self.last_watering, 0) / 3600000.0
+        return values
+
+    def copy(self):
+        return FeatureState.from_json(self.to_json())
+
+    def to_json(self):
+        return json.dumps({
+            'timestamp': self.timestamp, 'last': self.last, 'ewma': self.ewma, 'slopes': self.slopes,
+            'day': self.day, 'degree_hours': self.degree_hours, 'light_integral': self.light_integral,
+            'last_watering': self.last_watering
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        state = cls()
+        state.timestamp, state.last, state.ewma, state.slopes = data['timestamp'], data['last'], data['ewma'], data['slopes']
+        state.day, state.degree_hours, state.light_integral = data['day'], data['degree_hours'], data['light_integral']
+        state.last_watering = data['last_watering']
+        return state
+
+
+def decay_sums(sums, hours, horizon):
+    """
+    Move the origin of the weighted sums (weight, t, y, t^2, t*y) forward by hours and decay the weights,
+    so old points count less without keeping them.
+    """
+    if not hours:
+        return
+    decay = math.exp(-hours / horizon)
+    weight, t, y, tt, ty = sums
+    sums[0] = decay * weight
+    sums[1] = decay * (t - hours * weight)
+    sums[2] = decay * y
+    sums[3] = decay * (tt - 2 * hours * t + hours * hours * weight)
+    sums[4] = decay * (ty - hours * y)
+
+
+def slope(sums):
+    weight, t, y, tt, ty = sums
+    spread = weight * tt - t * t
+    # Fewer than two points (or all at the same time) have no slope
+    if weight <= 0 or spread <= 1e-12 * max(weight * tt, 1e-12):
+        return math.nan
+    return (weight * ty - t * y) / spread
+
+
+def nan_if_none(value):
+    return math.nan if value is None else float(value)
+
+
+def watering_times(cursor, plant_id=None):
+    """
+    Epoch ms of watering events, oldest first, [] if watering_events doesn't exist (yet)
+    :return: list of (plant_id, epoch ms)
+    """
+    where, params = ('WHERE plant_id = ?', (str(plant_id),)) if plant_id is not None else ('', ())
+    try:
+        rows = cursor.execute(
+            f'SELECT plant_id, timestamp FROM watering_events {where} ORDER BY timestamp', params
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        # watering_events belongs to MLDataBaseHandler, it may not have created it here
+        if 'no such table' not in str(e):
+            raise
+        return []
+    return [(str(row_plant_id), to_epoch_ms(timestamp)) for row_plant_id, timestamp in rows if timestamp]
+
+
+def replay(readings, waterings=()):
+    """
+    Feature rows for stored history, the same updates the ingest path makes. Used for training.
+    :param readings: iterable of (plant_id, moisture, temperature, humidity, light_level, epoch ms) in time order
+    :param waterings: (plant_id, epoch ms) pairs in time order, see watering_times
+    :return: generator of (plant_id, epoch ms, feature dict)
+    """
+    states = {}
+    waterings = list(waterings)
+    next_watering = 0
+    for plant_id, moisture, temperature, humidity, light_level, timestamp in readings:
+        # Waterings up to this reading count, like they would have at ingest
+        while next_watering < len(waterings) and waterings[next_watering][1] <= timestamp:
+            watered_plant, watered_at = waterings[next_watering]
+            states.setdefault(watered_plant, FeatureState()).water(watered_at)
+            next_watering += 1
+        state = states.setdefault(str(plant_id), FeatureState())
+        reading = dict(zip(SENSORS, (moisture, temperature, humidity, light_level)))
+        if state.update(timestamp, reading):
+            yield str(plant_id), timestamp, state.features()
+
+
+class FeatureStore:
+    """
+    In-memory feature states updated by the ingest path the same way as SketchStore and DriftEngine:
+    update() once a batch committed, checkpoint() writes them to plant_features.
+    """
+    def __init__(self):
+        self._states = {}
+        # Plants changed since the last checkpoint
+        self._dirty = set()
+        # Ingest updates states in place while inference reads them from the workers
+        self._lock = threading.Lock()
+
+    def load_state(self, cursor, plant_id, before):
+        """
+        The plant's stored state caught up on the readings stored after it was checkpointed, or one rebuilt
+        from its last WARMUP_HOURS of readings when there is none or it was stored by another FEATURE_VERSION.
+        :param before: epoch ms of the first reading about to be added, readings from then on are left out
+        """
+        row = cursor.execute('SELECT version, state FROM plant_features WHERE plant_id = ?', (plant_id,)).fetchone()
+        if row and row[0] == FEATURE_VERSION:
+            state = FeatureState.from_json(row[1])
+            start = state.timestamp + 1 if state.timestamp is not None else before - int(WARMUP_HOURS * 3600000)
+        else:
+            state = FeatureState()
+            start = before - int(WARMUP_HOURS * 3600000)
+        history = cursor.execute(f'''
+            SELECT {', '.join(SENSORS)}, timestamp FROM sensor_data
+            WHERE plant_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp
+        ''', (plant_id, start, before)).fetchall()
+        waterings = watering_times(cursor, plant_id)
+        next_watering = 0
+        for *values, timestamp in history:
+            while next_watering < len(waterings) and waterings[next_watering][1] <= timestamp:
+                state.water(waterings[next_watering][1])
+                next_watering += 1
+            state.update(timestamp, dict(zip(SENSORS, values)))
+        if waterings:
+            state.water(waterings[-1][1])
+        return state
+
+    def update(self, cursor, readings):
+        """
+        Add readings to their plants' states, in memory only.
+        :param readings: rows shaped like the sensor_data insert, timestamps in epoch ms
+        """
+        readings = sorted(readings, key=lambda row: row[5])
+        # Oldest reading of each plant in the batch, the first one seen in time order
+        first = {}
+        for row in readings:
+            first.setdefault(row[0], row[5])
+        loaded = {}
+        for plant_id, timestamp in first.items():
+            if plant_id not in self._states:
+                # Readings of this batch are already inserted, warm up from what came before them
+                loaded[plant_id] = self.load_state(cursor, plant_id, timestamp)
+        with self._lock:
+            for plant_id, state in loaded.items():
+                self._states.setdefault(plant_id, state)
+            for row in readings:
+                self._states[row[0]].update(row[5], dict(zip(SENSORS, row[1:5])))
+            self._dirty.update(first)
+
+    def checkpoint(self, cursor):
+        """ Write the states changed since the last checkpoint """
+        with self._lock:
+            rows = [
+                (plant_id, FEATURE_VERSION, self._states[plant_id].timestamp, self._states[plant_id].to_json())
+                for plant_id in self._dirty
+            ]
+            self._dirty.clear()
+        cursor.executemany(UPSERT_SQL, rows)
+
+    def record_watering(self, plant_id, timestamp):
+        """
+        A watering event was stored for the plant, picked up by hours_since_watering from its next reading.
+        :param timestamp: datetime (local time) or epoch milliseconds
+        """
+        with self._lock:
+            state = self._states.get(str(plant_id))
+            if state is not None:
+                state.water(to_epoch_ms(timestamp))
+
+    def current(self, plant_id, reading=None, timestamp=None):
+        """
+        The plant's features as of its newest stored reading, None if it hasn't been seen since startup.
+        :param reading: a reading accepted but maybe not stored yet (buffered writes). Its features are computed
+        on a copy of the state, the same update ingest will make, so serving sees what training replays.
+        :param timestamp: the reading's datetime (local time) or epoch milliseconds
+        """
+        with self._lock:
+            state = self._states.get(str(plant_id))
+            if state is None:
+                return None
+            if reading is None or timestamp is None:
+                return state.features()
+            timestamp = to_epoch_ms(timestamp)
+            if state.timestamp is not None and timestamp <= state.timestamp:
+                # Already stored, or too old to change anything
+                return state.features()
+            state = state.copy()
+        state.update(timestamp, reading)
+        return state.features()
@@ -1,13 +1,19 @@
-import sqlite3
 from datetime import datetime
+from db_connection import get_pool
 
 class MLDataBaseHandler:
     def __init__(self, db_name = 'plant_data.db'):
         self.db_name = db_name
+        # Same pool as DataBaseHandler when both point at plant_data.db
+        self.pool = get_pool(db_name)
         self.init_db()
 
+    def close(self):
+        """ Close the pooled connections for this database, call on shutdown """
+        self.pool.close()
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_name)
+        conn = self.pool.connection()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -49,11 +55,10 @@ class MLDataBaseHandler:
 
 
         conn.commit()
-        conn.close()
         # Add this line to call the init_default_settings method
 
     def store_watering_feedback(self, plant_id, data):
-        conn = sqlite3.connect(self.db_name)
+        conn = self.pool.connection()
         cursor = conn.cursor()
  # TODO - Create db table for storing these values. possibly "watering_feedback.db"
  #        cursor.execute('''
@@ -68,41 +73,37 @@ class MLDataBaseHandler:
  #            data['user_notes']
  #        ))
         conn.commit()
-        conn.close()
 
     def store_watering_prediction(self, plant_id, predicted_moisture_threshold, predicted_duration, predicted_time):
-        conn = sqlite3.connect(self.db_name)
+        conn = self.pool.connection()
         cursor = conn.cursor()
 
     def store_watering_event_initial(self, plant_id, moisture_before, watering_duration):
-        conn = sqlite3.connect(self.db_name)
+        conn = self.pool.connection()
         cursor = conn.cursor()
         #TODO add the insert of prediction_id when that becomes available.
-        cursor.execute('''
-                    INSERT INTO watering_events
-                    (plant_id, watering_duration, moisture_before, timestamp)
-                    VALUES (?, ?, ?, ?)
-                ''', (
-            plant_id,
-            watering_duration,
-            moisture_before,
-            datetime.now()
-        ))
+        with conn:
+            cursor.execute('''
+                        INSERT INTO watering_events
+                        (plant_id, watering_duration, moisture_before, timestamp)
+                        VALUES (?, ?, ?, ?)
+                    ''', (
+                plant_id,
+                watering_duration,
+                moisture_before,
+                datetime.now()
+            ))
         #Save the event to store moisture after
         event_id = cursor.lastrowid
-
-        conn.commit()
-        conn.close()
         return event_id
 
     def store_watering_event_final(self, event_id, moisture_after):
-        conn = sqlite3.connect(self.db_name)
+        conn = self.pool.connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            UPDATE watering_events
-            SET moisture_after = ?
-            WHERE id = ?
-        ''', (moisture_after, event_id))
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor.execute('''
+                UPDATE watering_events
+                SET moisture_after = ?
+                WHERE id = ?
+            ''', (moisture_after, event_id))
@@ -0,0 +1,98 @@
+'''
+Small logistic regression trained a chunk at a time with partial_fit, so training never needs more than one
+chunk of the history in memory. Pure NumPy, it runs the same on the Pi as anywhere else.
+'''
+import numpy as np
+
+
+class OnlineLogisticModel:
+    """
+    Features are standardized with running mean/variance kept from every chunk seen, missing values (NaN)
+    become the running mean. Trained with mini-batch gradient descent on the log loss, positives are weighted
+    by the running negative/positive ratio since events like waterings are rare.
+    """
+    def __init__(self, n_features, learning_rate=0.05, l2=1e-4, batch_size=256):
+        """
+        :param n_features: Number of input columns
+        :param learning_rate: Step size of each mini-batch update
+        :param l2: Weight decay
+        :param batch_size: Rows per gradient step
+        """
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.batch_size = batch_size
+        self.weights = np.zeros(n_features)
+        self.bias = 0.0
+        # Rows trained on, and per feature how many of them weren't NaN
+        self.count = 0
+        self.counts = np.zeros(n_features)
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.positives = 0
+        self.negatives = 0
+
+    @property
+    def scale(self):
+        """ Standard deviation of each feature, 1 where it never varied """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2 / (self.counts - 1))
+        return np.where(std > 0, std, 1.0)
+
+    def _update_moments(self, X):
+        # Chan et al. per column, NaNs left out
+        present = ~np.isnan(X)
+        n = present.sum(axis=0)
+        total = self.counts + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, np.where(present, X, 0.0).sum(axis=0) / n, 0.0)
+            delta = mean - self.mean
+            share = np.where(total > 0, n / total, 0.0)
+        m2 = (np.where(present, X - mean, 0.0) ** 2).sum(axis=0)
+        self.mean = self.mean + delta * share
+        self.m2 = self.m2 + m2 + delta * delta * self.counts * share
+        self.counts = total
+        self.count += len(X)
+
+    def transform(self, X):
+        """ Standardized features, NaN as 0 (the running mean) """
+        Z = (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+        return np.where(np.isnan(Z), 0.0, Z)
+
+    def partial_fit(self, X, y):
+        """
+        Train on one chunk.
+        :param X: (rows, n_features) features
+        :param y: (rows,) 0/1 labels
+        :return: mean log loss of the chunk before it was trained on (progressive validation)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if not len(X):
+            return float('nan')
+        loss = self.log_loss(X, y) if self.count else float('nan')
+        self._update_moments(X)
+        self.positives += int(y.sum())
+        self.negatives += int(len(y) - y.sum())
+        positive_weight = self.negatives / self.positives if self.positives else 1.0
+
+        Z = self.transform(X)
+        for start in range(0, len(Z), self.batch_size):
+            z, target = Z[start:start + self.batch_size], y[start:start + self.batch_size]
+            weight = np.where(target > 0, positive_weight, 1.0)
+            error = (self._sigmoid(z @ self.weights + self.bias) - target) * weight
+            self.weights -= self.learning_rate * (z.T @ error / weight.sum() + self.l2 * self.weights)
+            self.bias -= self.learning_rate * error.sum() / weight.sum()
+        return loss
+
+    def predict_proba(self, X):
+        """ (rows, 2) probabilities of class 0 and 1, scikit-learn style """
+        p = self._sigmoid(self.transform(X) @ self.weights + self.bias)
+        return np.column_stack([1 - p, p])
+
+    def log_loss(self, X, y):
+        p = np.clip(self.predict_proba(X)[:, 1], 1e-12, 1 - 1e-12)
+        return float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
+
+    @staticmethod
+    def _sigmoid(x):
+        return 1.0 / (1.0 + np.exp(-np.clip(x, -500, 500)))
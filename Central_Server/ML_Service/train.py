@@ -0,0 +1,121 @@
+'''
+Offline training over the sqlite history. Readings are streamed plant by plant in chunk_size rows (cursor
+fetchmany), turned into features by the same feature_store replay the ingest path uses, labeled from
+watering_events and fed to the model's partial_fit a chunk at a time, so memory stays at about one chunk
+however many years of history there are. The result is written to the MLInference model registry, as a .pkl to
+keep training from and the .npz export the server loads.
+Run from Central_Server: python -m ML_Service.train --plant 101
+'''
+import argparse
+import bisect
+import os
+import sqlite3
+import numpy as np
+from MLInference import ModelRegistry, MODEL_DIR
+from ML_Service.export import export_model
+from ML_Service.feature_store import FEATURES, SENSORS, replay, watering_times
+from ML_Service.online_model import OnlineLogisticModel
+
+# A reading is labeled needs_water when the plant was watered within this many hours after it
+LABEL_HOURS = 1.0
+# Only watering is learned, PlantController keeps the rule based light decision for these models
+OUTPUTS = ('needs_water',)
+
+
+def stream_readings(conn, plant_id, chunk_size):
+    """ The plant's readings oldest first, fetched chunk_size rows at a time """
+    cursor = conn.execute(f'''
+        SELECT plant_id, {', '.join(SENSORS)}, timestamp FROM sensor_data
+        WHERE plant_id = ? ORDER BY timestamp
+    ''', (str(plant_id),))
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def dataset(conn, plant_ids, chunk_size=5000, label_hours=LABEL_HOURS):
+    """
+    (features, labels) chunks of at most chunk_size rows, features in FEATURES order.
+    A reading's label is 1 when a watering_events row for the plant follows it within label_hours.
+    """
+    horizon = int(label_hours * 3600000)
+    features, labels = [], []
+    for plant_id in plant_ids:
+        waterings = watering_times(conn.cursor(), plant_id)
+        watered_at = [timestamp for _, timestamp in waterings]
+        for _, timestamp, values in replay(stream_readings(conn, plant_id, chunk_size), waterings):
+            following = bisect.bisect_right(watered_at, timestamp)
+            labels.append(following < len(watered_at) and watered_at[following] - timestamp <= horizon)
+            features.append([values[name] for name in FEATURES])
+            if len(features) >= chunk_size:
+                yield np.array(features, dtype=np.float64), np.array(labels, dtype=np.float64)
+                features, labels = [], []
+    if features:
+        yield np.array(features, dtype=np.float64), np.array(labels, dtype=np.float64)
+
+
+def train(conn, plant_ids, epochs=1, chunk_size=5000, label_hours=LABEL_HOURS, model=None):
+    """
+    Train a model on the plants' history.
+    :param plant_ids: plants whose readings go into the one model
+    :param epochs: passes over the history, each streams it again
+    :param model: model to keep training, a new OnlineLogisticModel if None
+    :return: (model, summary dict with rows, positives and the last epoch's progressive log loss)
+    """
+    model = model or OnlineLogisticModel(len(FEATURES))
+    summary = {'rows': 0, 'positives': 0, 'log_loss': float('nan')}
+    for epoch in range(epochs):
+        rows, positives, loss_sum = 0, 0, 0.0
+        for X, y in dataset(conn, plant_ids, chunk_size, label_hours):
+            loss = model.partial_fit(X, y)
+            if not np.isnan(loss):
+                loss_sum += loss * len(X)
+            rows += len(X)
+            positives += int(y.sum())
+        summary = {'rows': rows, 'positives': positives, 'log_loss': loss_sum / rows if rows else float('nan')}
+        print(f"Epoch {epoch + 1}/{epochs}: {rows} readings, {positives} before a watering, "
+              f"log loss {summary['log_loss']:.4f}")
+    return model, summary
+
+
+def plants_of_type(conn, plant_type):
+    return [row[0] for row in conn.execute('SELECT plant_id FROM plant_settings WHERE plant_type = ?', (plant_type,))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train a watering model from the sqlite history')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--plant', help='Train plant_<id> on this plant')
+    target.add_argument('--plant-type', help='Train type_<plant_type> on every plant of this type')
+    parser.add_argument('--db', default='plant_data.db', help='Path to plant_data.db')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='Model registry directory MLInference reads')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Rows held in memory at a time')
+    parser.add_argument('--label-hours', type=float, default=LABEL_HOURS,
+                        help='A reading needs water when a watering followed within this many hours')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        plant_ids = [args.plant] if args.plant else plants_of_type(conn, args.plant_type)
+        if not plant_ids:
+            print(f"No plants of type {args.plant_type}")
+            return None
+        model, summary = train(conn, plant_ids, args.epochs, args.chunk_size, args.label_hours)
+    finally:
+        conn.close()
+    if not summary['rows']:
+        print("No readings to train on")
+        return None
+    path = ModelRegistry(args.model_dir).save(
+        model, plant_id=args.plant, plant_type=args.plant_type, features=FEATURES, outputs=OUTPUTS
+    )
+    npz_path = export_model(model, os.path.splitext(path)[0] + '.npz', FEATURES, OUTPUTS)
+    print(f"Saved {path} and {npz_path}")
+    return path
+
+
+if __name__ == "__main__":
+    main()
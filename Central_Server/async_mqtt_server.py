@@ -0,0 +1,181 @@
+# Asyncio version of the Mosquitto server
+'''
+Same job as mqtt_server.MQTTServer but everything network side runs as coroutines on one event loop,
+paho's socket is driven by the loop instead of loop_forever's thread. Only the sqlite work goes to a
+small thread pool, so thousands of plants don't need thousands of threads.
+'''
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import paho.mqtt.client as mqtt
+from mqtt_server import MQTTServer
+
+
+class AsyncioPahoAdapter:
+    """
+    Hooks paho's socket callbacks into an asyncio loop (add_reader/add_writer) so the client
+    never needs its own network thread. Based on paho's loop_asyncio example.
+    """
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc_task = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.misc_task:
+            self.misc_task.cancel()
+            self.misc_task = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def misc_loop(self):
+        # Keepalive pings and retries, what loop_forever would do between reads
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+
+class AsyncMQTTServer(MQTTServer):
+    def __init__(self, buffered_writes=False, db_threads=4, max_in_flight=256, reconnect_delay=5):
+        """
+        :param buffered_writes: Group sensor readings into batched writes (see SensorWriteBuffer)
+        :param db_threads: Threads running the blocking sqlite calls
+        :param max_in_flight: Most readings being stored/decided at once, the rest wait on the loop
+        :param reconnect_delay: Seconds between reconnect attempts after losing the broker
+        """
+        super().__init__(buffered_writes=buffered_writes, workers=0)
+        self.executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix="sqlite")
+        self.max_in_flight = max_in_flight
+        self.reconnect_delay = reconnect_delay
+        self.loop = None
+        self._in_flight = None
+        self._stopping = None
+        # One lock per plant with messages in progress, it keeps each plant's readings in order
+        self._plant_locks = {}
+        self._tasks = set()
+
+    def start(self):
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            pass
+
+    async def run(self, host="localhost", port=1883, keepalive=60):
+        """ Connect and serve until shutdown() is called """
+        self.loop = asyncio.get_running_loop()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._stopping = asyncio.Event()
+        AsyncioPahoAdapter(self.loop, self.client)
+        self.client.on_disconnect = self.on_disconnect
+        try:
+            await self.connect(host, port, keepalive)
+            await self._stopping.wait()
+        finally:
+            self.client.disconnect()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            self.executor.shutdown(wait=True)
+            self.stop()
+
+    def shutdown(self):
+        """ Ask run() to finish, safe to call from any thread """
+        if self.loop and self._stopping:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+
+    async def connect(self, host, port, keepalive):
+        while not self._stopping.is_set():
+            try:
+                self.client.connect(host, port, keepalive)
+                return
+            except Exception as e:
+                print(f"Failed to connect MQTT server {e}, retrying in {self.reconnect_delay}s")
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def reconnect(self):
+        while not self._stopping.is_set():
+            try:
+                self.client.reconnect()
+                return
+            except Exception as e:
+                print(f"Failed to reconnect MQTT server {e}")
+                await asyncio.sleep(self.reconnect_delay)
+
+    def on_disconnect(self, client, userdata, rc):
+        print(f"Disconnected with result code {rc}")
+        if rc != 0 and not self._stopping.is_set():
+            self._track(self.loop.create_task(self.reconnect()))
+
+    def on_message(self, client, userdata, msg):
+        # Called from loop_read on the event loop, so just schedule the coroutines.
+        # One per plant in the message, so a gateway batch waits on each of its plants' locks in arrival order.
+        for plant_id, payload in self.split_message(msg):
+            self._track(self.loop.create_task(self.dispatch(plant_id, payload)))
+
+    async def dispatch(self, plant_id, payload):
+        """
+        Process one plant's part of a sensor message: store and decide in the executor, then publish the decisions.
+        :param plant_id: plant the payload is for (see MQTTServer.split_message)
+        :param payload: reading dict or list of reading dicts
+        """
+        try:
+            # A list is a batch of buffered readings (or a binary payload), see MQTTServer.handle_batch
+            if isinstance(payload, list):
+                handle, publish = self.handle_batch, self.publish_batch
+            else:
+                if not self.validate_sensor_data(payload):
+                    print(f"Invalid sensor data for plant id {plant_id}")
+                    return
+                handle, publish = self.handle_reading, self.publish
+            # Tasks reach this point in the order messages arrived and the lock is FIFO,
+            # so the watering_state before/after pairing sees each plant's readings in order.
+            lock = self._plant_locks.setdefault(plant_id, [asyncio.Lock(), 0])
+            lock[1] += 1
+            try:
+                async with lock[0]:
+                    async with self._in_flight:
+                        automation_decisions = await self.loop.run_in_executor(
+                            self.executor, handle, plant_id, payload
+                        )
+                    if automation_decisions:
+                        await publish(plant_id, automation_decisions)
+            finally:
+                lock[1] -= 1
+                if lock[1] == 0:
+                    # Don't keep a lock around for every plant we have ever heard from
+                    del self._plant_locks[plant_id]
+        except Exception as e:
+            print(f"Error processing message: {e}")
+
+    async def publish(self, plant_id, automation_decisions):
+        """ Publish decisions on the plant's control topic, paho only queues it and the loop writes it out """
+        control_topic = self.CONTROL_TOPIC.format(plant_id)
+        self.client.publish(control_topic, self.encode_control(plant_id, automation_decisions))
+
+    async def publish_batch(self, plant_id, results):
+        """ Publish the (plant_id, decisions) pairs handle_batch returned, each on its own plant's topic """
+        for batch_plant_id, automation_decisions in results:
+            await self.publish(batch_plant_id, automation_decisions)
+
+    def _track(self, task):
+        # Keep a reference until the task is done, asyncio only holds weak ones
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+if __name__ == "__main__":
+    server = AsyncMQTTServer(buffered_writes=True)
+    server.start()
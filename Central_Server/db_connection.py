@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import threading
+
+# Every handler pointing at the same database file shares one pool, so the MQTT server's
+# DataBaseHandler and MLDataBaseHandler end up reusing the same connections.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived sqlite connection per thread for a database file instead of
+    connecting/closing on every query. sqlite connections should not be shared between threads
+    while in use, so each thread gets its own, and the pool remembers all of them so they can be
+    closed together on shutdown.
+    """
+    def __init__(self, db_name, cached_statements=256, timeout=30.0):
+        """
+        :param db_name: Path to the sqlite database file
+        :param cached_statements: Size of sqlite3's per connection prepared statement cache
+        :param timeout: Seconds to wait on a locked database before giving up
+        """
+        self.db_name = db_name
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """
+        Returns this thread's connection, opening it the first time the thread asks.
+        Use it as a context manager (with conn:) to commit or roll back a group of statements.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        # check_same_thread is off only so close() can run from the shutdown thread,
+        # a connection is still only ever used by the thread that opened it.
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        # WAL lets the dashboard read while the server writes, and with synchronous=NORMAL
+        # a commit no longer waits on an fsync (only checkpoints do).
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """ Close every connection the pool has handed out. The pool can still be used afterwards. """
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Failed to close database connection {e}")
+
+
+def get_pool(db_name):
+    """
+    Returns the shared pool for a database file, creating it on first use.
+    :param db_name: Path to the sqlite database file
+    :return: ConnectionPool
+    """
+    key = os.path.abspath(db_name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_name)
+            _pools[key] = pool
+        return pool
+
@@ -1,48 +1,73 @@
-import sqlite3
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
+from db_connection import get_pool
+from migrations import migrate
+from rollups import update_rollups, update_latest
+from seasonality import update_seasonality
+from timestamps import TIMESTAMP_FORMAT, to_epoch_ms
+from quantile_sketch import SketchStore
+from drift_engine import DriftEngine
+from ML_Service.feature_store import FeatureStore
+
 
 class DataBaseHandler:
-    def __init__(self, db_name = 'plant_data.db'):
+    def __init__(self, db_name = 'plant_data.db', settings_check_interval=1.0, retention_days=None,
+                 archive_db=None, prune_interval=3600, checkpoint_interval=60):
+        """
+        :param db_name: Path to the sqlite database file
+        :param settings_check_interval: How often (seconds) cached plant settings are checked against
+        settings_version, i.e. how long an edit made outside this handler (the dashboard) can take to show up.
+        :param retention_days: Raw sensor_data (and minute rollups) older than this is pruned, None keeps everything.
+        Hour and day rollups are always kept.
+        :param archive_db: Copy pruned rows into sensor_data in this database file before deleting them
+        :param prune_interval: Seconds between automatic prunes while storing readings
+        :param checkpoint_interval: Seconds between writes of the in-memory sketches, drift and feature state
+        (see checkpoint). A crash loses at most this long of their updates, sensor_data itself is never behind.
+        """
         self.db_name = db_name
+        self.retention_days = retention_days
+        self.archive_db = archive_db
+        self.prune_interval = prune_interval
+        self._pruned_at = time.monotonic()
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpointed_at = time.monotonic()
+        # Connections are long lived and shared with any other handler on the same db file
+        self.pool = get_pool(db_name)
+        # In-memory state updated at ingest, quantile sketches (quantile_sketch.py), drift (drift_engine.py)
+        # and ML features (ML_Service/feature_store.py)
+        self.sketches = SketchStore()
+        self.drift = DriftEngine()
+        self.features = FeatureStore()
+        # Held while that state is updated or checkpointed
+        self._ingest_lock = threading.Lock()
+        # plant settings cache, keyed by plant_id as text since that is how plant_settings stores it
+        self.settings_check_interval = settings_check_interval
+        self._settings_cache = {}
+        self._settings_generation = 0  # bumped on every clear so a read racing a clear doesn't cache stale settings
+        self._settings_version = None
+        self._settings_checked_at = 0.0
+        self._settings_lock = threading.Lock()
         self.init_db()
 
-    def init_db(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                plant_id TEXT,
-                moisture REAL,
-                temperature REAL,
-                humidity REAL,
-                light_level REAL,
-                timestamp DATETIME
-            )
-        ''')
+    def close(self):
+        """ Write out the in-memory ingest state and close the pooled connections for this database, call on shutdown """
+        try:
+            self.checkpoint()
+        except Exception as e:
+            print(f"Failed to checkpoint ingest state {e}")
+        self.pool.close()
 
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS plant_settings(
-        plant_id TEXT PRIMARY KEY,
-        moisture_threshold REAL,
-        light_threshold REAL,
-        watering_duration INTEGER,
-        lighting_duration INTEGER,
-        light_schedule_start TEXT,
-        light_schedule_end TEXT,
-        plant_type TEXT,
-        ml_enabled boolean
-        )
-    ''')
+    def init_db(self):
+        conn = self.pool.connection()
+        # Creates the tables on a new file and upgrades older plant_data.db files in place
+        migrate(conn)
 
-        conn.commit()
-        conn.close()
         # Add this line to call the init_default_settings method
         self.init_default_settings()
 
     def init_default_settings(self):
-        conn = sqlite3.connect(self.db_name)
+        conn = self.pool.connection()
         cursor = conn.cursor()
 
         #Create a default plant settings to consider case where its a new plant or no settings exist
@@ -72,7 +97,6 @@ class DataBaseHandler:
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', default_settings)
         conn.commit()
-        conn.close()
     def set_plant_settings(self, plant_id, plant_type='default', custom_settings=None):
         """
         This should be called to set the settings for a plant, by default it will start with generic settings.
@@ -83,7 +107,7 @@ class DataBaseHandler:
         That require custom settings)
         :return:
         """
-        conn = sqlite3.connect(self.db_name)
+        conn = self.pool.connection()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -118,57 +142,162 @@ class DataBaseHandler:
         if custom_settings:
             settings.update(custom_settings)
         #now we insert settings into the plant_settings table
-        cursor.execute('''
-            INSERT OR REPLACE INTO plant_settings
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            settings['plant_id'],
-            settings['moisture_threshold'],
-            settings['light_threshold'],
-            settings['watering_duration'],
-            settings['lighting_duration'],
-            settings['light_schedule_start'],
-            settings['light_schedule_end'],
-            settings['plant_type'],
-            settings['ml_enabled']
-        ))
-
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor.execute('''
+                INSERT OR REPLACE INTO plant_settings
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                settings['plant_id'],
+                settings['moisture_threshold'],
+                settings['light_threshold'],
+                settings['watering_duration'],
+                settings['lighting_duration'],
+                settings['light_schedule_start'],
+                settings['light_schedule_end'],
+                settings['plant_type'],
+                settings['ml_enabled']
+            ))
+        self.invalidate_settings_cache()
         return settings
 
-    def store_sensor_data(self, plant_id,data):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def store_sensor_data(self, plant_id,data, timestamp=None):
+        self.store_sensor_data_batch([(plant_id, data, timestamp or datetime.now())])
 
-        cursor.execute('''
-            INSERT INTO sensor_data
-            (plant_id, moisture, temperature, humidity, light_level,timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            plant_id,
+    def store_sensor_data_batch(self, readings):
+        """
+        Store many readings in one transaction (one commit instead of one per reading).
+        :param readings: list of (plant_id, data, timestamp) tuples, data being the sensor reading dict.
+        timestamp is a datetime (local time) or epoch milliseconds
+        :return:
+        """
+        conn = self.pool.connection()
+        cursor = conn.cursor()
+        rows = [(
+            str(plant_id),
             data['moisture'],
             data['temperature'],
             data['humidity'],
             data['light_level'],
-            datetime.now()
-        ))
-        conn.commit()
-        conn.close()
+            to_epoch_ms(timestamp)
+        ) for plant_id, data, timestamp in readings]
+
+        # with conn commits, or rolls back so a failed insert doesn't leave the shared connection mid transaction
+        with self._ingest_lock:
+            with conn:
+                cursor.executemany('''
+                    INSERT INTO sensor_data
+                    (plant_id, moisture, temperature, humidity, light_level,timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+                # Same transaction, so the rollups, latest readings and seasonality never disagree with sensor_data
+                update_rollups(cursor, rows)
+                update_latest(cursor, rows)
+                update_seasonality(cursor, rows)
+            # Only after the commit, a rolled back batch leaves the in-memory state as it was.
+            # Nothing is written here, checkpoint() does that every checkpoint_interval.
+            self.sketches.update(cursor, rows)
+            drift_alerts = self.drift.update(cursor, rows)
+            self.features.update(cursor, rows)
+        self.drift.notify(drift_alerts)
+
+        if time.monotonic() - self._checkpointed_at >= self.checkpoint_interval:
+            self.checkpoint()
+        if self.retention_days and time.monotonic() - self._pruned_at >= self.prune_interval:
+            self.prune_sensor_data()
+
+    def checkpoint(self):
+        """
+        Write the sketches, drift state and feature state changed since the last checkpoint in one transaction.
+        They are serialized whole (BLOBs and JSON), so doing it per batch would cost more than the insert.
+        """
+        conn = self.pool.connection()
+        cursor = conn.cursor()
+        with self._ingest_lock:
+            self._checkpointed_at = time.monotonic()
+            with conn:
+                self.sketches.checkpoint(cursor)
+                self.drift.checkpoint(cursor)
+                self.features.checkpoint(cursor)
+
+    def prune_sensor_data(self, retention_days=None):
+        """
+        Delete raw readings (and minute rollups) older than the retention window, copying them to
+        archive_db first if one is set. Hour and day rollups keep the history for the charts.
+        :param retention_days: Defaults to the handler's retention_days
+        :return: Number of sensor_data rows removed
+        """
+        retention_days = retention_days or self.retention_days
+        self._pruned_at = time.monotonic()
+        if not retention_days:
+            return 0
+        cutoff_time = datetime.now() - timedelta(days=retention_days)
+        cutoff = to_epoch_ms(cutoff_time)
+        conn = self.pool.connection()
+        cursor = conn.cursor()
+        # Deleting per plant lets each delete use the (plant_id, timestamp) index
+        cursor.execute("SELECT DISTINCT plant_id FROM sensor_rollups WHERE resolution = 'day'")
+        plant_ids = [row[0] for row in cursor.fetchall()]
+
+        if self.archive_db:
+            # ATTACH can't run inside a transaction
+            cursor.execute('ATTACH DATABASE ? AS archive', (self.archive_db,))
+        removed = 0
+        try:
+            with conn:
+                if self.archive_db:
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS archive.sensor_data (
+                            id INTEGER PRIMARY KEY,
+                            plant_id TEXT NOT NULL,
+                            moisture REAL,
+                            temperature REAL,
+                            humidity REAL,
+                            light_level REAL,
+                            timestamp INTEGER NOT NULL
+                        )
+                    ''')
+                for plant_id in plant_ids:
+                    if self.archive_db:
+                        cursor.execute('''
+                            INSERT OR IGNORE INTO archive.sensor_data
+                            SELECT * FROM main.sensor_data WHERE plant_id = ? AND timestamp < ?
+                        ''', (plant_id, cutoff))
+                    cursor.execute('DELETE FROM main.sensor_data WHERE plant_id = ? AND timestamp < ?', (plant_id, cutoff))
+                    removed += cursor.rowcount
+                cursor.execute('''
+                    DELETE FROM main.sensor_rollups WHERE resolution = 'minute' AND bucket_start < ?
+                ''', (cutoff_time.strftime(TIMESTAMP_FORMAT),))
+        finally:
+            if self.archive_db:
+                cursor.execute('DETACH DATABASE archive')
+        return removed
 
     def get_plant_settings(self, plant_id):
-        conn = sqlite3.connect(self.db_name)
+        """
+        Settings for a plant, served from memory once loaded. The cache is cleared when set_plant_settings
+        runs here, or within settings_check_interval when settings_version shows someone else changed plant_settings.
+        :param plant_id: The id of the plant we need settings for
+        :return: settings dict, or None if the plant has no settings yet
+        """
+        self._check_settings_version()
+        generation = self._settings_generation
+        key = str(plant_id)
+        cached = self._settings_cache.get(key)
+        if cached is not None:
+            # copy so callers can't modify what we serve to everyone else
+            return dict(cached)
+
+        conn = self.pool.connection()
         cursor = conn.cursor()
 
         cursor.execute('''
             SELECT * FROM plant_settings WHERE plant_id = ?
-        ''', (plant_id,))
+        ''', (key,))
 
         result = cursor.fetchone()
-        conn.close()
 
         if result:
-            return {
+            settings = {
                 'plant_id': result[0],
                 'moisture_threshold': result[1],
                 'light_threshold': result[2],
@@ -179,5 +308,34 @@ class DataBaseHandler:
                 'plant_type': result[7],
                 'ml_enabled': result[8]
             }
+            with self._settings_lock:
+                if generation == self._settings_generation:
+                    self._settings_cache[key] = settings
+            return dict(settings)
         return None
 
+    def invalidate_settings_cache(self):
+        """ Drop every cached plant setting and re-check settings_version on the next read """
+        with self._settings_lock:
+            self._settings_cache.clear()
+            self._settings_generation += 1
+            self._settings_checked_at = 0.0
+
+    def _check_settings_version(self):
+        # At most one small SELECT per settings_check_interval instead of a settings query per message
+        now = time.monotonic()
+        if now - self._settings_checked_at < self.settings_check_interval:
+            return
+        with self._settings_lock:
+            if now - self._settings_checked_at < self.settings_check_interval:
+                return
+            row = self.pool.connection().execute(
+                'SELECT version FROM settings_version WHERE id = 0'
+            ).fetchone()
+            version = row[0] if row else None
+            if version != self._settings_version:
+                self._settings_cache.clear()
+                self._settings_generation += 1
+                self._settings_version = version
+            self._settings_checked_at = now
+
@@ -0,0 +1,223 @@
+'''
+Streaming concept drift detection, updated at ingest. Per plant and sensor (and for the whole fleet) it keeps
+the running mean of the current day and Welford mean/variance over a sliding window of the previous days'
+means, O(1) per reading. When a day closes its mean is checked against the window's 2 sigma band, the
+result goes to drift_history (what the ML Models page plots) and alerts go to the listeners.
+State and history are kept in memory and written out by checkpoint(), see DataBaseHandler.checkpoint.
+'''
+import json
+import math
+from collections import deque
+from datetime import date
+from timestamps import from_epoch_ms
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# plant_id of the state covering every plant
+FLEET = ''
+WINDOW_DAYS = 14
+# Alert when a day's mean is further than this many standard deviations from the window mean
+BAND = 2.0
+
+HISTORY_SQL = '''
+    INSERT OR REPLACE INTO drift_history (plant_id, sensor, day, mean, count, window_mean, window_std, window_days, alert)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+STATE_SQL = 'INSERT OR REPLACE INTO drift_state (plant_id, sensor, state) VALUES (?, ?, ?)'
+
+
+def create_drift_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS drift_state (
+            plant_id TEXT NOT NULL,
+            sensor TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (plant_id, sensor)
+        ) WITHOUT ROWID
+    ''')
+    # One row per closed day, window_* is the band the day was checked against (the days before it)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS drift_history (
+            plant_id TEXT NOT NULL,
+            sensor TEXT NOT NULL,
+            day TEXT NOT NULL,
+            mean REAL NOT NULL,
+            count INTEGER NOT NULL,
+            window_mean REAL,
+            window_std REAL,
+            window_days INTEGER NOT NULL,
+            alert INTEGER NOT NULL,
+            PRIMARY KEY (plant_id, sensor, day)
+        ) WITHOUT ROWID
+    ''')
+
+
+class SensorDrift:
+    """ Drift state of one plant and sensor """
+    def __init__(self, window_days=WINDOW_DAYS, band=BAND):
+        self.window_days = window_days
+        self.band = band
+        self.day = None
+        self.day_count = 0
+        self.day_mean = 0.0
+        self.window = deque()
+        self.window_mean = 0.0
+        self.window_m2 = 0.0
+
+    def add(self, day, value):
+        """
+        Add one reading.
+        :param day: the reading's local date
+        :return: the closed day's history record if this reading started a new day, else None
+        """
+        if self.day is not None and day < self.day:
+            # Late reading for a day that is already closed, the rollups still have it
+            return None
+        closed = None
+        if self.day is not None and day > self.day:
+            closed = self.close_day()
+        if self.day is None or day > self.day:
+            self.day, self.day_count, self.day_mean = day, 0, 0.0
+        self.day_count += 1
+        self.day_mean += (value - self.day_mean) / self.day_count
+        return closed
+
+    def add_day(self, day, count, mean):
+        """ Replay a whole day's aggregate, used to backfill from the daily rollups """
+        closed = self.close_day() if self.day is not None else None
+        self.day, self.day_count, self.day_mean = day, count, mean
+        return closed
+
+    def window_std(self):
+        n = len(self.window)
+        return math.sqrt(self.window_m2 / (n - 1)) if n > 1 else None
+
+    def close_day(self):
+        """ Check the finished day against the window, then slide it into the window """
+        mean = self.day_mean
+        window_mean = self.window_mean if self.window else None
+        window_std = self.window_std()
+        alert = window_std is not None and len(self.window) == self.window_days and \
+            abs(mean - window_mean) > self.band * window_std
+        record = (self.day.isoformat(), mean, self.day_count, window_mean, window_std, len(self.window), alert)
+
+        # Welford add, and remove of the oldest day once the window is full
+        if len(self.window) == self.window_days:
+            old = self.window.popleft()
+            n = len(self.window)
+            if n:
+                delta = old - self.window_mean
+                self.window_mean -= delta / n
+                self.window_m2 -= delta * (old - self.window_mean)
+            else:
+                self.window_mean, self.window_m2 = 0.0, 0.0
+        self.window.append(mean)
+        n = len(self.window)
+        delta = mean - self.window_mean
+        self.window_mean += delta / n
+        self.window_m2 += delta * (mean - self.window_mean)
+        # Rounding can leave a tiny negative variance behind
+        self.window_m2 = max(self.window_m2, 0.0)
+        return record
+
+    def copy(self):
+        state = SensorDrift(self.window_days, self.band)
+        state.day, state.day_count, state.day_mean = self.day, self.day_count, self.day_mean
+        state.window = deque(self.window)
+        state.window_mean, state.window_m2 = self.window_mean, self.window_m2
+        return state
+
+    def to_json(self):
+        return json.dumps({
+            'window_days': self.window_days, 'band': self.band,
+            'day': self.day.isoformat() if self.day else None, 'day_count': self.day_count, 'day_mean': self.day_mean,
+            'window': list(self.window), 'window_mean': self.window_mean, 'window_m2': self.window_m2
+        })
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        state = cls(data['window_days'], data['band'])
+        state.day = date.fromisoformat(data['day']) if data['day'] else None
+        state.day_count, state.day_mean = data['day_count'], data['day_mean']
+        state.window = deque(data['window'])
+        state.window_mean, state.window_m2 = data['window_mean'], data['window_m2']
+        return state
+
+
+def history_row(plant_id, sensor, record):
+    day, mean, count, window_mean, window_std, window_days, alert = record
+    return plant_id, sensor, day, mean, count, window_mean, window_std, window_days, int(alert)
+
+
+class DriftEngine:
+    """
+    In-memory drift state for every plant and sensor, used by the ingest path the same way as SketchStore:
+    update() once a batch committed, checkpoint() writes drift_state and the closed days to drift_history.
+    Only the MQTT server writes drift_state.
+    """
+    def __init__(self, window_days=WINDOW_DAYS, band=BAND):
+        self.window_days = window_days
+        self.band = band
+        self._states = {}
+        # Keys changed and drift_history rows closed since the last checkpoint
+        self._dirty = set()
+        self._history = []
+        # Called with each alert dict (plant_id, sensor, day, mean, window_mean, window_std), see notify()
+        self.listeners = []
+
+    def load_state(self, cursor, plant_id, sensor):
+        row = cursor.execute(
+            'SELECT state FROM drift_state WHERE plant_id = ? AND sensor = ?', (plant_id, sensor)
+        ).fetchone()
+        return SensorDrift.from_json(row[0]) if row else SensorDrift(self.window_days, self.band)
+
+    def update(self, cursor, readings):
+        """
+        Feed readings to their states, in memory only.
+        :param readings: rows shaped like the sensor_data insert, timestamps in epoch ms
+        :return: alerts for notify()
+        """
+        alerts = []
+        # Oldest first so a batch closes its days in order
+        for row in sorted(readings, key=lambda row: row[5]):
+            day = from_epoch_ms(row[5]).date()
+            for i, sensor in enumerate(SENSORS):
+                value = row[i + 1]
+                if value is None:
+                    continue
+                for plant_id in (row[0], FLEET):
+                    key = (plant_id, sensor)
+                    state = self._states.get(key)
+                    if state is None:
+                        state = self._states[key] = self.load_state(cursor, *key)
+                    self._dirty.add(key)
+                    closed = state.add(day, value)
+                    if closed:
+                        self._history.append(history_row(plant_id, sensor, closed))
+                        if closed[-1]:
+                            alerts.append({
+                                'plant_id': plant_id, 'sensor': sensor, 'day': closed[0], 'mean': closed[1],
+                                'window_mean': closed[3], 'window_std': closed[4]
+                            })
+        return alerts
+
+    def checkpoint(self, cursor):
+        """ Write the states changed and the days closed since the last checkpoint """
+        cursor.executemany(HISTORY_SQL, self._history)
+        cursor.executemany(STATE_SQL, [
+            (plant_id, sensor, self._states[(plant_id, sensor)].to_json()) for plant_id, sensor in self._dirty
+        ])
+        self._history = []
+        self._dirty.clear()
+
+    def notify(self, alerts):
+        """ Log alerts and pass them to the listeners, call outside the ingest lock """
+        for alert in alerts:
+            print(f"Drift alert for plant {alert['plant_id'] or 'fleet'} {alert['sensor']} on {alert['day']}: "
+                  f"mean {alert['mean']:.2f} outside {alert['window_mean']:.2f} +/- {self.band} x {alert['window_std']:.2f}")
+            for listener in self.listeners:
+                try:
+                    listener(alert)
+                except Exception as e:
+                    print(f"Drift listener failed {e}")
@@ -0,0 +1,339 @@
+'''
+Schema migrations for plant_data.db. The schema version lives in sqlite's PRAGMA user_version,
+each migration runs once in its own transaction and bumps it, so older database files
+are upgraded in place the next time DataBaseHandler opens them.
+To change the schema add a function to the end of MIGRATIONS, never edit one that has shipped.
+'''
+from rollups import create_rollup_table, update_rollups, create_latest_table, sensor_counts
+from quantile_sketch import create_sketch_table, group_values, TDigest, UPSERT_SQL as SKETCH_UPSERT_SQL
+from drift_engine import create_drift_tables, SensorDrift, SENSORS, FLEET, HISTORY_SQL, STATE_SQL, history_row
+from seasonality import create_seasonality_tables, backfill_from_rollups
+from ML_Service.feature_store import create_feature_table
+from datetime import date
+
+
+def _baseline(cursor):
+    # The tables as they were before migrations existed, IF NOT EXISTS so old files pass straight through
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plant_id TEXT,
+            moisture REAL,
+            temperature REAL,
+            humidity REAL,
+            light_level REAL,
+            timestamp DATETIME
+        )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS plant_settings(
+    plant_id TEXT PRIMARY KEY,
+    moisture_threshold REAL,
+    light_threshold REAL,
+    watering_duration INTEGER,
+    lighting_duration INTEGER,
+    light_schedule_start TEXT,
+    light_schedule_end TEXT,
+    plant_type TEXT,
+    ml_enabled boolean
+    )
+''')
+
+    # Bumped by triggers on every change to plant_settings, whoever makes it (this handler or the dashboard).
+    # Cached settings are thrown away when it moves.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO settings_version (id, version) VALUES (0, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS plant_settings_{event.lower()}_version
+            AFTER {event} ON plant_settings
+            BEGIN
+                UPDATE settings_version SET version = version + 1 WHERE id = 0;
+            END
+        ''')
+
+
+def _last_sensor_id(cursor):
+    # Highest id sensor_data ever handed out, counting rows since moved or deleted
+    cursor.execute('''
+        SELECT MAX(last_id) FROM (
+            SELECT seq AS last_id FROM sqlite_sequence WHERE name = 'sensor_data'
+            UNION ALL SELECT MAX(id) FROM sensor_data
+        )
+    ''')
+    return cursor.fetchone()[0]
+
+
+def _keep_sensor_sequence(cursor, last_id):
+    # The rebuilt table's AUTOINCREMENT only knows the ids copied into it, carry the old one over so
+    # quarantined or pruned ids are never handed out again
+    if last_id is None:
+        return
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'sensor_data'")
+    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('sensor_data', ?)", (last_id,))
+
+
+def _sensor_data_types_and_index(cursor):
+    # Rebuild sensor_data with plant_id always text (on_message hands us ints) and timestamp declared TEXT,
+    # DATETIME gave it numeric affinity. Then index (plant_id, timestamp) so per plant range queries
+    # stop scanning the whole table.
+    cursor.execute('''
+        CREATE TABLE sensor_data_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plant_id TEXT NOT NULL,
+            moisture REAL,
+            temperature REAL,
+            humidity REAL,
+            light_level REAL,
+            timestamp TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO sensor_data_new (id, plant_id, moisture, temperature, humidity, light_level, timestamp)
+        SELECT id, CAST(plant_id AS TEXT), moisture, temperature, humidity, light_level, CAST(timestamp AS TEXT)
+        FROM sensor_data
+        WHERE plant_id IS NOT NULL AND timestamp IS NOT NULL
+    ''')
+    # Rows without a plant_id or timestamp can't go in the new table, they are kept aside instead of deleted
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_data_quarantine (
+            id INTEGER PRIMARY KEY,
+            plant_id TEXT,
+            moisture REAL,
+            temperature REAL,
+            humidity REAL,
+            light_level REAL,
+            timestamp TEXT
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO sensor_data_quarantine (id, plant_id, moisture, temperature, humidity, light_level, timestamp)
+        SELECT id, CAST(plant_id AS TEXT), moisture, temperature, humidity, light_level, CAST(timestamp AS TEXT)
+        FROM sensor_data
+        WHERE plant_id IS NULL OR timestamp IS NULL
+    ''')
+    if cursor.rowcount > 0:
+        print(f"Moved {cursor.rowcount} sensor_data rows without a plant_id or timestamp to sensor_data_quarantine")
+    last_id = _last_sensor_id(cursor)
+    cursor.execute('DROP TABLE sensor_data')
+    cursor.execute('ALTER TABLE sensor_data_new RENAME TO sensor_data')
+    _keep_sensor_sequence(cursor, last_id)
+    cursor.execute('CREATE INDEX idx_sensor_data_plant_time ON sensor_data (plant_id, timestamp)')
+
+
+def _sensor_rollups(cursor):
+    # Minute/hour/day aggregates maintained at ingest, backfilled here from whatever history is already stored
+    create_rollup_table(cursor)
+    read = cursor.connection.cursor()
+    read.execute('''
+        SELECT plant_id, moisture, temperature, humidity, light_level, timestamp
+        FROM sensor_data ORDER BY id
+    ''')
+    while True:
+        rows = read.fetchmany(5000)
+        if not rows:
+            break
+        update_rollups(cursor, rows)
+
+
+def _latest_readings(cursor):
+    # One row per plant with its newest reading, so "current state of every plant" never touches sensor_data.
+    # With MAX() sqlite takes the other columns from the row that has the max timestamp
+    create_latest_table(cursor)
+    cursor.execute('''
+        INSERT INTO latest_readings (plant_id, moisture, temperature, humidity, light_level, timestamp)
+        SELECT plant_id, moisture, temperature, humidity, light_level, MAX(timestamp)
+        FROM sensor_data GROUP BY plant_id
+    ''')
+
+
+# Local time text ('YYYY-MM-DD HH:MM:SS[.ffffff]') to UTC epoch milliseconds, exact to the millisecond
+_EPOCH_MS = "CAST(strftime('%s', {0}, 'utc') AS INTEGER) * 1000 + CAST(substr({0}, 21, 3) AS INTEGER)"
+
+
+def _epoch_timestamps(cursor):
+    # Reading timestamps become integer epoch ms, loading them no longer parses a string per row.
+    # Rollup bucket keys stay local time text, see timestamps.py
+    cursor.execute('''
+        CREATE TABLE sensor_data_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plant_id TEXT NOT NULL,
+            moisture REAL,
+            temperature REAL,
+            humidity REAL,
+            light_level REAL,
+            timestamp INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(f'''
+        INSERT INTO sensor_data_new (id, plant_id, moisture, temperature, humidity, light_level, timestamp)
+        SELECT id, plant_id, moisture, temperature, humidity, light_level, {_EPOCH_MS.format('timestamp')}
+        FROM sensor_data
+    ''')
+    last_id = _last_sensor_id(cursor)
+    cursor.execute('DROP TABLE sensor_data')
+    cursor.execute('ALTER TABLE sensor_data_new RENAME TO sensor_data')
+    _keep_sensor_sequence(cursor, last_id)
+    cursor.execute('CREATE INDEX idx_sensor_data_plant_time ON sensor_data (plant_id, timestamp)')
+
+    cursor.execute('''
+        CREATE TABLE latest_readings_new (
+            plant_id TEXT PRIMARY KEY,
+            moisture REAL,
+            temperature REAL,
+            humidity REAL,
+            light_level REAL,
+            timestamp INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(f'''
+        INSERT INTO latest_readings_new (plant_id, moisture, temperature, humidity, light_level, timestamp)
+        SELECT plant_id, moisture, temperature, humidity, light_level, {_EPOCH_MS.format('timestamp')}
+        FROM latest_readings
+    ''')
+    cursor.execute('DROP TABLE latest_readings')
+    cursor.execute('ALTER TABLE latest_readings_new RENAME TO latest_readings')
+
+
+def _analytics(cursor):
+    # Finished series for the ML Models page, written by ML_Service/analytics_job.py.
+    # One row per plant ('' for the whole fleet) and kind, payload is JSON, watermark the last sensor_data id included
+    cursor.execute('''
+        CREATE TABLE analytics (
+            plant_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            watermark INTEGER NOT NULL,
+            computed_at INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (plant_id, kind)
+        )
+    ''')
+
+
+def _sensor_sketches(cursor):
+    # t-digest per plant and sensor for the Q-Q plots, backfilled from the stored history a chunk at a time
+    create_sketch_table(cursor)
+    sketches = {}
+    read = cursor.connection.cursor()
+    read.execute('''
+        SELECT plant_id, moisture, temperature, humidity, light_level
+        FROM sensor_data ORDER BY id
+    ''')
+    while True:
+        rows = read.fetchmany(5000)
+        if not rows:
+            break
+        for key, values in group_values(rows).items():
+            sketches.setdefault(key, TDigest()).add_many(values)
+    cursor.executemany(SKETCH_UPSERT_SQL, [
+        (plant_id, sensor, sketch.count, sketch.to_bytes()) for (plant_id, sensor), sketch in sketches.items()
+    ])
+
+
+def _drift(cursor):
+    # Streaming drift state and history, replayed from the daily rollups instead of the raw readings
+    create_drift_tables(cursor)
+    counts = sensor_counts(cursor)
+    # Each sensor's own count, over only the rows where it has a sum
+    sums = ', '.join(f'SUM({s}_sum), SUM(CASE WHEN {s}_sum IS NOT NULL THEN {counts[s]} END)' for s in SENSORS)
+    plant_days = cursor.execute(f'''
+        SELECT plant_id, bucket_start, {sums} FROM sensor_rollups
+        WHERE resolution = 'day' GROUP BY plant_id, bucket_start ORDER BY plant_id, bucket_start
+    ''').fetchall()
+    fleet_days = cursor.execute(f'''
+        SELECT ?, bucket_start, {sums} FROM sensor_rollups
+        WHERE resolution = 'day' GROUP BY bucket_start ORDER BY bucket_start
+    ''', (FLEET,)).fetchall()
+    states = {}
+    history = []
+    for plant_id, bucket_start, *values in plant_days + fleet_days:
+        day = date.fromisoformat(bucket_start[:10])
+        for sensor, total, count in zip(SENSORS, values[::2], values[1::2]):
+            if total is None or not count:
+                continue
+            state = states.setdefault((plant_id, sensor), SensorDrift())
+            closed = state.add_day(day, count, total / count)
+            if closed:
+                history.append(history_row(plant_id, sensor, closed))
+    cursor.executemany(HISTORY_SQL, history)
+    cursor.executemany(STATE_SQL, [(plant_id, sensor, state.to_json()) for (plant_id, sensor), state in states.items()])
+
+
+def _seasonality(cursor):
+    # Hour of day x day of week cube and the hourly ring for the ACF, from the hourly rollups
+    create_seasonality_tables(cursor)
+    backfill_from_rollups(cursor)
+
+
+def _plant_features(cursor):
+    # No backfill, a plant's state is warmed up from its recent readings the first time it is seen
+    create_feature_table(cursor)
+
+
+def _sensor_data_time_index(cursor):
+    # The dashboard's date range queries filter on timestamp without a plant, (plant_id, timestamp) can't serve them
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sensor_data_time ON sensor_data (timestamp)')
+
+
+def _rollup_sensor_counts(cursor):
+    # Per sensor counts, so a null reading no longer skews the other sensors' means. A bucket whose sum a null
+    # reading already made NULL starts its count at 0 and fills back in with the readings after it
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(sensor_rollups)')}
+    for s in SENSORS:
+        if f'{s}_count' in columns:
+            # Databases that ran migration 3 since create_rollup_table has them already
+            continue
+        cursor.execute(f'ALTER TABLE sensor_rollups ADD COLUMN {s}_count INTEGER NOT NULL DEFAULT 0')
+        cursor.execute(f'UPDATE sensor_rollups SET {s}_count = CASE WHEN {s}_sum IS NULL THEN 0 ELSE count END')
+
+
+# (version, what it does, function). Versions must keep counting up by one.
+MIGRATIONS = [
+    (1, 'baseline tables', _baseline),
+    (2, 'normalize sensor_data types, index (plant_id, timestamp)', _sensor_data_types_and_index),
+    (3, 'minute/hour/day sensor_rollups', _sensor_rollups),
+    (4, 'latest_readings per plant', _latest_readings),
+    (5, 'epoch millisecond reading timestamps', _epoch_timestamps),
+    (6, 'analytics cache for the ML Models page', _analytics),
+    (7, 'quantile sketches per plant and sensor', _sensor_sketches),
+    (8, 'streaming concept drift state and history', _drift),
+    (9, 'seasonality cube and hourly ring', _seasonality),
+    (10, 'incremental ML feature state per plant', _plant_features),
+    (11, 'index sensor_data (timestamp)', _sensor_data_time_index),
+    (12, 'per sensor counts in sensor_rollups', _rollup_sensor_counts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Bring the database up to LATEST_VERSION, running only the migrations it hasn't had yet.
+    :param conn: sqlite connection
+    :return: the schema version the database ended up at
+    """
+    for version, description, upgrade in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        # IMMEDIATE takes the write lock up front, then check again in case another process just migrated
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) < version:
+                print(f"Migrating database to version {version}: {description}")
+                upgrade(conn.cursor())
+                conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
@@ -8,22 +8,49 @@ from datetime import datetime
 from ipywidgets import Controller
 from plant_controller import PlantController
 from db_handler import DataBaseHandler
+from write_buffer import SensorWriteBuffer, clean_reading
+from worker_pool import PlantWorkerPool
+import sensor_codec
 from ML_Service.ml_db_handler import MLDataBaseHandler
+from MLInference import MLInference
+from reading_buffer import ReadingBuffer
 
 class MQTTServer:
-    def __init__(self):
+    def __init__(self, buffered_writes=False, workers=0, recent_readings=False):
+        """
+        :param buffered_writes: Group sensor readings into batched writes (see SensorWriteBuffer)
+        instead of committing every reading as it arrives. False stores each reading before deciding on it.
+        :param workers: Number of worker threads processing messages off paho's network thread (see PlantWorkerPool).
+        0 processes each message inside on_message like before, None uses one worker per core.
+        :param recent_readings: Keep each plant's last readings in memory (see ReadingBuffer). Off by default, the
+        features models use are kept by the FeatureStore, this is for code that needs the raw recent readings.
+        """
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.watering_state = {} #Track the watering state to capture before and after moisture sensor readings.
+        # plant_id -> time of the newest reading decided on, older readings arriving late are stored but not acted on
+        self.last_reading = {}
+        # Last few readings of every plant in memory, for features that need recent history (see ReadingBuffer)
+        self.recent = ReadingBuffer() if recent_readings else None
 # Here we initialize the modules needed. Database, Plant control for the automation, and ML for future inference implementation
         self.db = DataBaseHandler()
         self.controller = PlantController()
         self.ml_db = MLDataBaseHandler()
+        self.ml = MLInference()
+        # Models get the plant's features kept at ingest next to the raw reading (see ML_Service/feature_store.py)
+        self.ml.feature_source = self.db.features.current
+        # Drift alerts raised at ingest flag the plant's model for retraining
+        self.db.drift.listeners.append(self.ml.on_drift)
+        self.write_buffer = SensorWriteBuffer(self.db) if buffered_writes else None
+        # Messages for a plant always go to the same worker, so watering_state sees them in order
+        self.workers = PlantWorkerPool(self.process_payload, workers) if workers != 0 else None
 
         # Topics are what we subscribe to. (Central server Pi) sensors for data collection. Control watering and light control
         self.SENSOR_TOPIC = "garden/+/sensors"  # + is wildcard for plant_id
         self.CONTROL_TOPIC = "garden/{}/control"
+        # Plants whose nodes talk the binary format (see sensor_codec), they get binary control messages back
+        self.binary_plants = set()
 
 
     def start(self):
@@ -35,6 +62,18 @@ class MQTTServer:
             self.client.loop_forever()
         except Exception as e:
             print(f"Failed to start MQTT server {e}")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ Finish queued messages, write out buffered readings and release the pooled database connections """
+        if self.workers:
+            self.workers.stop()
+            self.workers = None
+        if self.write_buffer:
+            self.write_buffer.close()
+        self.db.close()
+        self.ml_db.close()
 
     def on_disconnect(self, client, userdata, rc):
         print(f"Disconnected with result code {rc}")
@@ -57,80 +96,285 @@ class MQTTServer:
 
     def on_message(self, client, userdata, msg):
         """
-        Collects data from sensors stores into the db, Then gets automation/control instructions
-        and publishes it to MQTT server
+        Runs on paho's network thread. With workers the message is only parsed and queued here, so a slow disk
+        never holds up keepalives or socket reads, otherwise it is processed right away.
         :param client: MQTT client
         :param msg: incoming message from Arduino(Plant)
-        :return: Returns the automation/control instructions
+        """
+        if self.workers:
+            # Each plant's part goes to that plant's worker so its messages stay in order, gateway batches included
+            for plant_id, payload in self.split_message(msg):
+                self.workers.submit(plant_id, (plant_id, payload))
+        else:
+            self.process_message(msg)
+
+    def split_message(self, msg):
+        """
+        Parse a sensor message into one (plant_id, payload) per plant it has readings for. A batch from a gateway
+        is split so every plant's readings are handled in that plant's order, not the gateway's.
+        :param msg: incoming message from Arduino(Plant)
+        :return: list of (plant_id, reading dict or list of reading dicts)
         """
         try:
             #Extract plant_id from topic. Plant id identifies the plant or edge Arduino node.
             plant_id = int(msg.topic.split("/")[1]) # convert plant id to int
-            payload = json.loads(msg.payload.decode())
+            payload = self.parse_payload(plant_id, msg.payload)
+        except Exception as e:
+            print(f"Error processing message: {e}")
+            return []
+        if not isinstance(payload, list):
+            return [(plant_id, payload)]
+        parts = {}
+        for reading in payload:
+            reading_plant_id = plant_id
+            if isinstance(reading, dict):
+                try:
+                    reading_plant_id = int(reading.get("plant_id", plant_id))
+                except (TypeError, ValueError):
+                    # Left with the topic's plant, handle_batch reports it
+                    pass
+            parts.setdefault(reading_plant_id, []).append(reading)
+        return list(parts.items())
 
-            if not self.validate_sensor_data(payload):
-                print("Invalid sensor data for plant id {plant_id}")
-            # store sensor data
-            self.db.store_sensor_data(plant_id, payload)
-            # Get plant settings
-            settings = self.db.get_plant_settings(plant_id)
+    def process_message(self, msg):
+        """
+        Collects data from sensors stores into the db, Then gets automation/control instructions
+        and publishes it to MQTT server
+        :param msg: incoming message from Arduino(Plant)
+        """
+        for plant_id, payload in self.split_message(msg):
+            self.process_payload((plant_id, payload))
 
-            if not settings:
-                print("No settings for plant id {plant_id}.")
-                print("Setting for plant id {plant_id}: {settings}.")
-                # Set the plant settings
-                self.db.set_plant_settings(plant_id)
+    def process_payload(self, item):
+        """
+        Store and decide on one plant's part of a message and publish the decisions
+        :param item: (plant_id, payload) from split_message
+        """
+        plant_id, payload = item
+        try:
+            # A list is a batch of buffered readings, see handle_batch
+            if isinstance(payload, list):
+                for batch_plant_id, automation_decisions in self.handle_batch(plant_id, payload):
+                    control_topic = self.CONTROL_TOPIC.format(batch_plant_id)
+                    self.client.publish(control_topic, self.encode_control(batch_plant_id, automation_decisions))
                 return
-            # Get ML predictions
-            # ml_predictions = self.ml_predictor.predict(plant_id,payload)
-
-            #Where we calculte the automation decisions for garden.
-            #convert to lists since plant controller is expecting it as a list
-            sensor_data_list = [payload]
-            settings_list = [settings]
 
-
-            # Future we will introduce ML model to start controlling
-            automation_decisions = self.controller.get_control_decisions(
-                sensor_data = sensor_data_list,
-                settings = settings_list,
-                # ml_predictions = ml_predictions
-            )
+            if not self.validate_sensor_data(payload):
+                print(f"Invalid sensor data for plant id {plant_id}")
+                return
+            automation_decisions = self.handle_reading(plant_id, payload)
             if not automation_decisions:
-                print("No automation decisions for plant id {plant_id}")
                 return
-            #Here we store a watering event if the needs water is true.
-            # ["plant_id": null, "water_pump": {"active": false, "duration": 0}, "grow_light": {"active": true}}]
-                # Here we check if it is in waterting state if not we initialize.
-            if plant_id not in self.watering_state:
-                self.watering_state[plant_id] = {'waiting_for_after': False, 'last_record_id': None}
-            automation_decision = automation_decisions[0]
-            if automation_decision['water_pump']['active']:
-                duration = automation_decision['water_pump']['duration']
-                record_id = self.ml_db.store_watering_event_initial(
-                    plant_id,
-                    payload['moisture'],
-                    duration
-                )
-
-                # Update watering state
-                self.watering_state[plant_id]['waiting_for_after'] = True
-                self.watering_state[plant_id]['last_record_id'] = record_id
-                # self.watering_state[plant_id]['watering_start_time'] = datetime.now()
-
-            elif self.watering_state[plant_id]['waiting_for_after']:
-                moisture_after = payload['moisture']
-                latest_record_id = self.watering_state[plant_id]['last_record_id']
-                self.ml_db.store_watering_event_final(latest_record_id, moisture_after)
-                self.watering_state[plant_id]['waiting_for_after'] = False
 
             control_topic = self.CONTROL_TOPIC.format(plant_id)
-            self.client.publish(control_topic, json.dumps(automation_decisions))
+            self.client.publish(control_topic, self.encode_control(plant_id, automation_decisions))
 
         except Exception as e:
             print(f"Error processing message: {e}")
 
+    def parse_payload(self, plant_id, raw):
+        """
+        Sensor payloads are JSON unless they start with sensor_codec's version byte. Binary ones always
+        decode to a list of readings and go through handle_batch. Whichever format a plant used last
+        is the one its control messages go back in.
+        :param plant_id: plant id from the topic
+        :param raw: message payload bytes
+        :return: reading dict or list of reading dicts
+        """
+        if sensor_codec.is_binary(raw):
+            readings = sensor_codec.decode_sensor_payload(raw)
+            self.binary_plants.add(plant_id)
+            self.binary_plants.update(reading["plant_id"] for reading in readings if "plant_id" in reading)
+            return readings
+        self.binary_plants.discard(plant_id)
+        return json.loads(raw.decode())
+
+    def encode_control(self, plant_id, automation_decisions):
+        """ Control payload for a plant, binary if that's what the node sends us, JSON otherwise """
+        if plant_id in self.binary_plants:
+            return sensor_codec.encode_decisions(plant_id, automation_decisions)
+        return json.dumps(automation_decisions)
+
+    def handle_reading(self, plant_id, payload):
+        """
+        The blocking part of processing a reading: store it, look up settings, get the automation
+        decisions and keep track of watering events. Shared by the threaded and asyncio servers.
+        :param plant_id: The id of the plant the reading is from
+        :param payload: Sensor reading dict
+        :return: automation decisions to publish, or None
+        """
+        # Sensor values as numbers, a reading that has none is rejected before it is stored
+        payload = clean_reading(payload)
+        now = datetime.now()
+        self.last_reading[plant_id] = now
+        if self.recent is not None:
+            self.recent.append(plant_id, now, payload)
+        # store sensor data, batched with other readings if the write buffer is on
+        if self.write_buffer:
+            self.write_buffer.add(plant_id, payload, now)
+        else:
+            self.db.store_sensor_data(plant_id, payload, now)
+        return self.decide(plant_id, payload, timestamp=now)
+
+    def handle_batch(self, plant_id, readings):
+        """
+        Blocking part of processing a batch payload: a JSON list of readings, each may carry its own
+        plant_id (defaults to the topic's) and timestamp (defaults to now). Valid readings are stored
+        with one executemany and decisions only run on the newest reading of each plant, none at all when
+        that is older than a reading the plant already sent.
+        :param plant_id: plant id from the topic
+        :param readings: list of reading dicts
+        :return: list of (plant_id, automation decisions) to publish
+        """
+        rows = []
+        latest = {}
+        now = datetime.now()
+        for reading in readings:
+            if not isinstance(reading, dict) or not self.validate_sensor_data(reading):
+                print(f"Invalid sensor data in batch from plant id {plant_id}: {reading}")
+                continue
+            try:
+                reading = clean_reading(reading)
+            except ValueError as e:
+                print(f"Invalid sensor data in batch from plant id {plant_id}: {e}")
+                continue
+            try:
+                reading_plant_id = int(reading.get("plant_id", plant_id))
+            except (TypeError, ValueError):
+                print(f"Invalid plant id in batch from plant id {plant_id}: {reading.get('plant_id')}")
+                continue
+            timestamp = self.parse_timestamp(reading.get("timestamp"), now)
+            rows.append((reading_plant_id, reading, timestamp))
+            # >= so the later of two readings with the same timestamp wins
+            if reading_plant_id not in latest or timestamp >= latest[reading_plant_id][1]:
+                latest[reading_plant_id] = (reading, timestamp)
+        if not rows:
+            return []
+        for reading_plant_id, (reading, timestamp) in list(latest.items()):
+            if timestamp < self.last_reading.get(reading_plant_id, timestamp):
+                # Buffered readings from before what the plant already reported live, too old to act on
+                del latest[reading_plant_id]
+            else:
+                self.last_reading[reading_plant_id] = timestamp
+        if self.recent is not None:
+            # Oldest first, the ring buffer drops a reading older than the plant's newest
+            for reading_plant_id, reading, timestamp in sorted(rows, key=lambda row: row[2]):
+                self.recent.append(reading_plant_id, timestamp, reading)
+
+        if self.write_buffer:
+            for reading_plant_id, reading, timestamp in rows:
+                self.write_buffer.add(reading_plant_id, reading, timestamp)
+        else:
+            self.db.store_sensor_data_batch(rows)
+
+        # Every ML enabled plant in the batch is scored in one predict_batch call
+        plant_settings = {}
+        ml_readings, ml_settings, ml_timestamps = [], [], []
+        for reading_plant_id, (reading, timestamp) in latest.items():
+            settings = plant_settings[reading_plant_id] = self.db.get_plant_settings(reading_plant_id)
+            if settings and settings.get('ml_enabled'):
+                ml_readings.append(reading)
+                ml_settings.append(settings)
+                ml_timestamps.append(timestamp)
+        ml_predictions = self.ml.predict_batch(ml_readings, ml_settings, ml_timestamps) if ml_settings else {}
+
+        results = []
+        for reading_plant_id, (reading, timestamp) in latest.items():
+            automation_decisions = self.decide(
+                reading_plant_id, reading, ml_predictions, settings=plant_settings[reading_plant_id]
+            )
+            if automation_decisions:
+                results.append((reading_plant_id, automation_decisions))
+        return results
+
+    def parse_timestamp(self, value, default):
+        """ Reading timestamps come as 'YYYY-MM-DD HH:MM:SS[.ffffff]' or epoch seconds, anything else gets default """
+        try:
+            if isinstance(value, str):
+                timestamp = datetime.fromisoformat(value)
+                # Everything is stored in the Pi's local time
+                if timestamp.tzinfo is not None:
+                    timestamp = timestamp.astimezone().replace(tzinfo=None)
+                return timestamp
+            if isinstance(value, (int, float)):
+                return datetime.fromtimestamp(value)
+        except (ValueError, OverflowError, OSError):
+            print(f"Invalid timestamp {value}, using the time it arrived")
+        return default
+
+    def decide(self, plant_id, payload, ml_predictions=None, settings=None, timestamp=None):
+        """
+        Look up settings, get the automation decisions for a reading and keep track of watering events.
+        :param plant_id: The id of the plant the reading is from
+        :param payload: Sensor reading dict
+        :param ml_predictions: predictions already made for a batch (see MLInference.predict_batch),
+        None scores this reading on its own when the plant has ML enabled
+        :param settings: the plant's settings if the caller already looked them up
+        :param timestamp: when the reading was taken, so the model's features include it even before it is stored
+        :return: automation decisions to publish, or None
+        """
+        # Get plant settings
+        if settings is None:
+            settings = self.db.get_plant_settings(plant_id)
+
+        if not settings:
+            print("No settings for plant id {plant_id}.")
+            print("Setting for plant id {plant_id}: {settings}.")
+            # Set the plant settings
+            self.db.set_plant_settings(plant_id)
+            return None
+        # Get ML predictions, plants without a model are left out and keep the rule based decisions
+        if ml_predictions is None and settings.get('ml_enabled'):
+            ml_predictions = self.ml.predict_batch([payload], [settings], [timestamp])
+        # Only this plant's, a batch's predictions for other plants would switch it to ML without a model
+        plant_prediction = (ml_predictions or {}).get(settings.get('plant_id'))
+        ml_predictions = {settings.get('plant_id'): plant_prediction} if plant_prediction else None
+
+        #Where we calculte the automation decisions for garden.
+        #convert to lists since plant controller is expecting it as a list
+        sensor_data_list = [payload]
+        settings_list = [settings]
+
+
+        # Future we will introduce ML model to start controlling
+        automation_decisions = self.controller.get_control_decisions(
+            sensor_data = sensor_data_list,
+            settings = settings_list,
+            ml_predictions = ml_predictions
+        )
+        if not automation_decisions:
+            print("No automation decisions for plant id {plant_id}")
+            return None
+        #Here we store a watering event if the needs water is true.
+        # ["plant_id": null, "water_pump": {"active": false, "duration": 0}, "grow_light": {"active": true}}]
+            # Here we check if it is in waterting state if not we initialize.
+        if plant_id not in self.watering_state:
+            self.watering_state[plant_id] = {'waiting_for_after': False, 'last_record_id': None}
+        automation_decision = automation_decisions[0]
+        if automation_decision['water_pump']['active']:
+            duration = automation_decision['water_pump']['duration']
+            record_id = self.ml_db.store_watering_event_initial(
+                plant_id,
+                payload['moisture'],
+                duration
+            )
+
+            self.db.features.record_watering(plant_id, datetime.now())
+
+            # Update watering state
+            self.watering_state[plant_id]['waiting_for_after'] = True
+            self.watering_state[plant_id]['last_record_id'] = record_id
+            # self.watering_state[plant_id]['watering_start_time'] = datetime.now()
+
+        elif self.watering_state[plant_id]['waiting_for_after']:
+            moisture_after = payload['moisture']
+            latest_record_id = self.watering_state[plant_id]['last_record_id']
+            self.ml_db.store_watering_event_final(latest_record_id, moisture_after)
+            self.watering_state[plant_id]['waiting_for_after'] = False
+
+        return automation_decisions
+
 if __name__ == "__main__":
-    server = MQTTServer()
+    server = MQTTServer(buffered_writes=True, workers=None)
     server.start()
 
@@ -0,0 +1,116 @@
+'''
+Minimal model format for inference: plain NumPy arrays in an .npz file plus a NumPy forward pass, so the
+MQTT server can score models without importing scikit-learn, TensorFlow or Keras (or unpickling anything).
+ML_Service/export.py converts trained models into it. Supported kinds:
+  linear  standardize, x @ weights + bias, logistic or identity link
+  mlp     standardize, dense layers with relu/tanh/logistic/identity, logistic or softmax output
+  trees   average of decision trees stored as flat node arrays (scikit-learn tree_ layout)
+Features are standardized with mean/scale first, NaN ends up as 0 (the mean) like the training side.
+'''
+import os
+import numpy as np
+
+ACTIVATIONS = {
+    'identity': lambda x: x,
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0.0),
+    'tanh': np.tanh,
+    'logistic': lambda x: 1.0 / (1.0 + np.exp(-np.clip(x, -500, 500))),
+    'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-np.clip(x, -500, 500))),
+    'softmax': lambda x: softmax(x),
+}
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def save_npz(path, kind, features, outputs, **arrays):
+    """
+    Write a model, replacing the file atomically so a running server never reads half of it.
+    :param kind: 'linear', 'mlp' or 'trees'
+    :param features: input names in column order
+    :param outputs: what each predicted column means
+    :param arrays: the kind's arrays, see NpzModel
+    """
+    arrays = {name: np.asarray(value) for name, value in arrays.items()}
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, kind=np.array(kind), features=np.array(features, dtype=str),
+                 outputs=np.array(outputs, dtype=str), **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+class NpzModel:
+    def __init__(self, kind, arrays):
+        """
+        :param kind: 'linear', 'mlp' or 'trees'
+        :param arrays: dict of the model's arrays as saved by save_npz
+        """
+        self.kind = kind
+        self.arrays = arrays
+        n_features = len(arrays['features'])
+        self.mean = arrays.get('mean', np.zeros(n_features))
+        self.scale = arrays.get('scale', np.ones(n_features))
+        if kind == 'mlp':
+            self.layers = [(arrays[f'W{i}'], arrays[f'b{i}']) for i in range(int(arrays['n_layers']))]
+            self.activations = [str(name) for name in arrays['activations']]
+
+    def transform(self, X):
+        Z = (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+        return np.where(np.isnan(Z), 0.0, Z)
+
+    def predict(self, X):
+        """
+        :param X: (rows, features) in the saved feature order
+        :return: (rows, outputs) scores, probabilities for classifiers
+        """
+        Z = self.transform(X)
+        if self.kind == 'linear':
+            link = ACTIVATIONS[str(self.arrays['link'])]
+            return link(Z @ self.arrays['weights'] + self.arrays['bias'])
+        if self.kind == 'mlp':
+            for (W, b), activation in zip(self.layers, self.activations):
+                Z = ACTIVATIONS[activation](Z @ W + b)
+            return Z
+        if self.kind == 'trees':
+            return self._trees(np.asarray(X, dtype=np.float64))
+        raise ValueError(f"Unknown model kind {self.kind}")
+
+    def _trees(self, X):
+        """
+        Every tree at once: each row walks its own node index down the flat arrays until it reaches a leaf.
+        Trees split on raw (unstandardized) values. NaN goes the way missing_left says, right without it.
+        """
+        a = self.arrays
+        roots = a['roots']
+        nodes = np.repeat(roots[None, :], len(X), axis=0)
+        rows = np.arange(len(X))[:, None]
+        while True:
+            left = a['left'][nodes]
+            internal = left >= 0
+            if not internal.any():
+                break
+            feature = np.where(internal, a['feature'][nodes], 0)
+            values = X[rows, feature]
+            go_left = values <= a['threshold'][nodes]
+            if 'missing_left' in a:
+                go_left = np.where(np.isnan(values), a['missing_left'][nodes], go_left)
+            nodes = np.where(internal, np.where(go_left, left, a['right'][nodes]), nodes)
+        # value is (nodes, outputs), the average over trees is the ensemble's answer
+        return a['value'][nodes].mean(axis=1)
+
+
+def load_npz(path):
+    """
+    :return: artifact dict like the pickled ones MLInference loads, {'model', 'features', 'outputs'}
+    """
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    return {
+        'model': NpzModel(str(arrays['kind']), arrays),
+        'features': tuple(str(name) for name in arrays['features']),
+        'outputs': tuple(str(name) for name in arrays['outputs']),
+    }
@@ -1,4 +1,5 @@
 from datetime import datetime
+import numpy as np
 
 
 class PlantController:
@@ -6,7 +7,7 @@ class PlantController:
     def get_control_decisions(self, sensor_data, settings, ml_predictions =None):
         """ Calculate the automation actions based on sensor data, settings, and ML predictions."""
         if ml_predictions and any(setting.get("ml_enabled", False) for setting in settings):
-            return self.get_ml_based_automation(ml_predictions, settings)
+            return self.get_ml_based_automation(ml_predictions, settings, sensor_data)
         else:
             return self.get_rule_based_decisions(sensor_data, settings)
 
@@ -30,6 +31,55 @@ class PlantController:
 
         return results
 
+    def get_batch_decisions(self, readings, settings):
+        """
+        Rule based decisions for N plants in one vectorized pass, for re-evaluating the whole fleet at once.
+        Same rules as get_rule_based_decisions, missing values fall back to the same defaults.
+        :param readings: dict of length N arrays, 'moisture' (and 'light_level' once light rules are back)
+        :param settings: dict of length N arrays (or scalars), 'moisture_threshold' and 'watering_duration'
+        :return: dict of length N arrays, 'water_active' (bool), 'water_duration' (int), 'light_active' (bool)
+        """
+        moisture = np.asarray(readings['moisture'], dtype=float)
+        n = moisture.shape[0]
+        moisture = np.where(np.isnan(moisture), 0.0, moisture)
+        threshold = np.broadcast_to(np.asarray(settings.get('moisture_threshold', 100), dtype=float), n)
+        threshold = np.where(np.isnan(threshold), 100.0, threshold)
+        duration = np.broadcast_to(np.asarray(settings.get('watering_duration', 0), dtype=float), n)
+        duration = np.where(np.isnan(duration), 0, duration).astype(np.int64)
+
+        water_active = moisture <= threshold
+        return {
+            'water_active': water_active,
+            'water_duration': np.where(water_active, duration, 0),
+            # _needs_light is always on until the schedule check comes back
+            'light_active': np.ones(n, dtype=bool),
+        }
+
+    def batch_to_decisions(self, plant_ids, batch):
+        """
+        Turn get_batch_decisions arrays back into the list of decision dicts we publish.
+        :param plant_ids: plant ids in the same order as the arrays
+        :param batch: result of get_batch_decisions
+        """
+        return [
+            {
+                "plant_id": plant_id,
+                "water_pump": {
+                    "active": water_active,
+                    "duration": water_duration,
+                },
+                "grow_light": {
+                    "active": light_active
+                }
+            }
+            for plant_id, water_active, water_duration, light_active in zip(
+                plant_ids,
+                batch['water_active'].tolist(),
+                batch['water_duration'].tolist(),
+                batch['light_active'].tolist()
+            )
+        ]
+
     def _needs_water(self, plant_data, plant_settings):
         return plant_data.get("moisture", 0) <= plant_settings.get("moisture_threshold", 100)
 
@@ -54,22 +104,28 @@ class PlantController:
                 "active": needs_light
             }
         }
-    def get_ml_based_automation(self, ml_predictions, settings):
-        #For future we want to be able to make ml predictions for plants at the same time
+    def get_ml_based_automation(self, ml_predictions, settings, sensor_data):
+        """
+        Decisions from the plants' model predictions (see MLInference.predict_batch). Whatever a plant's
+        model doesn't predict, or a plant without ML or a prediction, gets the rule based decision for its reading.
+        :param ml_predictions: {plant_id: {'needs_water': bool, 'needs_light': bool, ...}}
+        :param settings: list of plant settings dicts
+        :param sensor_data: list of reading dicts, same order as settings
+        """
         results = []
-        for plant_settings in settings:
+        current_time = datetime.now()
+        for plant_data, plant_settings in zip(sensor_data, settings):
             plant_id = plant_settings.get("plant_id")
-            plant_predictions = ml_predictions.get(plant_id, {})
+            plant_predictions = ml_predictions.get(plant_id) if plant_settings.get("ml_enabled", False) else None
+            plant_predictions = plant_predictions or {}
 
-            decisions = {
-                "plant_id": plant_id,
-                "water_pump": {
-                    "active": plant_settings.get("water_pump_active", False),
-                    "duration": plant_settings.get("watering_duration", 0),
-                },
-                "grow_light": {
-                    "active": plant_predictions.get("needs_light", False)
-                }
-            }
-            results.append(decisions)
+            if "needs_water" in plant_predictions:
+                needs_water = bool(plant_predictions["needs_water"])
+            else:
+                needs_water = self._needs_water(plant_data, plant_settings)
+            if "needs_light" in plant_predictions:
+                needs_light = bool(plant_predictions["needs_light"])
+            else:
+                needs_light = self._needs_light(plant_data, plant_settings, current_time)
+            results.append(self._create_plant_decision(plant_id, needs_water, needs_light, plant_settings))
         return results
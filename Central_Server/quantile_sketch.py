@@ -0,0 +1,202 @@
+'''
+Mergeable quantile sketches (t-digest) per plant and sensor, kept up to date at ingest in sensor_sketches.
+A sketch is a couple of hundred centroids whatever the number of readings, so Q-Q plots come from a fixed
+number of quantiles instead of sorting every reading, and plants' sketches merge into fleet ones.
+'''
+import struct
+from collections import defaultdict
+import numpy as np
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# Higher keeps more centroids (about compression / 2) and gives more accurate quantiles
+COMPRESSION = 200
+
+# count, min, max, mean, m2 then the centroid count
+_HEADER = struct.Struct('<qddddI')
+
+UPSERT_SQL = '''
+    INSERT INTO sensor_sketches (plant_id, sensor, count, digest) VALUES (?, ?, ?, ?)
+    ON CONFLICT (plant_id, sensor) DO UPDATE SET count = excluded.count, digest = excluded.digest
+'''
+
+
+class TDigest:
+    """
+    Merging t-digest (Dunning). Values are buffered and merged into centroids whose size is bounded by the
+    arcsine scale function, small near the tails so extreme quantiles stay accurate.
+    Count, min, max, mean and variance are tracked exactly on the side.
+    """
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+        self._buffer = []
+
+    def copy(self):
+        digest = TDigest(self.compression)
+        self._compress()
+        digest.means, digest.weights = self.means.copy(), self.weights.copy()
+        digest.count, digest.min, digest.max, digest.mean, digest.m2 = self.count, self.min, self.max, self.mean, self.m2
+        return digest
+
+    def add_many(self, values):
+        """ Add readings, NaN ones are skipped """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self._merge_stats(len(values), values.min(), values.max(), values.mean(), ((values - values.mean()) ** 2).sum())
+        self._buffer.append((values, np.ones(len(values))))
+        if sum(len(v) for v, _ in self._buffer) > 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """ Fold another digest into this one, e.g. every plant's into a fleet digest """
+        if not other.count:
+            return
+        other._compress()
+        self._merge_stats(other.count, other.min, other.max, other.mean, other.m2)
+        self._buffer.append((other.means, other.weights))
+        self._compress()
+
+    def _merge_stats(self, count, minimum, maximum, mean, m2):
+        # Chan et al. so mean and variance merge exactly
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [v for v, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [w for _, w in self._buffer])
+        self._buffer = []
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+
+        total = weights.sum()
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / total
+        # Arcsine scale function, neighbours whose k differs by less than one share a centroid
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q):
+        """
+        :param q: probability or array of probabilities in [0, 1]
+        :return: estimated value(s) at q
+        """
+        self._compress()
+        if not self.count:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        # Centroid means sit at the middle of their weight, the exact min and max pin the ends
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.r_[0.0, centers, self.count]
+        values = np.r_[self.min, self.means, self.max]
+        return np.interp(np.asarray(q) * self.count, positions, values)
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.count)) if self.count else float('nan')
+
+    def to_bytes(self):
+        self._compress()
+        header = _HEADER.pack(self.count, self.min, self.max, self.mean, self.m2, len(self.means))
+        return header + self.means.astype('<f8').tobytes() + self.weights.astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, compression=COMPRESSION):
+        digest = cls(compression)
+        count, digest.min, digest.max, digest.mean, digest.m2, size = _HEADER.unpack_from(data)
+        digest.count = count
+        offset = _HEADER.size
+        digest.means = np.frombuffer(data, dtype='<f8', count=size, offset=offset).copy()
+        digest.weights = np.frombuffer(data, dtype='<f8', count=size, offset=offset + 8 * size).copy()
+        return digest
+
+
+def create_sketch_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_sketches (
+            plant_id TEXT NOT NULL,
+            sensor TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            digest BLOB NOT NULL,
+            PRIMARY KEY (plant_id, sensor)
+        ) WITHOUT ROWID
+    ''')
+
+
+def group_values(readings):
+    """ {(plant_id, sensor): [values]} from rows shaped like the sensor_data insert """
+    values = defaultdict(list)
+    for row in readings:
+        for i, sensor in enumerate(SENSORS):
+            if row[i + 1] is not None:
+                values[(row[0], sensor)].append(row[i + 1])
+    return values
+
+
+def load_sketch(cursor, plant_id, sensor):
+    """ Stored digest for a plant and sensor, an empty one if there is none """
+    row = cursor.execute(
+        'SELECT digest FROM sensor_sketches WHERE plant_id = ? AND sensor = ?', (str(plant_id), sensor)
+    ).fetchone()
+    return TDigest.from_bytes(row[0]) if row else TDigest()
+
+
+def fleet_sketch(cursor, sensor, plant_ids=None):
+    """
+    Merge plants' digests into one for fleet level views.
+    :param plant_ids: only these plants, None merges every plant
+    """
+    digest = TDigest()
+    for plant_id, data in cursor.execute('SELECT plant_id, digest FROM sensor_sketches WHERE sensor = ?', (sensor,)).fetchall():
+        if plant_ids is None or plant_id in plant_ids:
+            digest.merge(TDigest.from_bytes(data))
+    return digest
+
+
+class SketchStore:
+    """
+    In-memory digests the ingest path updates, each deserialized the first time its plant is seen. They are
+    written to sensor_sketches by checkpoint(), not on every batch. Only this process is expected to write
+    sensor_sketches (the MQTT server).
+    """
+    def __init__(self):
+        self._sketches = {}
+        # Keys changed since the last checkpoint
+        self._dirty = set()
+
+    def update(self, cursor, readings):
+        """
+        Add readings to their digests, in memory only. Call after the readings' insert committed.
+        :param readings: rows shaped like the sensor_data insert
+        """
+        for key, values in group_values(readings).items():
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = load_sketch(cursor, *key)
+            sketch.add_many(values)
+            self._dirty.add(key)
+
+    def checkpoint(self, cursor):
+        """ Write the digests changed since the last checkpoint """
+        cursor.executemany(UPSERT_SQL, [
+            (plant_id, sensor, self._sketches[(plant_id, sensor)].count, self._sketches[(plant_id, sensor)].to_bytes())
+            for plant_id, sensor in self._dirty
+        ])
+        self._dirty.clear()
@@ -0,0 +1,141 @@
+'''
+In-memory ring buffer of each plant's most recent readings, filled by the MQTT server as messages arrive, so
+features like the moisture slope don't need a sqlite query. Plants get a row in fixed size NumPy slabs that
+are allocated SLAB_PLANTS rows at a time, and the number of plants is capped (least recently heard from is
+reused), so memory stays bounded at about max_plants * capacity * 48 bytes.
+'''
+import threading
+from collections import OrderedDict
+import numpy as np
+from timestamps import to_epoch_ms
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# Readings kept per plant
+CAPACITY = 24
+# Plants kept, about 115MB with everything allocated at the default capacity
+MAX_PLANTS = 100000
+# Plant rows allocated at a time
+SLAB_PLANTS = 1024
+
+
+class _Slab:
+    """
+    Rows for SLAB_PLANTS plants. Every reading is written twice, at i and i + capacity, so the last n readings
+    are always one contiguous slice and windows can be views instead of copies.
+    """
+    def __init__(self, plants, capacity):
+        self.timestamps = np.zeros((plants, 2 * capacity), dtype=np.int64)
+        self.values = np.full((plants, 2 * capacity, len(SENSORS)), np.nan, dtype=np.float32)
+        self.head = np.zeros(plants, dtype=np.int32)
+        self.count = np.zeros(plants, dtype=np.int32)
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes + self.head.nbytes + self.count.nbytes
+
+
+class ReadingBuffer:
+    def __init__(self, capacity=CAPACITY, max_plants=MAX_PLANTS, slab_plants=SLAB_PLANTS):
+        """
+        :param capacity: Readings kept per plant
+        :param max_plants: Most plants kept, past it the plant heard from least recently loses its readings
+        :param slab_plants: Plant rows allocated at a time
+        """
+        self.capacity = capacity
+        self.max_plants = max_plants
+        self.slab_plants = slab_plants
+        # plant_id -> row, least recently appended to first
+        self._rows = OrderedDict()
+        self._slabs = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, plant_id):
+        return str(plant_id) in self._rows
+
+    def memory_bytes(self):
+        return sum(slab.nbytes for slab in self._slabs)
+
+    def _locate(self, row):
+        return self._slabs[row // self.slab_plants], row % self.slab_plants
+
+    def _row_for(self, plant_id):
+        row = self._rows.get(plant_id)
+        if row is not None:
+            self._rows.move_to_end(plant_id)
+            return row
+        if len(self._rows) < self.max_plants:
+            row = len(self._rows)
+            if row // self.slab_plants >= len(self._slabs):
+                self._slabs.append(_Slab(self.slab_plants, self.capacity))
+        else:
+            _, row = self._rows.popitem(last=False)
+            slab, i = self._locate(row)
+            slab.head[i] = slab.count[i] = 0
+        self._rows[plant_id] = row
+        return row
+
+    def append(self, plant_id, timestamp, reading):
+        """
+        Add a reading, O(1). Readings older than the plant's newest are dropped so windows stay in time order.
+        :param timestamp: datetime (local time) or epoch milliseconds
+        :param reading: sensor reading dict, missing sensors are stored as NaN
+        :return: False if the reading was dropped
+        """
+        timestamp = to_epoch_ms(timestamp)
+        values = [reading.get(sensor) for sensor in SENSORS]
+        with self._lock:
+            slab, i = self._locate(self._row_for(str(plant_id)))
+            head, count = slab.head[i], slab.count[i]
+            if count and timestamp < slab.timestamps[i, head + self.capacity - 1]:
+                return False
+            slab.timestamps[i, head] = slab.timestamps[i, head + self.capacity] = timestamp
+            slab.values[i, head] = slab.values[i, head + self.capacity] = [np.nan if v is None else v for v in values]
+            slab.head[i] = (head + 1) % self.capacity
+            slab.count[i] = min(count + 1, self.capacity)
+        return True
+
+    def window(self, plant_id, n=None):
+        """
+        The plant's last n readings, oldest first. Both arrays are views into the buffer, copy them to keep
+        them past the plant's next append.
+        :param n: readings wanted, None for all that are kept
+        :return: (epoch ms timestamps, values with one column per sensor in SENSORS order)
+        """
+        with self._lock:
+            row = self._rows.get(str(plant_id))
+            if row is None:
+                return np.empty(0, dtype=np.int64), np.empty((0, len(SENSORS)), dtype=np.float32)
+            slab, i = self._locate(row)
+            count = int(slab.count[i])
+            n = count if n is None else min(n, count)
+            end = int(slab.head[i]) + self.capacity
+        return slab.timestamps[i, end - n:end], slab.values[i, end - n:end]
+
+    def latest(self, plant_id):
+        """ (epoch ms, reading dict) of the plant's newest reading, None if there is none """
+        timestamps, values = self.window(plant_id, 1)
+        if not len(timestamps):
+            return None
+        return int(timestamps[0]), dict(zip(SENSORS, values[0].tolist()))
+
+    def slope(self, plant_id, sensor='moisture', n=None):
+        """
+        Least squares change per hour of a sensor over the plant's last n readings.
+        :return: slope, None with fewer than two readings at different times
+        """
+        timestamps, values = self.window(plant_id, n)
+        column = values[:, SENSORS.index(sensor)].astype(np.float64)
+        keep = ~np.isnan(column)
+        hours = (timestamps[keep] - timestamps[-1]) / 3600000.0 if len(timestamps) else timestamps
+        column = column[keep]
+        if len(column) < 2:
+            return None
+        hours = hours - hours.mean()
+        spread = (hours * hours).sum()
+        if spread == 0:
+            return None
+        return float((hours * (column - column.mean())).sum() / spread)
@@ -0,0 +1,118 @@
+'''
+Per plant minute/hour/day aggregates of sensor_data, kept up to date as readings are stored so
+charts over weeks or months read a few hundred rollup rows instead of every raw reading.
+Each bucket keeps count, and min, max, sum, count and the last value for every sensor (mean = <sensor>_sum /
+<sensor>_count). A sensor that sent null is left out of its own min/max/sum/count, not the others'.
+latest_readings is kept the same way, one row per plant with its newest reading.
+'''
+from timestamps import local_text
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# How to cut a '%Y-%m-%d %H:%M:%S.%f' timestamp down to the start of its bucket
+RESOLUTIONS = {
+    'minute': lambda timestamp: timestamp[:16] + ':00',
+    'hour': lambda timestamp: timestamp[:13] + ':00:00',
+    'day': lambda timestamp: timestamp[:10] + ' 00:00:00',
+}
+
+_columns = ', '.join(f'{s}_min, {s}_max, {s}_sum, {s}_count, {s}_last' for s in SENSORS)
+# Scalar MIN/MAX and + give NULL if either side is NULL, the COALESCEs keep whichever side has a value
+_updates = ',\n    '.join(
+    f'''{s}_min = COALESCE(MIN({s}_min, excluded.{s}_min), {s}_min, excluded.{s}_min),
+    {s}_max = COALESCE(MAX({s}_max, excluded.{s}_max), {s}_max, excluded.{s}_max),
+    {s}_sum = COALESCE({s}_sum + excluded.{s}_sum, {s}_sum, excluded.{s}_sum),
+    {s}_count = {s}_count + excluded.{s}_count,
+    {s}_last = CASE WHEN excluded.{s}_last IS NULL THEN {s}_last
+        WHEN {s}_last IS NULL OR excluded.last_timestamp >= last_timestamp THEN excluded.{s}_last
+        ELSE {s}_last END'''
+    for s in SENSORS
+)
+
+# In an UPDATE every column on the right hand side is still the old value, so the order here doesn't matter.
+# Batches can arrive out of order, the last_* values only move forward in time.
+UPSERT_SQL = f'''
+    INSERT INTO sensor_rollups (plant_id, resolution, bucket_start, last_timestamp, count, {_columns})
+    VALUES (?, ?, ?, ?, 1, {', '.join('?' for _ in range(5 * len(SENSORS)))})
+    ON CONFLICT (plant_id, resolution, bucket_start) DO UPDATE SET
+    count = count + 1,
+    last_timestamp = MAX(last_timestamp, excluded.last_timestamp),
+    {_updates}
+'''
+
+
+def create_rollup_table(cursor):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS sensor_rollups (
+            plant_id TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            last_timestamp TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            {', '.join(f'{s}_min REAL, {s}_max REAL, {s}_sum REAL, {s}_count INTEGER NOT NULL DEFAULT 0, {s}_last REAL'
+                       for s in SENSORS)},
+            PRIMARY KEY (plant_id, resolution, bucket_start)
+        ) WITHOUT ROWID
+    ''')
+
+
+def rollup_rows(readings):
+    """
+    Turn stored readings into upsert parameters, one per resolution.
+    :param readings: iterable of (plant_id, moisture, temperature, humidity, light_level, timestamp) rows,
+    the same shape they are inserted into sensor_data with. Timestamps are epoch ms, or text before migration 5
+    """
+    for plant_id, moisture, temperature, humidity, light_level, timestamp in readings:
+        # Buckets are local calendar minutes/hours/days
+        timestamp = local_text(timestamp)
+        values = []
+        for value in (moisture, temperature, humidity, light_level):
+            # min, max, sum and last all start as the reading itself, a null one isn't counted
+            values.extend((value, value, value, 0 if value is None else 1, value))
+        for resolution, bucket in RESOLUTIONS.items():
+            yield (plant_id, resolution, bucket(timestamp), timestamp, *values)
+
+
+def sensor_counts(cursor):
+    """
+    {sensor: column holding how many of its readings a sensor_rollups row has}. Rows from before the per sensor
+    counts (migration 12) only have count, exact for them since any null reading made the sensor's sum NULL.
+    """
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(sensor_rollups)')}
+    return {s: f'{s}_count' if f'{s}_count' in columns else 'count' for s in SENSORS}
+
+
+def update_rollups(cursor, readings):
+    """ Add readings to their minute/hour/day buckets, run it in the same transaction as the sensor_data insert """
+    cursor.executemany(UPSERT_SQL, rollup_rows(readings))
+
+
+# Same rule as the rollups' last_* values, an older reading arriving late never replaces a newer one
+LATEST_UPSERT_SQL = f'''
+    INSERT INTO latest_readings (plant_id, {', '.join(SENSORS)}, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (plant_id) DO UPDATE SET
+    {', '.join(f'{s} = excluded.{s}' for s in SENSORS)},
+    timestamp = excluded.timestamp
+    WHERE excluded.timestamp >= latest_readings.timestamp
+'''
+
+
+def create_latest_table(cursor):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS latest_readings (
+            plant_id TEXT PRIMARY KEY,
+            {', '.join(f'{s} REAL' for s in SENSORS)},
+            timestamp TEXT NOT NULL
+        )
+    ''')
+
+
+def update_latest(cursor, readings):
+    """ Move each plant's latest reading forward, same row shape and transaction as update_rollups """
+    latest = {}
+    for row in readings:
+        # >= so the later of two readings with the same timestamp wins, like the upsert
+        if row[0] not in latest or row[5] >= latest[row[0]][5]:
+            latest[row[0]] = row
+    cursor.executemany(LATEST_UPSERT_SQL, latest.values())
@@ -0,0 +1,133 @@
+'''
+Seasonality aggregates kept up to date at ingest, so the seasonality view never groups raw history.
+seasonality_cube holds a sum and count per plant, sensor, day of week and hour of day (24 x 7 cells).
+seasonality_hourly is a ring of the last HOURLY_SLOTS hourly sums per plant and sensor, the series the
+autocorrelation is computed on. Both stay the same size however long the history gets.
+Hours and weekdays are the Pi's local time, like the rollup buckets.
+'''
+from collections import defaultdict
+from datetime import datetime
+from timestamps import from_epoch_ms
+from rollups import sensor_counts
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+# Four weeks of hours, plenty for the ACF's 60 lags and the daily/weekly cycles
+HOURLY_SLOTS = 24 * 28
+
+CUBE_UPSERT_SQL = '''
+    INSERT INTO seasonality_cube (plant_id, sensor, weekday, hour, sum, count) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (plant_id, sensor, weekday, hour) DO UPDATE SET
+    sum = sum + excluded.sum,
+    count = count + excluded.count
+'''
+
+# A slot is reused once the ring comes round again, readings older than what the slot holds are dropped
+HOURLY_UPSERT_SQL = '''
+    INSERT INTO seasonality_hourly (plant_id, sensor, slot, hour_index, sum, count) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (plant_id, sensor, slot) DO UPDATE SET
+    sum = CASE WHEN excluded.hour_index = hour_index THEN sum + excluded.sum ELSE excluded.sum END,
+    count = CASE WHEN excluded.hour_index = hour_index THEN count + excluded.count ELSE excluded.count END,
+    hour_index = excluded.hour_index
+    WHERE excluded.hour_index >= seasonality_hourly.hour_index
+'''
+
+
+def create_seasonality_tables(cursor):
+    # weekday 0 is Monday, like pandas' dayofweek
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS seasonality_cube (
+            plant_id TEXT NOT NULL,
+            sensor TEXT NOT NULL,
+            weekday INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            sum REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (plant_id, sensor, weekday, hour)
+        ) WITHOUT ROWID
+    ''')
+    # hour_index counts local hours since 0001-01-01, slot is hour_index % HOURLY_SLOTS
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS seasonality_hourly (
+            plant_id TEXT NOT NULL,
+            sensor TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            hour_index INTEGER NOT NULL,
+            sum REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (plant_id, sensor, slot)
+        ) WITHOUT ROWID
+    ''')
+
+
+def hour_index(moment):
+    """ Local hours since 0001-01-01 for a naive local datetime """
+    return moment.toordinal() * 24 + moment.hour
+
+
+def seasonality_rows(readings):
+    """
+    Sum readings per cube cell and per hour before they hit the upserts.
+    :param readings: rows shaped like the sensor_data insert, timestamps in epoch ms
+    :return: (cube upsert parameters, hourly upsert parameters)
+    """
+    cube = defaultdict(lambda: [0.0, 0])
+    hourly = defaultdict(lambda: [0.0, 0])
+    for row in readings:
+        moment = from_epoch_ms(row[5])
+        index = hour_index(moment)
+        for i, sensor in enumerate(SENSORS):
+            value = row[i + 1]
+            if value is None:
+                continue
+            add(cube[(row[0], sensor, moment.weekday(), moment.hour)], value, 1)
+            add(hourly[(row[0], sensor, index)], value, 1)
+    return (
+        [(*key, total, count) for key, (total, count) in cube.items()],
+        [(plant_id, sensor, index % HOURLY_SLOTS, index, total, count)
+         for (plant_id, sensor, index), (total, count) in hourly.items()]
+    )
+
+
+def add(cell, total, count):
+    cell[0] += total
+    cell[1] += count
+
+
+def update_seasonality(cursor, readings):
+    """ Add readings to the cube and the hourly ring, run it in the same transaction as the sensor_data insert """
+    cube, hourly = seasonality_rows(readings)
+    cursor.executemany(CUBE_UPSERT_SQL, cube)
+    cursor.executemany(HOURLY_UPSERT_SQL, hourly)
+
+
+def backfill_from_rollups(cursor):
+    """ Fill both tables from the hourly rollups, which are kept forever and already summed per hour """
+    cube = defaultdict(lambda: [0.0, 0])
+    hourly = defaultdict(lambda: [0.0, 0])
+    newest = {}
+    counts = sensor_counts(cursor)
+    read = cursor.execute(f'''
+        SELECT plant_id, bucket_start, {', '.join(f'{s}_sum, {counts[s]}' for s in SENSORS)}
+        FROM sensor_rollups WHERE resolution = 'hour'
+    ''')
+    while True:
+        rows = read.fetchmany(5000)
+        if not rows:
+            break
+        for plant_id, bucket_start, *values in rows:
+            moment = datetime.strptime(bucket_start, '%Y-%m-%d %H:%M:%S')
+            index = hour_index(moment)
+            for sensor, total, count in zip(SENSORS, values[::2], values[1::2]):
+                if total is None or not count:
+                    continue
+                add(cube[(plant_id, sensor, moment.weekday(), moment.hour)], total, count)
+                add(hourly[(plant_id, sensor, index)], total, count)
+                newest[(plant_id, sensor)] = max(newest.get((plant_id, sensor), index), index)
+    cursor.executemany(CUBE_UPSERT_SQL, [(*key, total, count) for key, (total, count) in cube.items()])
+    # Only the last HOURLY_SLOTS hours of each plant and sensor fit in the ring
+    cursor.executemany(HOURLY_UPSERT_SQL, [
+        (plant_id, sensor, index % HOURLY_SLOTS, index, total, count)
+        for (plant_id, sensor, index), (total, count) in hourly.items()
+        if index > newest[(plant_id, sensor)] - HOURLY_SLOTS
+    ])
@@ -0,0 +1,104 @@
+'''
+Compact binary payloads for the Arduino nodes, JSON stays the default.
+Every binary payload starts with a 4 byte header: version byte, record type, record count (uint16).
+The version byte is never '{' or '[' so a payload can be told apart from JSON by its first byte.
+
+Sensor record (24 bytes, little endian):
+    plant_id uint32 (0 = the topic's plant), timestamp uint32 epoch seconds (0 = when it arrived),
+    moisture, temperature, humidity, light_level float32
+Control record (7 bytes):
+    plant_id uint32, flags uint8 (bit 0 water pump on, bit 1 grow light on), watering duration uint16 seconds
+'''
+import struct
+
+VERSION = 0xA1
+SENSOR_RECORD = 0x01
+CONTROL_RECORD = 0x02
+
+HEADER = struct.Struct('<BBH')
+SENSOR = struct.Struct('<IIffff')
+CONTROL = struct.Struct('<IBH')
+
+WATER_FLAG = 0x01
+LIGHT_FLAG = 0x02
+
+
+def is_binary(payload):
+    """ True if the payload starts with our version byte rather than JSON """
+    return len(payload) >= HEADER.size and payload[0] == VERSION
+
+
+def _read_header(payload, record_type, record):
+    version, kind, count = HEADER.unpack_from(payload)
+    if version != VERSION or kind != record_type:
+        raise ValueError(f"Unsupported binary payload version {version} type {kind}")
+    if len(payload) != HEADER.size + count * record.size:
+        raise ValueError(f"Binary payload is {len(payload)} bytes, expected {count} records")
+    return memoryview(payload)[HEADER.size:]
+
+
+def decode_sensor_payload(payload):
+    """
+    Decode binary sensor records into the reading dicts the JSON path uses.
+    plant_id and timestamp are only set when the node filled them in.
+    :return: list of reading dicts
+    """
+    readings = []
+    for plant_id, timestamp, moisture, temperature, humidity, light_level in SENSOR.iter_unpack(
+            _read_header(payload, SENSOR_RECORD, SENSOR)):
+        reading = {
+            "moisture": moisture,
+            "temperature": temperature,
+            "humidity": humidity,
+            "light_level": light_level
+        }
+        if plant_id:
+            reading["plant_id"] = plant_id
+        if timestamp:
+            reading["timestamp"] = timestamp
+        readings.append(reading)
+    return readings
+
+
+def encode_sensor_payload(readings):
+    """ Encode reading dicts, mostly for tests and simulating nodes """
+    parts = [HEADER.pack(VERSION, SENSOR_RECORD, len(readings))]
+    for reading in readings:
+        parts.append(SENSOR.pack(
+            int(reading.get("plant_id", 0)),
+            int(reading.get("timestamp", 0)),
+            reading["moisture"],
+            reading["temperature"],
+            reading["humidity"],
+            reading["light_level"]
+        ))
+    return b"".join(parts)
+
+
+def encode_decisions(plant_id, decisions):
+    """
+    Encode the decision dicts PlantController returns.
+    :param plant_id: used for decisions that don't carry their own plant_id
+    """
+    parts = [HEADER.pack(VERSION, CONTROL_RECORD, len(decisions))]
+    for decision in decisions:
+        flags = 0
+        if decision["water_pump"]["active"]:
+            flags |= WATER_FLAG
+        if decision["grow_light"]["active"]:
+            flags |= LIGHT_FLAG
+        duration = min(max(int(decision["water_pump"]["duration"] or 0), 0), 0xFFFF)
+        parts.append(CONTROL.pack(int(decision.get("plant_id") or plant_id), flags, duration))
+    return b"".join(parts)
+
+
+def decode_decisions(payload):
+    """ Decode control records back into decision dicts """
+    return [
+        {
+            "plant_id": plant_id,
+            "water_pump": {"active": bool(flags & WATER_FLAG), "duration": duration},
+            "grow_light": {"active": bool(flags & LIGHT_FLAG)}
+        }
+        for plant_id, flags, duration in CONTROL.iter_unpack(_read_header(payload, CONTROL_RECORD, CONTROL))
+    ]
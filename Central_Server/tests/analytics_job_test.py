@@ -0,0 +1,83 @@
+import unittest
+import json
+import sqlite3
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+from helpers import DatabaseTestCase
+
+from ML_Service.analytics_job import AnalyticsJob, FLEET
+
+
+class AnalyticsJobTest(DatabaseTestCase):
+    test_db_name = "test_analytics_plant_data.db"
+
+    def setUp(self):
+        super().setUp()
+        self.job = AnalyticsJob(self.test_db_name)
+        self.rng = np.random.default_rng(1)
+
+    def tearDown(self):
+        self.job.close()
+        super().tearDown()
+
+    def store(self, plant_id, days, start=datetime(2025, 2, 1)):
+        rows = []
+        for i in range(days * 24):
+            moisture = self.rng.uniform(20, 80)
+            rows.append((plant_id, {
+                'moisture': moisture,
+                'temperature': 15 + moisture / 10 + self.rng.normal(),
+                'humidity': self.rng.uniform(40, 60),
+                'light_level': self.rng.uniform(0, 1000)
+            }, start + timedelta(hours=i)))
+        self.job.db.store_sensor_data_batch(rows)
+        # Q-Q quantiles come from the sketches, written out at checkpoints
+        self.job.db.checkpoint()
+
+    def stored(self, plant_id, kind):
+        conn = sqlite3.connect(self.test_db_name)
+        row = conn.execute("SELECT payload FROM analytics WHERE plant_id = ? AND kind = ?", (plant_id, kind)).fetchone()
+        conn.close()
+        return json.loads(row[0])
+
+    def raw_frame(self, plant_id=None):
+        conn = sqlite3.connect(self.test_db_name)
+        where = f"WHERE plant_id = '{plant_id}'" if plant_id else ''
+        df = pd.read_sql_query(f"SELECT moisture, temperature, humidity, light_level FROM sensor_data {where}", conn)
+        conn.close()
+        return df
+
+    def test_incremental_matches_full_recompute(self):
+        """Test correlations updated from only the new rows match pandas over everything"""
+        self.store(101, 5)
+        self.store(102, 5)
+        self.assertEqual(sorted(self.job.run_once()), ['101', '102'])
+        # Nothing new, nothing recomputed
+        self.assertEqual(self.job.run_once(), [])
+
+        self.store(101, 3, start=datetime(2025, 2, 6))
+        self.assertEqual(self.job.run_once(), ['101'])
+
+        for plant_id in ('101', FLEET):
+            expected = self.raw_frame(plant_id).corr().to_numpy()
+            matrix = np.array(self.stored(plant_id, 'correlation')['matrix'], dtype=float)
+            np.testing.assert_allclose(matrix, expected, atol=1e-3)
+
+    def test_qq_quantiles(self):
+        """Test Q-Q quantiles are stored per plant"""
+        self.store(101, 6)
+        self.job.run_once()
+
+        qq = self.stored('101', 'qq')['moisture']
+        data = self.raw_frame('101')['moisture']
+        self.assertEqual(qq['count'], len(data))
+        # From the t-digest, close to the exact quantiles rather than equal
+        np.testing.assert_allclose(qq['quantiles'], np.quantile(data, qq['probabilities']), atol=1.0)
+        self.assertAlmostEqual(qq['mean'], data.mean())
+        self.assertAlmostEqual(qq['std'], data.std(ddof=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import json
+
+import helpers  # puts Central_Server and Front_End on sys.path
+
+import sensor_codec
+
+
+class SensorCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.readings = [
+            {"plant_id": 101, "timestamp": 1740148200, "moisture": 45.5, "temperature": 22.5,
+             "humidity": 60.0, "light_level": 850.0},
+            {"moisture": 30.0, "temperature": 21.0, "humidity": 55.5, "light_level": 0.0},
+        ]
+
+    def test_sensor_round_trip(self):
+        """Test readings survive encoding, and unset plant_id/timestamp stay unset"""
+        payload = sensor_codec.encode_sensor_payload(self.readings)
+
+        self.assertTrue(sensor_codec.is_binary(payload))
+        self.assertEqual(len(payload), sensor_codec.HEADER.size + 2 * sensor_codec.SENSOR.size)
+        self.assertEqual(sensor_codec.decode_sensor_payload(payload), self.readings)
+
+    def test_json_is_not_binary(self):
+        """Test JSON objects and lists are never mistaken for binary payloads"""
+        self.assertFalse(sensor_codec.is_binary(json.dumps(self.readings[0]).encode()))
+        self.assertFalse(sensor_codec.is_binary(json.dumps(self.readings).encode()))
+        self.assertFalse(sensor_codec.is_binary(b""))
+
+    def test_truncated_payload_rejected(self):
+        """Test a payload shorter than its record count says is refused"""
+        payload = sensor_codec.encode_sensor_payload(self.readings)
+        with self.assertRaises(ValueError):
+            sensor_codec.decode_sensor_payload(payload[:-1])
+
+    def test_decisions_round_trip(self):
+        """Test control decisions pack into 7 byte records and decode back"""
+        decisions = [
+            {"plant_id": None, "water_pump": {"active": True, "duration": 5}, "grow_light": {"active": True}},
+            {"plant_id": 102, "water_pump": {"active": False, "duration": 0}, "grow_light": {"active": False}},
+        ]
+        payload = sensor_codec.encode_decisions(101, decisions)
+
+        self.assertEqual(len(payload), sensor_codec.HEADER.size + 2 * sensor_codec.CONTROL.size)
+        decoded = sensor_codec.decode_decisions(payload)
+        self.assertEqual(decoded[0], {"plant_id": 101, "water_pump": {"active": True, "duration": 5},
+                                      "grow_light": {"active": True}})
+        self.assertEqual(decoded[1]["plant_id"], 102)
+        self.assertFalse(decoded[1]["water_pump"]["active"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+from datetime import datetime
+
+from helpers import DatabaseTestCase
+
+from db_handler import DataBaseHandler
+from data_loader import (SensorDataLoader, ChangeFeed, load_rollups, list_plants, data_date_range,
+                         load_range_correlation, load_rollup_series)
+import numpy as np
+from unittest.mock import patch
+import sqlite3
+from datetime import date
+
+
+class SensorDataLoaderTest(DatabaseTestCase):
+    test_db_name = "test_loader_plant_data.db"
+
+    def setUp(self):
+        super().setUp()
+        self.db_handler = DataBaseHandler(self.test_db_name)
+        self.reading = {'moisture': 0.5, 'temperature': 20.0, 'humidity': 60.0, 'light_level': 800}
+
+    def tearDown(self):
+        self.db_handler.close()
+        super().tearDown()
+
+    def test_only_new_rows_are_fetched(self):
+        """Test later loads append rows past the watermark and keep the frame within the ttl"""
+        self.db_handler.store_sensor_data_batch([('101', self.reading, datetime(2025, 2, 21, 14, 30, 0, 500000))])
+        loader = SensorDataLoader(self.test_db_name, ttl=3600)
+
+        first = loader.load()
+        self.assertEqual(len(first), 1)
+        self.assertEqual(first['timestamp'].iloc[0], datetime(2025, 2, 21, 14, 30))
+
+        self.db_handler.store_sensor_data_batch([('102', self.reading, datetime(2025, 2, 21, 14, 31))])
+        # Still within the ttl, same frame
+        self.assertIs(loader.load(), first)
+
+        second = loader.load(refresh=True)
+        self.assertEqual(list(second['plant_id']), ['101', '102'])
+        self.assertEqual(loader.last_id, int(second['id'].iloc[-1]))
+        # The frame handed out earlier is left alone
+        self.assertEqual(len(first), 1)
+
+    def test_pruned_rows_are_dropped(self):
+        """Test rows deleted by retention pruning disappear from the loaded frame"""
+        old = datetime.now().replace(year=datetime.now().year - 1)
+        self.db_handler.store_sensor_data_batch([('101', self.reading, old), ('101', self.reading, datetime.now())])
+        loader = SensorDataLoader(self.test_db_name, ttl=0)
+        self.assertEqual(len(loader.load()), 2)
+
+        self.db_handler.prune_sensor_data(retention_days=30)
+        frame = loader.load()
+        self.assertEqual(len(frame), 1)
+        self.assertEqual(list(frame.index), [0])
+
+    def test_plant_and_time_filter(self):
+        """Test only the selected plant and [start, end) range are loaded, raw and rolled up"""
+        self.db_handler.store_sensor_data_batch([
+            ('101', self.reading, datetime(2025, 2, 20, 23, 59, 59, 900000)),
+            ('101', self.reading, datetime(2025, 2, 21, 0, 0, 0)),
+            ('102', self.reading, datetime(2025, 2, 21, 12, 0)),
+            ('101', self.reading, datetime(2025, 2, 21, 23, 59, 59, 999999)),
+            ('101', self.reading, datetime(2025, 2, 22, 0, 0)),
+        ])
+        start, end = datetime(2025, 2, 21), datetime(2025, 2, 22)
+        frame = SensorDataLoader(self.test_db_name, plant_id=101, start=start, end=end).load()
+        self.assertEqual(list(frame['timestamp'].dt.day), [21, 21])
+        self.assertEqual(set(frame['plant_id']), {'101'})
+
+        conn = sqlite3.connect(self.test_db_name)
+        try:
+            daily = load_rollups(conn, 'day', plant_id=101, start=start, end=end)
+            self.assertEqual(list(daily['count']), [2])
+            self.assertEqual(list(load_rollups(conn, 'day', start=start, end=end)['count']), [3])
+            self.assertEqual(list_plants(conn), ['101', '102'])
+            self.assertEqual(data_date_range(conn), (date(2025, 2, 20), date(2025, 2, 22)))
+        finally:
+            conn.close()
+
+    def test_rollup_series_means(self):
+        """Test rollup means divide by each sensor's own count, a bucket of only nulls is NaN not 0"""
+        self.db_handler.store_sensor_data_batch([
+            ('101', self.reading, datetime(2025, 2, 21, 14, 10)),
+            ('101', dict(self.reading, moisture=None, temperature=30.0), datetime(2025, 2, 21, 14, 20)),
+            ('101', dict(self.reading, moisture=None), datetime(2025, 2, 21, 15, 20)),
+        ])
+        conn = sqlite3.connect(self.test_db_name)
+        series = load_rollup_series(conn, 'hour', plant_id=101)
+        conn.close()
+
+        self.assertEqual(list(series['moisture'][:1]), [0.5])
+        self.assertTrue(np.isnan(series['moisture'].iloc[1]))
+        self.assertEqual(list(series['temperature']), [25.0, 20.0])
+
+    def test_range_correlation(self):
+        """Test the date range correlation matches numpy over only the readings in the range and plant"""
+        rng = np.random.default_rng(3)
+        values = rng.normal([50, 20, 60, 800], [10, 2, 5, 100], size=(40, 4))
+        values[:, 1] += values[:, 0] * 0.3
+        # 20 readings on the 21st, 20 on the 22nd
+        rows = [('101', dict(zip(('moisture', 'temperature', 'humidity', 'light_level'), row)),
+                 datetime(2025, 2, 21 + i // 20, 12, i % 20)) for i, row in enumerate(values)]
+        # Another plant, and a reading missing a sensor, neither counted
+        rows.append(('102', dict(self.reading), datetime(2025, 2, 21, 13)))
+        rows.append(('101', dict(self.reading, humidity=None), datetime(2025, 2, 21, 13)))
+        self.db_handler.store_sensor_data_batch(rows)
+        conn = sqlite3.connect(self.test_db_name)
+        result = load_range_correlation(conn, '101', datetime(2025, 2, 21), datetime(2025, 2, 22))
+        self.assertIsNone(load_range_correlation(conn, '101', datetime(2025, 3, 1), None))
+        conn.close()
+
+        self.assertEqual(result['sensors'], ['moisture', 'temperature', 'humidity', 'light_level'])
+        np.testing.assert_allclose(np.array(result['matrix'], dtype=float), np.corrcoef(values[:20].T), atol=1e-4)
+
+    def test_change_feed_pushes_to_loaders(self):
+        """Test live loaders get new rows from one shared feed query instead of querying themselves"""
+        self.db_handler.store_sensor_data_batch([('101', self.reading, datetime(2025, 2, 21, 14, 30))])
+        conn = sqlite3.connect(self.test_db_name)
+        feed = ChangeFeed(self.test_db_name)
+        feed.poll(conn)
+        plant_loader = SensorDataLoader(self.test_db_name, plant_id=101, feed=feed)
+        fleet_loader = SensorDataLoader(self.test_db_name, feed=feed)
+        self.assertEqual(len(plant_loader.load()), 1)
+        self.assertEqual(len(fleet_loader.load()), 1)
+
+        self.db_handler.store_sensor_data_batch([
+            ('101', self.reading, datetime(2025, 2, 21, 14, 31)),
+            ('102', self.reading, datetime(2025, 2, 21, 14, 32)),
+        ])
+        feed.poll(conn)
+        with patch.object(SensorDataLoader, '_fetch_new_rows') as fetch:
+            self.assertEqual(list(plant_loader.load()['plant_id']), ['101', '101'])
+            self.assertEqual(list(fleet_loader.load()['plant_id']), ['101', '101', '102'])
+            fetch.assert_not_called()
+        self.assertEqual(fleet_loader.load()['timestamp'].iloc[-1], datetime(2025, 2, 21, 14, 32))
+
+        # A closed loader stops getting rows
+        plant_loader.close()
+        self.db_handler.store_sensor_data_batch([('101', self.reading, datetime(2025, 2, 21, 14, 33))])
+        feed.poll(conn)
+        self.assertEqual(len(plant_loader.load()), 2)
+        self.assertEqual(len(fleet_loader.load()), 4)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,22 +1,26 @@
 import unittest
 import sqlite3
+import threading
 from datetime import datetime
-from Central_Server.db_handler import DataBaseHandler
 import os
-class TestDB(unittest.TestCase):
+
+from helpers import DatabaseTestCase
+
+from Central_Server.db_handler import DataBaseHandler
+from Central_Server.migrations import LATEST_VERSION, migrate
+from Central_Server.timestamps import to_epoch_ms
+class TestDB(DatabaseTestCase):
+    test_db_name = "test_plant_data.db"
+
     def setUp(self):
         """ Run before each test """
-        self.test_db_name = "test_plant_data.db"
-        if os.path.exists(self.test_db_name):
-            os.remove(self.test_db_name)
-
+        super().setUp()
         self.db_handler = DataBaseHandler(self.test_db_name)
 
     def tearDown(self):
         """ Run after each test """
-        #Clean up the database after testing
-        if os.path.exists(self.test_db_name):
-            os.remove(self.test_db_name)
+        self.db_handler.close()
+        super().tearDown()
 
     def test_init_db(self):
         """ Test if database and tables are created correctly """
@@ -116,5 +120,255 @@ class TestDB(unittest.TestCase):
         settings = self.db_handler.get_plant_settings('nonexistent_plant')
         self.assertIsNone(settings)
 
+    def test_wal_mode(self):
+        """Test the pooled connections switch the database to WAL"""
+        conn = sqlite3.connect(self.test_db_name)
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+        self.assertEqual(mode, 'wal')
+
+    def test_connection_reused_per_thread(self):
+        """Test a thread keeps its connection and other threads get their own"""
+        conn = self.db_handler.pool.connection()
+        self.assertIs(conn, self.db_handler.pool.connection())
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.db_handler.pool.connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(conn, other[0])
+
+    def test_close_reopens(self):
+        """Test the handler still works after its connections are closed"""
+        self.db_handler.close()
+        self.db_handler.set_plant_settings('test_plant5', 'herbs')
+        self.assertIsNotNone(self.db_handler.get_plant_settings('test_plant5'))
+
+    def test_get_plant_settings_cached(self):
+        """Test settings are served from memory until settings_version moves"""
+        self.db_handler.set_plant_settings('test_plant6', 'herbs')
+        self.db_handler.settings_check_interval = 60
+        self.assertEqual(self.db_handler.get_plant_settings('test_plant6')['moisture_threshold'], 0.6)
+
+        # Change it behind the handler's back, the way the dashboard form does
+        conn = sqlite3.connect(self.test_db_name)
+        conn.execute("UPDATE plant_settings SET moisture_threshold = 0.2 WHERE plant_id = 'test_plant6'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.db_handler.get_plant_settings('test_plant6')['moisture_threshold'], 0.6)
+
+        # Once the version is checked again the cached copy is dropped
+        self.db_handler.settings_check_interval = 0
+        self.assertEqual(self.db_handler.get_plant_settings('test_plant6')['moisture_threshold'], 0.2)
+
+    def test_set_plant_settings_invalidates_cache(self):
+        """Test set_plant_settings replaces what the cache serves straight away"""
+        self.db_handler.settings_check_interval = 60
+        self.db_handler.set_plant_settings('test_plant7', 'herbs')
+        self.assertEqual(self.db_handler.get_plant_settings('test_plant7')['plant_type'], 'herbs')
+
+        self.db_handler.set_plant_settings('test_plant7', 'tropical')
+        self.assertEqual(self.db_handler.get_plant_settings('test_plant7')['plant_type'], 'tropical')
+
+    def test_schema_version(self):
+        """Test a new database is created at the latest schema version with the sensor_data index"""
+        conn = sqlite3.connect(self.test_db_name)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        indexes = [row[1] for row in conn.execute("PRAGMA index_list(sensor_data)")]
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM sensor_data WHERE plant_id = '101' AND timestamp > '2025-01-01'"
+        ).fetchall()
+        conn.close()
+
+        self.assertEqual(version, LATEST_VERSION)
+        self.assertIn("idx_sensor_data_plant_time", indexes)
+        self.assertIn("idx_sensor_data_plant_time", " ".join(str(row) for row in plan))
+
+    def test_date_range_uses_time_index(self):
+        """Test the dashboard's all plants date range query is answered from the timestamp index"""
+        conn = sqlite3.connect(self.test_db_name)
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM sensor_data WHERE timestamp >= ? AND timestamp < ? ORDER BY id",
+            (1740000000000, 1740100000000)
+        ).fetchall()
+        conn.close()
+
+        self.assertIn("idx_sensor_data_time", " ".join(str(row) for row in plan))
+
+    def test_upgrade_existing_database(self):
+        """Test a plant_data.db from before migrations is upgraded in place and keeps its rows"""
+        self.db_handler.close()
+        os.remove(self.test_db_name)
+        conn = sqlite3.connect(self.test_db_name)
+        conn.execute('''
+            CREATE TABLE sensor_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                plant_id,
+                moisture REAL,
+                temperature REAL,
+                humidity REAL,
+                light_level REAL,
+                timestamp DATETIME
+            )
+        ''')
+        conn.execute("INSERT INTO sensor_data VALUES (1, 101, 0.5, 25.0, 60.0, 800, '2025-02-21 14:30:22.000001')")
+        conn.execute("INSERT INTO sensor_data VALUES (2, '101', 0.4, 24.0, 61.0, 700, '2025-02-21 14:31:22.000001')")
+        conn.execute("INSERT INTO sensor_data VALUES (3, NULL, 0.2, 23.0, 62.0, 600, '2025-02-21 14:32:22.000001')")
+        conn.commit()
+        conn.close()
+
+        self.db_handler = DataBaseHandler(self.test_db_name)
+
+        conn = sqlite3.connect(self.test_db_name)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        rows = conn.execute("SELECT id, plant_id, typeof(plant_id), moisture FROM sensor_data ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual(version, LATEST_VERSION)
+        self.assertEqual(rows, [(1, '101', 'text', 0.5), (2, '101', 'text', 0.4)])
+        # The row without a plant_id is set aside, not deleted
+        conn = sqlite3.connect(self.test_db_name)
+        quarantined = conn.execute("SELECT id, plant_id, moisture FROM sensor_data_quarantine").fetchall()
+        conn.close()
+        self.assertEqual(quarantined, [(3, None, 0.2)])
+        # latest_readings is backfilled from the newest row
+        conn = sqlite3.connect(self.test_db_name)
+        latest = conn.execute("SELECT plant_id, moisture FROM latest_readings").fetchall()
+        timestamps = conn.execute("SELECT timestamp, typeof(timestamp) FROM sensor_data ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual(latest, [('101', 0.4)])
+        # Text timestamps were local time, they become epoch milliseconds
+        self.assertEqual(timestamps, [
+            (to_epoch_ms(datetime(2025, 2, 21, 14, 30, 22)), 'integer'),
+            (to_epoch_ms(datetime(2025, 2, 21, 14, 31, 22)), 'integer'),
+        ])
+
+        # New rows continue after the old ids, the quarantined row's id 3 isn't handed out again
+        self.db_handler.store_sensor_data(101, {'moisture': 0.3, 'temperature': 20.0, 'humidity': 50.0, 'light_level': 600})
+        conn = sqlite3.connect(self.test_db_name)
+        last = conn.execute("SELECT id, plant_id FROM sensor_data ORDER BY id DESC").fetchone()
+        conn.close()
+        self.assertEqual(last, (4, '101'))
+
+    def test_rollups_updated_at_ingest(self):
+        """Test minute/hour/day rollups follow the readings, including out of order ones"""
+        readings = [
+            ('101', {'moisture': 0.5, 'temperature': 20.0, 'humidity': 60.0, 'light_level': 800}, datetime(2025, 2, 21, 14, 30, 10)),
+            ('101', {'moisture': 0.3, 'temperature': 22.0, 'humidity': 62.0, 'light_level': 900}, datetime(2025, 2, 21, 14, 30, 50)),
+            # Arrives last but is older, it must not become the bucket's last value
+            ('101', {'moisture': 0.7, 'temperature': 18.0, 'humidity': 58.0, 'light_level': 700}, datetime(2025, 2, 21, 14, 30, 0)),
+            ('101', {'moisture': 0.4, 'temperature': 21.0, 'humidity': 61.0, 'light_level': 850}, datetime(2025, 2, 21, 15, 5, 0)),
+        ]
+        self.db_handler.store_sensor_data_batch(readings)
+
+        conn = sqlite3.connect(self.test_db_name)
+        minute = conn.execute('''
+            SELECT count, moisture_min, moisture_max, moisture_sum, moisture_last FROM sensor_rollups
+            WHERE plant_id = '101' AND resolution = 'minute' AND bucket_start = '2025-02-21 14:30:00'
+        ''').fetchone()
+        hours = conn.execute('''
+            SELECT bucket_start, count FROM sensor_rollups
+            WHERE plant_id = '101' AND resolution = 'hour' ORDER BY bucket_start
+        ''').fetchall()
+        day = conn.execute('''
+            SELECT count, temperature_min, temperature_max, light_level_last FROM sensor_rollups
+            WHERE plant_id = '101' AND resolution = 'day'
+        ''').fetchone()
+        conn.close()
+
+        self.assertEqual(minute[:3], (3, 0.3, 0.7))
+        self.assertAlmostEqual(minute[3], 1.5)
+        self.assertEqual(minute[4], 0.3)
+        self.assertEqual(hours, [('2025-02-21 14:00:00', 3), ('2025-02-21 15:00:00', 1)])
+        self.assertEqual(day, (4, 18.0, 22.0, 850))
+
+    def test_null_reading_left_out_of_rollups(self):
+        """Test a sensor that sent null doesn't wipe its bucket's min/max/sum or count toward its mean"""
+        reading = {'moisture': 0.5, 'temperature': 20.0, 'humidity': 60.0, 'light_level': 800}
+        # Null first and last, so both sides of the upsert see a NULL
+        self.db_handler.store_sensor_data_batch([('101', dict(reading, moisture=None), datetime(2025, 2, 21, 14, 30))])
+        self.db_handler.store_sensor_data_batch([('101', reading, datetime(2025, 2, 21, 14, 30, 10))])
+        self.db_handler.store_sensor_data_batch([('101', dict(reading, moisture=None), datetime(2025, 2, 21, 14, 30, 20))])
+
+        conn = sqlite3.connect(self.test_db_name)
+        rows = conn.execute('''
+            SELECT resolution, count, moisture_min, moisture_max, moisture_sum, moisture_count, moisture_last,
+            temperature_count FROM sensor_rollups WHERE plant_id = '101' ORDER BY resolution
+        ''').fetchall()
+        conn.close()
+
+        self.assertEqual(rows, [(resolution, 3, 0.5, 0.5, 0.5, 1, 0.5, 3) for resolution in ('day', 'hour', 'minute')])
+
+    def test_rollup_counts_migration(self):
+        """Test rollups from before per sensor counts get them, 0 where a null reading had already made the sum NULL"""
+        reading = {'moisture': 0.5, 'temperature': 20.0, 'humidity': 60.0, 'light_level': 800}
+        self.db_handler.store_sensor_data_batch([('101', reading, datetime(2025, 2, 21, 14, 30)),
+                                                 ('101', reading, datetime(2025, 2, 21, 14, 31))])
+        self.db_handler.close()
+        conn = sqlite3.connect(self.test_db_name)
+        for sensor in ('moisture', 'temperature', 'humidity', 'light_level'):
+            conn.execute(f"ALTER TABLE sensor_rollups DROP COLUMN {sensor}_count")
+        conn.execute("UPDATE sensor_rollups SET moisture_sum = NULL WHERE resolution = 'minute' AND bucket_start LIKE '%14:31:00'")
+        conn.execute("PRAGMA user_version = 11")
+        conn.commit()
+        migrate(conn)
+        rows = conn.execute('''
+            SELECT resolution, bucket_start, moisture_count, temperature_count FROM sensor_rollups
+            ORDER BY resolution, bucket_start
+        ''').fetchall()
+        conn.close()
+        self.db_handler = DataBaseHandler(self.test_db_name)
+
+        self.assertEqual(rows, [('day', '2025-02-21 00:00:00', 2, 2), ('hour', '2025-02-21 14:00:00', 2, 2),
+                                ('minute', '2025-02-21 14:30:00', 1, 1), ('minute', '2025-02-21 14:31:00', 0, 1)])
+
+    def test_latest_readings_updated_at_ingest(self):
+        """Test latest_readings keeps each plant's newest reading and ignores late older ones"""
+        reading = {'moisture': 0.5, 'temperature': 20.0, 'humidity': 60.0, 'light_level': 800}
+        self.db_handler.store_sensor_data_batch([
+            ('101', dict(reading, moisture=0.4), datetime(2025, 2, 21, 14, 31)),
+            ('101', dict(reading, moisture=0.3), datetime(2025, 2, 21, 14, 30)),
+            ('102', dict(reading, moisture=0.6), datetime(2025, 2, 21, 14, 30)),
+        ])
+        # Arrives late from a gateway buffer, older than what we already have for 101
+        self.db_handler.store_sensor_data_batch([('101', dict(reading, moisture=0.9), datetime(2025, 2, 21, 14, 29))])
+        self.db_handler.store_sensor_data_batch([('102', dict(reading, moisture=0.7), datetime(2025, 2, 21, 14, 32))])
+
+        conn = sqlite3.connect(self.test_db_name)
+        latest = conn.execute("SELECT plant_id, moisture, timestamp FROM latest_readings ORDER BY plant_id").fetchall()
+        conn.close()
+        self.assertEqual(latest, [
+            ('101', 0.4, to_epoch_ms(datetime(2025, 2, 21, 14, 31))),
+            ('102', 0.7, to_epoch_ms(datetime(2025, 2, 21, 14, 32))),
+        ])
+
+    def test_prune_sensor_data(self):
+        """Test old raw readings are archived and removed while hour/day rollups stay"""
+        archive_name = "test_plant_archive.db"
+        self.db_handler.archive_db = archive_name
+        old = datetime.now().replace(year=datetime.now().year - 1)
+        reading = {'moisture': 0.5, 'temperature': 20.0, 'humidity': 60.0, 'light_level': 800}
+        self.db_handler.store_sensor_data_batch([('101', reading, old), ('101', reading, datetime.now())])
+
+        try:
+            removed = self.db_handler.prune_sensor_data(retention_days=30)
+            self.assertEqual(removed, 1)
+
+            conn = sqlite3.connect(self.test_db_name)
+            remaining = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+            day_buckets = conn.execute("SELECT COUNT(*) FROM sensor_rollups WHERE resolution = 'day'").fetchone()[0]
+            minute_buckets = conn.execute("SELECT COUNT(*) FROM sensor_rollups WHERE resolution = 'minute'").fetchone()[0]
+            conn.close()
+            self.assertEqual(remaining, 1)
+            self.assertEqual(day_buckets, 2)
+            self.assertEqual(minute_buckets, 1)
+
+            conn = sqlite3.connect(archive_name)
+            archived = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+            conn.close()
+            self.assertEqual(archived, 1)
+        finally:
+            if os.path.exists(archive_name):
+                os.remove(archive_name)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+import helpers  # puts Central_Server and Front_End on sys.path
+
+from downsample import downsample, lttb_indices, min_max_indices
+
+
+class DownsampleTest(unittest.TestCase):
+    def setUp(self):
+        n = 10000
+        self.df = pd.DataFrame({
+            'timestamp': pd.date_range('2025-01-01', periods=n, freq='min'),
+            'moisture': np.sin(np.linspace(0, 20, n)) * 10 + 50,
+        })
+        # A single reading spike that must still show on the chart
+        self.df.loc[4321, 'moisture'] = 99.0
+
+    def test_lttb_keeps_size_ends_and_peaks(self):
+        """Test LTTB returns the requested number of points including the ends and the spike"""
+        result = downsample(self.df, 'timestamp', 'moisture', points=500)
+
+        self.assertEqual(len(result), 500)
+        self.assertEqual(result.index[0], 0)
+        self.assertEqual(result.index[-1], len(self.df) - 1)
+        self.assertIn(4321, result.index)
+        self.assertTrue(result['timestamp'].is_monotonic_increasing)
+
+    def test_lttb_buckets_follow_time(self):
+        """Test a dense burst of readings doesn't take more than its share of the time range"""
+        # A day of minute readings, then an hour of readings every second
+        x = np.concatenate([np.arange(0, 86400, 60), 86400 + np.arange(3600)]).astype(float)
+        y = np.sin(x / 1000)
+        indices = lttb_indices(x, y, 100)
+
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], len(x) - 1)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        # The last hour is 1/25th of the time, so it gets about 4 of the 98 buckets, not most of them
+        self.assertLessEqual(np.sum(x[indices[1:-1]] >= 86400), 5)
+
+    def test_lttb_skips_empty_buckets(self):
+        """Test a gap in the readings gives fewer points instead of empty buckets"""
+        x = np.concatenate([np.arange(50), 1000 + np.arange(50)]).astype(float)
+        indices = lttb_indices(x, x % 7, 20)
+
+        self.assertLess(len(indices), 20)
+        self.assertEqual(len(np.unique(indices)), len(indices))
+        self.assertEqual((indices[0], indices[-1]), (0, 99))
+
+    def test_min_max_keeps_extremes(self):
+        """Test min/max buckets keep the overall extremes"""
+        result = downsample(self.df, 'timestamp', 'moisture', points=200, method='minmax')
+
+        self.assertLessEqual(len(result), 200)
+        self.assertEqual(result['moisture'].max(), 99.0)
+        self.assertEqual(result['moisture'].min(), self.df['moisture'].min())
+
+    def test_small_and_unsorted_series_pass_through(self):
+        """Test short series are only sorted and NaN readings are dropped"""
+        small = self.df.iloc[[5, 3, 4]].copy()
+        small.loc[4, 'moisture'] = np.nan
+        result = downsample(small, 'timestamp', 'moisture', points=500)
+
+        self.assertEqual(list(result.index), [3, 5])
+
+    def test_indices_without_enough_points(self):
+        """Test asking for more points than there are returns everything"""
+        x = np.arange(5, dtype=float)
+        self.assertEqual(list(lttb_indices(x, x, 10)), [0, 1, 2, 3, 4])
+        self.assertEqual(list(min_max_indices(x, x, 10)), [0, 1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import sqlite3
+from datetime import date, datetime, timedelta
+import numpy as np
+
+from helpers import DatabaseTestCase
+
+from drift_engine import SensorDrift, FLEET
+from db_handler import DataBaseHandler
+
+
+class SensorDriftTest(unittest.TestCase):
+    def feed(self, state, means, start=date(2025, 3, 1)):
+        """ One reading per day, returns the closed day records """
+        records = []
+        for i, mean in enumerate(means):
+            record = state.add(start + timedelta(days=i), mean)
+            if record:
+                records.append(record)
+        return records
+
+    def test_window_matches_numpy(self):
+        """Test the sliding Welford window matches mean/std over the last days"""
+        means = np.random.default_rng(3).normal(50, 5, size=40)
+        state = SensorDrift(window_days=7)
+        records = self.feed(state, means)
+
+        # Day i is checked against the 7 days before it
+        for i, record in enumerate(records):
+            window = means[max(0, i - 7):i]
+            self.assertEqual(record[5], len(window))
+            if len(window) > 1:
+                self.assertAlmostEqual(record[3], window.mean())
+                self.assertAlmostEqual(record[4], window.std(ddof=1))
+
+        # Survives a round trip through drift_state
+        restored = SensorDrift.from_json(state.to_json())
+        self.assertAlmostEqual(restored.window_std(), state.window_std())
+        self.assertEqual(restored.day, state.day)
+
+    def test_alert_on_shift(self):
+        """Test a day leaving the band alerts, only once the window is full"""
+        state = SensorDrift(window_days=5)
+        records = self.feed(state, [50, 51, 49, 50, 51, 50, 80, 50])
+        alerts = [record[0] for record in records if record[-1]]
+        self.assertEqual(alerts, ['2025-03-07'])
+
+        # A shift before the window filled up is not an alert
+        state = SensorDrift(window_days=5)
+        records = self.feed(state, [50, 51, 80, 50])
+        self.assertFalse(any(record[-1] for record in records))
+
+    def test_late_reading_ignored(self):
+        """Test readings for an already closed day don't change the current day"""
+        state = SensorDrift()
+        state.add(date(2025, 3, 2), 10.0)
+        self.assertIsNone(state.add(date(2025, 3, 1), 1000.0))
+        self.assertEqual(state.day_count, 1)
+        self.assertEqual(state.day_mean, 10.0)
+
+
+class DriftIngestTest(DatabaseTestCase):
+    test_db_name = "test_drift_plant_data.db"
+
+    def setUp(self):
+        super().setUp()
+        self.db = DataBaseHandler(self.test_db_name)
+        self.db.drift.window_days = 3
+        self.alerts = []
+        self.db.drift.listeners.append(self.alerts.append)
+
+    def tearDown(self):
+        self.db.close()
+        super().tearDown()
+
+    def store_days(self, plant_id, moistures, start=datetime(2025, 3, 1, 12)):
+        self.db.store_sensor_data_batch([
+            (plant_id, {'moisture': moisture, 'temperature': 20.0, 'humidity': 50.0, 'light_level': 300.0},
+             start + timedelta(days=i))
+            for i, moisture in enumerate(moistures)
+        ])
+
+    def test_ingest_writes_history_and_alerts(self):
+        """Test batches close days into drift_history and alerts reach the listeners"""
+        self.store_days(101, [40, 41, 39])
+        self.store_days(101, [40, 90], start=datetime(2025, 3, 4, 12))
+
+        conn = sqlite3.connect(self.test_db_name)
+        # Nothing is written until the checkpoint
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM drift_history").fetchone()[0], 0)
+        self.db.checkpoint()
+        days = conn.execute(
+            "SELECT day, alert FROM drift_history WHERE plant_id = '101' AND sensor = 'moisture' ORDER BY day"
+        ).fetchall()
+        fleet_days = conn.execute(
+            "SELECT COUNT(*) FROM drift_history WHERE plant_id = ? AND sensor = 'moisture'", (FLEET,)
+        ).fetchone()[0]
+        conn.close()
+
+        # The last day is still open
+        self.assertEqual([day for day, _ in days], ['2025-03-01', '2025-03-02', '2025-03-03', '2025-03-04'])
+        self.assertFalse(any(alert for _, alert in days))
+        self.assertEqual(fleet_days, 4)
+        self.assertEqual(self.alerts, [])
+
+        # Closing the 90 day raises the alert for the plant and the fleet
+        self.store_days(101, [40], start=datetime(2025, 3, 6, 12))
+        self.assertEqual(sorted(alert['plant_id'] for alert in self.alerts if alert['sensor'] == 'moisture'), [FLEET, '101'])
+
+
+if __name__ == '__main__':
+    unittest.main()
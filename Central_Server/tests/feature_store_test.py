@@ -0,0 +1,138 @@
+import unittest
+import math
+import sqlite3
+from datetime import datetime, timedelta
+
+from helpers import DatabaseTestCase
+
+from db_handler import DataBaseHandler
+from ML_Service.ml_db_handler import MLDataBaseHandler
+from ML_Service.feature_store import FeatureState, replay, watering_times, FEATURES
+from timestamps import to_epoch_ms
+
+
+class FeatureStoreTest(DatabaseTestCase):
+    test_db_name = "test_features_plant_data.db"
+
+    def setUp(self):
+        super().setUp()
+        self.db = DataBaseHandler(self.test_db_name)
+        self.start = datetime(2025, 5, 1, 8)
+
+    def tearDown(self):
+        self.db.close()
+        super().tearDown()
+
+    def rows(self, plant_id, count, offset=0):
+        # Moisture falls 2 per hour, a reading every 10 minutes
+        return [
+            (plant_id, {'moisture': 80 - (i / 3), 'temperature': 20.0, 'humidity': 50.0, 'light_level': 300.0},
+             self.start + timedelta(minutes=10 * i))
+            for i in range(offset, offset + count)
+        ]
+
+    def stored_readings(self):
+        conn = sqlite3.connect(self.test_db_name)
+        readings = conn.execute('''
+            SELECT plant_id, moisture, temperature, humidity, light_level, timestamp FROM sensor_data ORDER BY timestamp
+        ''').fetchall()
+        waterings = watering_times(conn.cursor())
+        conn.close()
+        return readings, waterings
+
+    def assertFeaturesEqual(self, actual, expected):
+        self.assertEqual(list(actual), list(FEATURES))
+        for name in FEATURES:
+            if math.isnan(expected[name]):
+                self.assertTrue(math.isnan(actual[name]), name)
+            else:
+                self.assertAlmostEqual(actual[name], expected[name], places=6, msg=name)
+
+    def test_features_of_a_steady_decline(self):
+        """Test slope, EWMA and the daily integrals on readings with a known shape"""
+        state = FeatureState()
+        for plant_id, reading, timestamp in self.rows('101', 13):
+            state.update(to_epoch_ms(timestamp), reading)
+        features = state.features()
+        self.assertAlmostEqual(features['moisture_slope_1h'], -2.0)
+        self.assertAlmostEqual(features['moisture_slope_6h'], -2.0)
+        # Lags behind a falling series
+        self.assertGreater(features['moisture_ewma'], features['moisture'])
+        self.assertAlmostEqual(features['degree_hours'], 10.0 * 2)
+        self.assertAlmostEqual(features['light_integral'], 300.0 * 2)
+        self.assertTrue(math.isnan(features['hours_since_watering']))
+        # Late readings are ignored
+        self.assertFalse(state.update(to_epoch_ms(self.start), {'moisture': 0.0}))
+
+    def test_ingest_matches_replay(self):
+        """Test features kept at ingest (across batches and a restart) equal a replay of the stored history"""
+        ml_db = MLDataBaseHandler(self.test_db_name)
+        self.db.store_sensor_data_batch(self.rows('101', 20) + self.rows('102', 5))
+        event_id = ml_db.store_watering_event_initial('101', 70, 10)
+        conn = sqlite3.connect(self.test_db_name)
+        # Watered between the 20th and 21st reading
+        watered_at = self.start + timedelta(minutes=195)
+        conn.execute('UPDATE watering_events SET timestamp = ? WHERE id = ?', (str(watered_at), event_id))
+        conn.commit()
+        conn.close()
+        self.db.features.record_watering('101', watered_at)
+        self.db.store_sensor_data_batch(self.rows('101', 10, offset=20))
+
+        # A new handler picks the stored state up
+        self.db.close()
+        self.db = DataBaseHandler(self.test_db_name)
+        self.db.store_sensor_data_batch(self.rows('101', 5, offset=30))
+
+        readings, waterings = self.stored_readings()
+        replayed = {}
+        for plant_id, timestamp, features in replay(readings, waterings):
+            replayed[plant_id] = features
+        self.assertFeaturesEqual(self.db.features.current('101'), replayed['101'])
+        self.assertAlmostEqual(replayed['101']['hours_since_watering'], (34 * 10 - 195) / 60)
+        self.assertIsNone(self.db.features.current('102'))
+        ml_db.close()
+
+    def test_warmup_from_history(self):
+        """Test a plant without stored state is warmed up from its recent readings"""
+        self.db.store_sensor_data_batch(self.rows('101', 20))
+        self.db.close()
+        conn = sqlite3.connect(self.test_db_name)
+        conn.execute('DELETE FROM plant_features')
+        conn.commit()
+        conn.close()
+
+        self.db = DataBaseHandler(self.test_db_name)
+        self.db.store_sensor_data_batch(self.rows('101', 3, offset=20))
+        readings, _ = self.stored_readings()
+        expected = list(replay(readings))[-1][2]
+        self.assertFeaturesEqual(self.db.features.current('101'), expected)
+
+    def test_catch_up_after_lost_checkpoint(self):
+        """Test readings stored after the last checkpoint are replayed onto the stored state after a crash"""
+        self.db.store_sensor_data_batch(self.rows('101', 20))
+        self.db.checkpoint()
+        self.db.store_sensor_data_batch(self.rows('101', 10, offset=20))
+
+        # The old handler never gets to checkpoint again
+        self.db = DataBaseHandler(self.test_db_name)
+        self.db.store_sensor_data_batch(self.rows('101', 3, offset=30))
+        readings, _ = self.stored_readings()
+        expected = list(replay(readings))[-1][2]
+        self.assertFeaturesEqual(self.db.features.current('101'), expected)
+
+    def test_serving_includes_accepted_reading(self):
+        """Test features served for a buffered reading equal the ones ingest computes once it is stored"""
+        self.db.store_sensor_data_batch(self.rows('101', 20))
+        row = self.rows('101', 1, offset=20)[0]
+        served = self.db.features.current('101', row[1], row[2])
+        # Computed on a copy, the state itself waits for the write
+        self.assertNotEqual(self.db.features.current('101')['moisture'], served['moisture'])
+
+        self.db.store_sensor_data_batch([row])
+        self.assertFeaturesEqual(served, self.db.features.current('101'))
+        # Asking again once it is stored doesn't count it twice
+        self.assertFeaturesEqual(self.db.features.current('101', row[1], row[2]), served)
+
+
+if __name__ == '__main__':
+    unittest.main()
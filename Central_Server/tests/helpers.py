@@ -0,0 +1,35 @@
+'''
+Shared setup for the tests. Importing this puts Central_Server and Front_End on sys.path, the modules import
+their siblings directly the same as when the server runs from Central_Server and the dashboard from Front_End.
+'''
+import os
+import sys
+import unittest
+
+CENTRAL_SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRONT_END = os.path.join(CENTRAL_SERVER, 'Front_End')
+
+for path in (CENTRAL_SERVER, FRONT_END):
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+def remove_db(db_name):
+    """ Delete a sqlite file along with the -wal and -shm files WAL mode leaves next to it """
+    for path in (db_name, db_name + "-wal", db_name + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Test case using its own database file, test_db_name, which is removed before and after every test.
+    Subclasses open their handlers after super().setUp() and close them before super().tearDown().
+    """
+    test_db_name = None
+
+    def setUp(self):
+        remove_db(self.test_db_name)
+
+    def tearDown(self):
+        remove_db(self.test_db_name)
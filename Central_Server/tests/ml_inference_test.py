@@ -0,0 +1,91 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import helpers  # puts Central_Server and Front_End on sys.path
+
+from MLInference import MLInference, ModelRegistry
+
+
+class ThresholdModel:
+    """ Needs water below a moisture level, needs light below a light level, counts its calls """
+    calls = 0
+
+    def __init__(self, moisture, light):
+        self.moisture = moisture
+        self.light = light
+
+    def predict(self, features):
+        ThresholdModel.calls += 1
+        return np.column_stack([features[:, 0] < self.moisture, features[:, 3] < self.light]).astype(float)
+
+
+class MLInferenceTest(unittest.TestCase):
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        self.registry = ModelRegistry(self.model_dir)
+        self.ml = MLInference(self.model_dir)
+        ThresholdModel.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir)
+
+    def reading(self, moisture, light=500.0):
+        return {'moisture': moisture, 'temperature': 20.0, 'humidity': 50.0, 'light_level': light}
+
+    def test_registry_prefers_plant_model(self):
+        """Test a plant's own model wins over its plant type's, and plants without either have none"""
+        self.registry.save(ThresholdModel(30, 100), plant_type='herbs')
+        self.registry.save(ThresholdModel(60, 100), plant_id='101')
+        self.assertTrue(self.registry.resolve('101', 'herbs').endswith('plant_101.pkl'))
+        self.assertTrue(self.registry.resolve('102', 'herbs').endswith('type_herbs.pkl'))
+        self.assertIsNone(self.registry.resolve('103', 'default'))
+
+    def test_predict_batch_one_call_per_model(self):
+        """Test plants sharing a model are scored together and the result is what the controller reads"""
+        self.registry.save(ThresholdModel(50, 100), plant_type='herbs')
+        settings = [{'plant_id': str(i), 'plant_type': 'herbs'} for i in range(101, 111)]
+        readings = [self.reading(moisture) for moisture in range(10, 110, 10)]
+        readings[0]['light_level'] = 10.0
+        settings.append({'plant_id': '200', 'plant_type': 'default'})
+        readings.append(self.reading(10))
+
+        predictions = self.ml.predict_batch(readings, settings)
+        self.assertEqual(ThresholdModel.calls, 1)
+        self.assertNotIn('200', predictions)
+        self.assertEqual([predictions[str(i)]['needs_water'] for i in range(101, 111)], [True] * 4 + [False] * 6)
+        self.assertTrue(predictions['101']['needs_light'])
+        self.assertFalse(predictions['102']['needs_light'])
+        self.assertEqual(predictions['101']['confidence'], 1.0)
+        self.assertEqual(self.ml.predict('101', readings[0], {'plant_type': 'herbs'})['water_probability'], 1.0)
+
+    def test_lru_cache_memory_cap(self):
+        """Test models load once, the least recently used is dropped past the cap and replaced files reload"""
+        paths = [self.registry.save(ThresholdModel(50, 100), plant_id=str(i)) for i in range(3)]
+        self.ml.cache_bytes = os.path.getsize(paths[0]) * 2
+        for path in paths[:2]:
+            self.ml.load_model(path)
+        self.ml.load_model(paths[0])
+        self.ml.load_model(paths[2])
+        # 1 was used least recently
+        self.assertEqual(list(self.ml.models), [paths[0], paths[2]])
+
+        first = self.ml.load_model(paths[0])
+        self.assertIs(self.ml.load_model(paths[0]), first)
+        self.registry.save(ThresholdModel(20, 100), plant_id='0')
+        os.utime(paths[0], ns=(1, 1))
+        self.assertEqual(self.ml.load_model(paths[0])['model'].moisture, 20)
+
+    def test_drift_requests_retrain(self):
+        """Test drift alerts flag the plant until it is marked retrained"""
+        self.registry.save(ThresholdModel(50, 100), plant_id='101')
+        self.ml.on_drift({'plant_id': '101', 'sensor': 'moisture'})
+        self.assertTrue(self.ml.predict('101', self.reading(40))['retrain'])
+        self.ml.mark_retrained('101')
+        self.assertFalse(self.ml.needs_retrain('101'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,9 @@
 import unittest
 from unittest.mock import Mock, patch, MagicMock
 import json
-import sys
-import os
 from datetime import datetime
 
-# Add the parent directory to Python path for imports
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import helpers  # puts Central_Server and Front_End on sys.path
 
 from mqtt_server import MQTTServer
 from plant_controller import PlantController
@@ -19,7 +16,7 @@ class MQTTServerIntegrationTest(unittest.TestCase):
         # Create a mock MQTT client first
         self.mock_mqtt_client = Mock()
         with patch('paho.mqtt.client.Client', return_value=self.mock_mqtt_client):
-            self.server = MQTTServer()
+            self.server = MQTTServer(buffered_writes=False)
             self.server.client = self.mock_mqtt_client  # Ensure we use our mock
 
         # Sample sensor data that matches Arduino format
@@ -0,0 +1,99 @@
+import unittest
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+import numpy as np
+
+import helpers  # puts Central_Server and Front_End on sys.path
+
+from npz_model import load_npz, save_npz
+from MLInference import MLInference, ModelRegistry
+from ML_Service.export import export_model
+from ML_Service.online_model import OnlineLogisticModel
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+
+class NpzModelTest(unittest.TestCase):
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        self.rng = np.random.default_rng(5)
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir)
+
+    def path(self, name):
+        return os.path.join(self.model_dir, name)
+
+    def test_linear_export_matches_online_model(self):
+        """Test an exported OnlineLogisticModel scores like the original, NaN included"""
+        model = OnlineLogisticModel(4)
+        X = self.rng.normal([50, 20, 50, 400], [15, 3, 10, 100], size=(2000, 4))
+        model.partial_fit(X, (X[:, 0] < 40).astype(float))
+        X[3, 1] = np.nan
+        artifact = load_npz(export_model(model, self.path('plant_1.npz'), SENSORS, ('needs_water',)))
+        self.assertEqual(artifact['features'], SENSORS)
+        self.assertEqual(artifact['outputs'], ('needs_water',))
+        np.testing.assert_allclose(artifact['model'].predict(X)[:, 0], model.predict_proba(X)[:, 1])
+
+    def test_mlp_forward_pass(self):
+        """Test an exported scikit-learn style MLP (coefs_/intercepts_) gives its forward pass"""
+        W0, b0 = self.rng.normal(size=(4, 8)), self.rng.normal(size=8)
+        W1, b1 = self.rng.normal(size=(8, 1)), self.rng.normal(size=1)
+        mlp = SimpleNamespace(coefs_=[W0, W1], intercepts_=[b0, b1],
+                              activation='relu', out_activation_='logistic', classes_=np.array([0, 1]))
+        X = self.rng.normal(size=(20, 4))
+        model = load_npz(export_model(mlp, self.path('mlp.npz'), SENSORS, ('needs_water',)))['model']
+        expected = 1 / (1 + np.exp(-(np.maximum(X @ W0 + b0, 0) @ W1 + b1)))
+        np.testing.assert_allclose(model.predict(X), expected)
+
+    def test_tree_ensemble(self):
+        """Test a two tree forest averages the class 1 share of the leaves each row falls in"""
+        def tree(feature, threshold, left_counts, right_counts, missing_left=None):
+            # Root splitting on feature, two leaves holding [class 0, class 1] counts
+            tree_ = SimpleNamespace(
+                children_left=np.array([1, -1, -1]), children_right=np.array([2, -1, -1]),
+                feature=np.array([feature, -2, -2]), threshold=np.array([threshold, -2.0, -2.0]),
+                value=np.array([[[0, 0]], [left_counts], [right_counts]], dtype=float)
+            )
+            if missing_left is not None:
+                tree_.missing_go_to_left = np.array([missing_left, 0, 0], dtype=np.uint8)
+            return SimpleNamespace(tree_=tree_)
+        forest = SimpleNamespace(estimators_=[tree(0, 40.0, [0, 4], [4, 0], missing_left=True),
+                                              tree(3, 100.0, [1, 3], [3, 1])],
+                                 classes_=np.array([0, 1]))
+        with np.errstate(all='raise'):
+            model = load_npz(export_model(forest, self.path('forest.npz'), SENSORS, ('needs_water',)))['model']
+        X = np.array([[30, 20, 50, 50], [30, 20, 50, 500], [70, 20, 50, 50], [70, 20, 50, 500],
+                      [np.nan, 20, 50, np.nan]], dtype=float)
+        # The last row's NaN moisture goes left as the first tree says, its NaN light goes right in the second
+        np.testing.assert_allclose(model.predict(X)[:, 0], [(1 + 0.75) / 2, (1 + 0.25) / 2,
+                                                           (0 + 0.75) / 2, (0 + 0.25) / 2, (1 + 0.25) / 2])
+
+    def test_unknown_model_rejected(self):
+        """Test exporting something that isn't a supported model fails instead of writing a file"""
+        with self.assertRaises(ValueError):
+            export_model(object(), self.path('plant_1.npz'), SENSORS, ('needs_water',))
+        self.assertFalse(os.path.exists(self.path('plant_1.npz')))
+
+    def test_inference_prefers_npz(self):
+        """Test the registry serves a plant's .npz over its .pkl, and MLInference scores with it"""
+        registry = ModelRegistry(self.model_dir)
+        registry.save(OnlineLogisticModel(4), plant_id='101')
+        # Always says yes for needs_water, the untrained pickle says 0.5
+        save_npz(self.path('plant_101.npz'), 'linear', SENSORS, ('needs_water',),
+                 weights=np.zeros((4, 1)), bias=np.array([10.0]), link='logistic')
+        self.assertTrue(registry.resolve('101').endswith('plant_101.npz'))
+        ml = MLInference(self.model_dir)
+        prediction = ml.predict('101', {'moisture': 20.0, 'temperature': 20.0, 'humidity': 50.0, 'light_level': 500.0})
+        self.assertTrue(prediction['needs_water'])
+        self.assertGreater(prediction['water_probability'], 0.99)
+
+        # Saving a new pickle drops the old export instead of leaving it to shadow the new model
+        registry.save(OnlineLogisticModel(4), plant_id='101')
+        self.assertTrue(registry.resolve('101').endswith('plant_101.pkl'))
+
+
+if __name__ == '__main__':
+    unittest.main()
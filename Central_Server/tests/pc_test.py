@@ -1,6 +1,7 @@
 import unittest
 import sqlite3
 from datetime import datetime
+import numpy as np
 from Central_Server.plant_controller import PlantController
 import os
 
@@ -78,6 +79,31 @@ class PCTest(unittest.TestCase):
         self.assertEqual(second_plant["water_pump"]["active"], True)
         self.assertEqual(second_plant["water_pump"]["duration"], 3)
 
+    def test_batch_decisions_match_rule_based(self):
+        decisions = self.plant_controller.get_rule_based_decisions(self.sensor_data, self.settings)
+
+        readings = {"moisture": np.array([d["moisture"] for d in self.sensor_data])}
+        settings = {
+            "moisture_threshold": np.array([s["moisture_threshold"] for s in self.settings]),
+            "watering_duration": np.array([s["watering_duration"] for s in self.settings]),
+        }
+        batch = self.plant_controller.get_batch_decisions(readings, settings)
+        batch_decisions = self.plant_controller.batch_to_decisions([101, 102], batch)
+
+        self.assertEqual(batch_decisions, decisions)
+
+    def test_batch_decisions_vectorized(self):
+        moisture = np.array([10.0, 80.0, np.nan, 50.0])
+        batch = self.plant_controller.get_batch_decisions(
+            {"moisture": moisture},
+            {"moisture_threshold": np.array([20.0, 75.0, 30.0, np.nan]), "watering_duration": 5}
+        )
+
+        # Missing moisture counts as 0 and a missing threshold as 100, like _needs_water
+        self.assertEqual(batch["water_active"].tolist(), [True, False, True, True])
+        self.assertEqual(batch["water_duration"].tolist(), [5, 0, 5, 5])
+        self.assertEqual(batch["light_active"].shape, (4,))
+
     # def test_ml_based_automation(self):
     #     ml_predictions = {
     #         101: {"needs_light": True, "needs_water": True},
@@ -109,6 +135,29 @@ class PCTest(unittest.TestCase):
     #     self.assertEqual(second_plant["water_pump"]["duration"], 3)  # From settings
     #     self.assertEqual(second_plant["grow_light"]["active"], False)  # From ML predictions
 
+    def test_ml_predictions_drive_decisions(self):
+        """Test predicted outputs set the pump and light, anything not predicted falls back to the rules"""
+        for setting in self.settings:
+            setting["ml_enabled"] = True
+        self.sensor_data[1]["moisture"] = 90
+        ml_predictions = {
+            101: {"needs_water": False, "needs_light": False},
+            # Model without a needs_light output, light comes from the rules
+            102: {"needs_water": True},
+        }
+        decisions = self.plant_controller.get_control_decisions(self.sensor_data, self.settings, ml_predictions)
+
+        self.assertEqual(decisions[0]["water_pump"], {"active": False, "duration": 0})
+        self.assertFalse(decisions[0]["grow_light"]["active"])
+        # Rules say moisture 90 is wet, the model wins
+        self.assertEqual(decisions[1]["water_pump"], {"active": True, "duration": 3})
+        self.assertTrue(decisions[1]["grow_light"]["active"])
+
+        # A plant without a prediction keeps the rule based decisions
+        del ml_predictions[101]
+        decisions = self.plant_controller.get_control_decisions(self.sensor_data, self.settings, ml_predictions)
+        self.assertEqual(decisions[0]["water_pump"], {"active": True, "duration": 5})
+
     def test_needs_water(self):
         # Test case where moisture is below threshold
         plant_data = {"moisture": 70}
@@ -0,0 +1,358 @@
+import unittest
+from unittest.mock import Mock, patch
+import json
+import threading
+import time
+import asyncio
+from datetime import datetime
+
+import helpers  # puts Central_Server and Front_End on sys.path
+
+from worker_pool import PlantWorkerPool
+from mqtt_server import MQTTServer
+from async_mqtt_server import AsyncMQTTServer
+import sensor_codec
+
+
+class PlantWorkerPoolTest(unittest.TestCase):
+    def test_same_key_keeps_order(self):
+        """Test items for one plant are handled in the order they were submitted"""
+        seen = {}
+        lock = threading.Lock()
+
+        def handler(item):
+            plant_id, n = item
+            # Give other workers a chance to run in between
+            time.sleep(0.0005)
+            with lock:
+                seen.setdefault(plant_id, []).append(n)
+
+        pool = PlantWorkerPool(handler, workers=4, queue_size=200)
+        for n in range(50):
+            for plant_id in ('101', '102', '103'):
+                pool.submit(plant_id, (plant_id, n))
+        pool.stop()
+
+        for plant_id in ('101', '102', '103'):
+            self.assertEqual(seen[plant_id], list(range(50)))
+
+    def test_handler_errors_do_not_stop_worker(self):
+        """Test a failing item doesn't kill the worker thread"""
+        handled = []
+
+        def handler(item):
+            if item == 'bad':
+                raise ValueError(item)
+            handled.append(item)
+
+        pool = PlantWorkerPool(handler, workers=1)
+        pool.submit('101', 'bad')
+        pool.submit('101', 'good')
+        pool.stop()
+        self.assertEqual(handled, ['good'])
+
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        """Test submit() returns straight away and counts the item when the worker's queue is full"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def handler(item):
+            started.set()
+            release.wait(2)
+
+        pool = PlantWorkerPool(handler, workers=1, queue_size=2)
+        pool.submit('101', 0)
+        started.wait(2)
+        results = [pool.submit('101', n) for n in range(1, 5)]
+        release.set()
+        pool.stop()
+
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(pool.dropped, 2)
+
+
+class MQTTServerWorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.mock_mqtt_client = Mock()
+        with patch('paho.mqtt.client.Client', return_value=self.mock_mqtt_client), \
+                patch('mqtt_server.DataBaseHandler'), patch('mqtt_server.MLDataBaseHandler'):
+            self.server = MQTTServer(workers=2)
+        self.sensor_data = {
+            "moisture": 75,
+            "temperature": 65,
+            "humidity": 80,
+            "light_level": 85
+        }
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_on_message_only_queues(self):
+        """Test the network callback hands the message to a worker instead of processing it"""
+        msg = Mock()
+        msg.topic = "garden/101/sensors"
+        msg.payload = json.dumps(self.sensor_data).encode()
+
+        with patch.object(self.server, 'process_payload') as mock_process:
+            self.server.workers.handler = mock_process
+            self.server.on_message(self.mock_mqtt_client, None, msg)
+            self.server.workers.stop()
+            self.server.workers = None
+
+        mock_process.assert_called_once_with((101, self.sensor_data))
+
+    def test_gateway_batch_goes_to_each_plants_worker(self):
+        """Test a gateway batch is split so each plant's readings queue behind that plant's own messages"""
+        msg = Mock()
+        msg.topic = "garden/900/sensors"
+        msg.payload = json.dumps([dict(self.sensor_data, plant_id=101), dict(self.sensor_data, plant_id=102),
+                                  dict(self.sensor_data, plant_id=101)]).encode()
+        self.server.workers.stop()
+        self.server.workers = Mock()
+
+        self.server.on_message(self.mock_mqtt_client, None, msg)
+
+        submitted = [call[0] for call in self.server.workers.submit.call_args_list]
+        self.assertEqual([key for key, _ in submitted], [101, 102])
+        self.assertEqual([len(part) for _, (_, part) in submitted], [2, 1])
+        self.server.workers = None
+
+
+class BatchPayloadTest(unittest.TestCase):
+    def setUp(self):
+        self.mock_mqtt_client = Mock()
+        with patch('paho.mqtt.client.Client', return_value=self.mock_mqtt_client), \
+                patch('mqtt_server.DataBaseHandler'), patch('mqtt_server.MLDataBaseHandler'):
+            self.server = MQTTServer(buffered_writes=False, recent_readings=True)
+        self.server.db.get_plant_settings.side_effect = lambda plant_id: {
+            "plant_id": plant_id,
+            "moisture_threshold": 50,
+            "watering_duration": 5,
+            "ml_enabled": False
+        }
+
+    def reading(self, moisture, timestamp, plant_id=None):
+        reading = {"moisture": moisture, "temperature": 20, "humidity": 50, "light_level": 100, "timestamp": timestamp}
+        if plant_id is not None:
+            reading["plant_id"] = plant_id
+        return reading
+
+    def test_batch_stored_and_decided_on_latest(self):
+        """Test a gateway batch is stored with one call per plant and only each plant's newest reading is decided on"""
+        msg = Mock()
+        msg.topic = "garden/900/sensors"
+        msg.payload = json.dumps([
+            self.reading(60, "2025-02-21 14:30:00", plant_id=101),
+            self.reading(40, "2025-02-21 14:35:00", plant_id=101),
+            self.reading(30, "2025-02-21 14:32:00", plant_id=102),
+            {"moisture": 10},  # invalid, dropped
+            self.reading(70, "2025-02-21 14:31:00", plant_id=102),
+        ]).encode()
+
+        self.server.process_message(msg)
+
+        self.assertEqual(self.server.db.store_sensor_data_batch.call_count, 2)
+        rows = [row for call in self.server.db.store_sensor_data_batch.call_args_list for row in call[0][0]]
+        self.assertEqual([(plant_id, reading["moisture"]) for plant_id, reading, _ in rows],
+                         [(101, 60), (101, 40), (102, 30), (102, 70)])
+        self.assertEqual(rows[0][2], datetime(2025, 2, 21, 14, 30))
+
+        published = {call[0][0]: json.loads(call[0][1]) for call in self.mock_mqtt_client.publish.call_args_list}
+        self.assertEqual(set(published), {"garden/101/control", "garden/102/control"})
+        # 101's newest reading (40) needs water, 102's newest (30 at 14:32) does too
+        self.assertTrue(published["garden/101/control"][0]["water_pump"]["active"])
+        self.assertTrue(published["garden/102/control"][0]["water_pump"]["active"])
+        self.assertEqual(self.server.db.get_plant_settings.call_count, 2)
+        # The ring buffer has both plants' readings in time order
+        self.assertEqual(self.server.recent.window(101)[1][:, 0].tolist(), [60, 40])
+        self.assertEqual(self.server.recent.window(102)[1][:, 0].tolist(), [70, 30])
+
+    def test_drift_alerts_reach_inference(self):
+        """Test the server subscribes MLInference to the drift engine and writes readings straight through by default"""
+        self.server.db.drift.listeners.append.assert_called_once_with(self.server.ml.on_drift)
+        self.server.ml.on_drift({'plant_id': '101', 'sensor': 'moisture'})
+        self.assertTrue(self.server.ml.needs_retrain(101))
+        with patch('paho.mqtt.client.Client'), patch('mqtt_server.DataBaseHandler'), \
+                patch('mqtt_server.MLDataBaseHandler'):
+            self.assertIsNone(MQTTServer().write_buffer)
+
+    def test_recent_readings_off_by_default(self):
+        """Test the ring buffer is only kept when asked for"""
+        with patch('paho.mqtt.client.Client'), patch('mqtt_server.DataBaseHandler'), \
+                patch('mqtt_server.MLDataBaseHandler'):
+            server = MQTTServer(buffered_writes=False)
+        server.db.get_plant_settings.side_effect = self.server.db.get_plant_settings.side_effect
+        self.assertIsNone(server.recent)
+        server.handle_batch(101, [self.reading(60, "2025-02-21 14:30:00")])
+        server.handle_reading(101, self.reading(60, None))
+        server.db.store_sensor_data_batch.assert_called_once()
+
+    def test_ml_prediction_decides_watering(self):
+        """Test decide() waters an ML enabled plant its model says is dry, even above the moisture threshold"""
+        self.server.db.get_plant_settings.side_effect = lambda plant_id: {
+            "plant_id": plant_id,
+            "moisture_threshold": 5,
+            "watering_duration": 7,
+            "ml_enabled": True
+        }
+        self.server.ml.predict_batch = Mock(side_effect=lambda readings, settings, timestamps: {
+            s["plant_id"]: {"needs_water": True, "water_probability": 0.9} for s in settings
+        })
+
+        decisions = self.server.decide(101, self.reading(60, None))
+
+        self.server.ml.predict_batch.assert_called_once()
+        self.assertEqual(decisions[0]["water_pump"], {"active": True, "duration": 7})
+        # The model has no needs_light output, the rule based light decision is used
+        self.assertTrue(decisions[0]["grow_light"]["active"])
+        self.server.ml_db.store_watering_event_initial.assert_called_once_with(101, 60, 7)
+
+    def test_stale_batch_not_decided(self):
+        """Test buffered readings older than what the plant already sent live are stored but not acted on"""
+        self.server.handle_reading(101, self.reading(80, None))
+        results = self.server.handle_batch(101, [self.reading(10, "2025-02-21 14:30:00")])
+
+        self.assertEqual(results, [])
+        self.server.db.store_sensor_data_batch.assert_called_once()
+        self.assertEqual(self.server.db.get_plant_settings.call_count, 1)
+
+    def test_invalid_reading_not_stored(self):
+        """Test a reading missing a sensor or with a value that isn't a number is dropped, not stored or decided on"""
+        for payload in ({"moisture": 40, "humidity": 50, "light_level": 100},
+                        {"moisture": "dry", "temperature": 20, "humidity": 50, "light_level": 100}):
+            msg = Mock()
+            msg.topic = "garden/101/sensors"
+            msg.payload = json.dumps(payload).encode()
+            self.server.process_message(msg)
+
+        self.server.db.store_sensor_data.assert_not_called()
+        self.mock_mqtt_client.publish.assert_not_called()
+
+        msg.payload = json.dumps({"moisture": "40", "temperature": 20, "humidity": 50, "light_level": 100}).encode()
+        self.server.process_message(msg)
+        self.assertEqual(self.server.db.store_sensor_data.call_args[0][1]["moisture"], 40.0)
+
+    def test_batch_skips_bad_plant_id(self):
+        """Test a reading with a plant_id that isn't a number is dropped and the rest of the batch still stored"""
+        msg = Mock()
+        msg.topic = "garden/101/sensors"
+        msg.payload = json.dumps([self.reading(60, 1740148200), self.reading(50, 1740148260, plant_id="abc"),
+                                  self.reading(40, 1740148320, plant_id=102)]).encode()
+        self.server.process_message(msg)
+
+        rows = [row for call in self.server.db.store_sensor_data_batch.call_args_list for row in call[0][0]]
+        self.assertEqual([(row[0], row[1]["moisture"]) for row in rows], [(101, 60.0), (102, 40.0)])
+
+    def test_batch_defaults_to_topic_plant(self):
+        """Test readings without plant_id belong to the topic's plant"""
+        rows = []
+        self.server.db.store_sensor_data_batch.side_effect = rows.extend
+        self.server.handle_batch(101, [self.reading(60, 1740148200), self.reading(70, None)])
+
+        self.assertEqual([row[0] for row in rows], [101, 101])
+        self.assertEqual(rows[0][2], datetime.fromtimestamp(1740148200))
+
+    def test_binary_payload_gets_binary_reply(self):
+        """Test a binary node is answered in binary, and a JSON one still gets JSON"""
+        msg = Mock()
+        msg.topic = "garden/101/sensors"
+        msg.payload = sensor_codec.encode_sensor_payload([self.reading(40, 1740148200)])
+
+        self.server.process_message(msg)
+
+        rows = self.server.db.store_sensor_data_batch.call_args[0][0]
+        self.assertEqual(rows[0][0], 101)
+        self.assertEqual(rows[0][2], datetime.fromtimestamp(1740148200))
+        topic, payload = self.mock_mqtt_client.publish.call_args[0]
+        self.assertEqual(topic, "garden/101/control")
+        decisions = sensor_codec.decode_decisions(payload)
+        self.assertEqual(decisions[0]["plant_id"], 101)
+        self.assertTrue(decisions[0]["water_pump"]["active"])
+
+        # Switching back to JSON switches the replies back too
+        msg.payload = json.dumps(self.reading(40, 1740148200)).encode()
+        self.server.process_message(msg)
+        self.assertTrue(json.loads(self.mock_mqtt_client.publish.call_args[0][1])[0]["water_pump"]["active"])
+
+
+class AsyncMQTTServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.mock_mqtt_client = Mock()
+        with patch('paho.mqtt.client.Client', return_value=self.mock_mqtt_client), \
+                patch('mqtt_server.DataBaseHandler'), patch('mqtt_server.MLDataBaseHandler'):
+            self.server = AsyncMQTTServer(db_threads=4)
+        self.server.loop = asyncio.get_running_loop()
+        self.server._in_flight = asyncio.Semaphore(4)
+        self.server._stopping = asyncio.Event()
+
+    async def asyncTearDown(self):
+        self.server.executor.shutdown(wait=True)
+
+    def make_msg(self, plant_id, n):
+        msg = Mock()
+        msg.topic = f"garden/{plant_id}/sensors"
+        msg.payload = json.dumps({
+            "moisture": n,
+            "temperature": 20,
+            "humidity": 50,
+            "light_level": 100
+        }).encode()
+        return msg
+
+    async def test_dispatch_keeps_plant_order(self):
+        """Test readings for a plant reach handle_reading in order and decisions get published"""
+        seen = {}
+        lock = threading.Lock()
+
+        def handle_reading(plant_id, payload):
+            time.sleep(0.001)
+            with lock:
+                seen.setdefault(plant_id, []).append(payload['moisture'])
+            return [{"plant_id": plant_id, "water_pump": {"active": False, "duration": 0}, "grow_light": {"active": True}}]
+
+        self.server.handle_reading = handle_reading
+        for n in range(20):
+            for plant_id in (101, 102):
+                self.server.on_message(self.mock_mqtt_client, None, self.make_msg(plant_id, n))
+        await asyncio.gather(*self.server._tasks)
+
+        self.assertEqual(seen[101], list(range(20)))
+        self.assertEqual(seen[102], list(range(20)))
+        self.assertEqual(self.mock_mqtt_client.publish.call_count, 40)
+        topics = {call[0][0] for call in self.mock_mqtt_client.publish.call_args_list}
+        self.assertEqual(topics, {"garden/101/control", "garden/102/control"})
+        # Locks are dropped once a plant has nothing in progress
+        self.assertEqual(self.server._plant_locks, {})
+
+
+    async def test_gateway_batch_locks_each_plant(self):
+        """Test a gateway batch is handled under each of its plants' locks, in order with their own messages"""
+        seen = []
+
+        def handle_batch(plant_id, readings):
+            time.sleep(0.001)
+            seen.append((plant_id, [reading['moisture'] for reading in readings]))
+            return []
+
+        def handle_reading(plant_id, payload):
+            seen.append((plant_id, payload['moisture']))
+            return None
+
+        self.server.handle_batch = handle_batch
+        self.server.handle_reading = handle_reading
+        gateway = Mock()
+        gateway.topic = "garden/900/sensors"
+        gateway.payload = json.dumps([
+            {"plant_id": 101, "moisture": 1, "temperature": 20, "humidity": 50, "light_level": 100},
+            {"plant_id": 102, "moisture": 2, "temperature": 20, "humidity": 50, "light_level": 100},
+        ]).encode()
+        self.server.on_message(self.mock_mqtt_client, None, gateway)
+        self.server.on_message(self.mock_mqtt_client, None, self.make_msg(101, 3))
+        await asyncio.gather(*self.server._tasks)
+
+        self.assertEqual([entry for entry in seen if entry[0] == 101], [(101, [1]), (101, 3)])
+        self.assertIn((102, [2]), seen)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+
+import helpers  # puts Central_Server and Front_End on sys.path
+
+from quantile_sketch import TDigest, COMPRESSION
+
+PROBABILITIES = np.array([0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999])
+
+
+class TDigestTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+
+    def assertQuantilesClose(self, digest, data):
+        # Rank error rather than value error, what t-digest bounds
+        estimates = digest.quantile(PROBABILITIES)
+        ranks = np.searchsorted(np.sort(data), estimates) / len(data)
+        np.testing.assert_allclose(ranks, PROBABILITIES, atol=0.01)
+
+    def test_quantiles_and_size(self):
+        """Test quantiles stay within 1% rank with a bounded number of centroids"""
+        data = self.rng.lognormal(size=200000)
+        digest = TDigest()
+        for chunk in np.array_split(data, 400):
+            digest.add_many(chunk)
+
+        self.assertQuantilesClose(digest, data)
+        self.assertLessEqual(len(digest.means), COMPRESSION)
+        self.assertEqual(digest.count, len(data))
+        self.assertEqual(digest.quantile(0), data.min())
+        self.assertEqual(digest.quantile(1), data.max())
+        self.assertAlmostEqual(digest.mean, data.mean())
+        self.assertAlmostEqual(digest.std, data.std())
+
+    def test_merge_across_plants(self):
+        """Test merged per plant digests match one digest over all readings"""
+        plants = [self.rng.normal(loc, 5, size=20000) for loc in (20, 35, 50)]
+        fleet = TDigest()
+        for data in plants:
+            digest = TDigest()
+            digest.add_many(data)
+            fleet.merge(TDigest.from_bytes(digest.to_bytes()))
+
+        everything = np.concatenate(plants)
+        self.assertQuantilesClose(fleet, everything)
+        self.assertEqual(fleet.count, len(everything))
+        self.assertAlmostEqual(fleet.std, everything.std())
+
+    def test_empty_and_nan(self):
+        """Test NaN readings are skipped and an empty digest has no quantiles"""
+        digest = TDigest()
+        self.assertTrue(np.isnan(digest.quantile(0.5)))
+        digest.add_many([1.0, np.nan, 3.0])
+        self.assertEqual(digest.count, 2)
+        self.assertEqual(digest.quantile(0.5), 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+
+import helpers  # puts Central_Server and Front_End on sys.path
+
+from reading_buffer import ReadingBuffer, SENSORS
+from timestamps import to_epoch_ms
+
+
+class ReadingBufferTest(unittest.TestCase):
+    def reading(self, moisture):
+        return {'moisture': moisture, 'temperature': 20.0, 'humidity': 50.0, 'light_level': 300.0}
+
+    def test_window_after_wrapping(self):
+        """Test windows are the last readings in time order and views into the buffer after wrapping"""
+        buffer = ReadingBuffer(capacity=5)
+        start = datetime(2025, 3, 1)
+        for i in range(13):
+            buffer.append(101, start + timedelta(minutes=i), self.reading(i))
+
+        timestamps, values = buffer.window(101)
+        self.assertEqual(values[:, 0].tolist(), [8, 9, 10, 11, 12])
+        self.assertEqual(timestamps[-1], to_epoch_ms(start + timedelta(minutes=12)))
+        self.assertEqual(buffer.window(101, 2)[1][:, 0].tolist(), [11, 12])
+        # Views, no copy
+        self.assertFalse(values.flags.owndata)
+        self.assertFalse(timestamps.flags.owndata)
+        self.assertEqual(buffer.latest(101)[1], dict(zip(SENSORS, [12.0, 20.0, 50.0, 300.0])))
+        self.assertEqual(len(buffer.window(999)[0]), 0)
+
+    def test_older_reading_dropped(self):
+        """Test a reading older than the plant's newest is dropped"""
+        buffer = ReadingBuffer(capacity=5)
+        self.assertTrue(buffer.append(101, datetime(2025, 3, 1, 12), self.reading(1)))
+        self.assertFalse(buffer.append(101, datetime(2025, 3, 1, 11), self.reading(2)))
+        self.assertEqual(buffer.window(101)[1][:, 0].tolist(), [1])
+
+    def test_memory_bounded(self):
+        """Test slabs are allocated as plants arrive and the least recently heard from plant is reused"""
+        buffer = ReadingBuffer(capacity=4, max_plants=6, slab_plants=4)
+        moment = datetime(2025, 3, 1)
+        for plant_id in range(5):
+            buffer.append(plant_id, moment, self.reading(plant_id))
+        self.assertEqual(len(buffer._slabs), 2)
+        full = buffer.memory_bytes()
+
+        buffer.append(0, moment, self.reading(0))
+        for plant_id in range(5, 10):
+            buffer.append(plant_id, moment, self.reading(plant_id))
+        self.assertEqual(len(buffer), 6)
+        self.assertEqual(buffer.memory_bytes(), full)
+        self.assertIn(0, buffer)
+        self.assertNotIn(1, buffer)
+        # The reused row starts empty
+        self.assertEqual(buffer.window(9)[1][:, 0].tolist(), [9])
+
+    def test_slope(self):
+        """Test the moisture slope per hour over the window"""
+        buffer = ReadingBuffer(capacity=8)
+        start = datetime(2025, 3, 1)
+        for i in range(10):
+            buffer.append(101, start + timedelta(minutes=30 * i), self.reading(80 - 2 * i))
+        self.assertAlmostEqual(buffer.slope(101), -4.0, places=4)
+        self.assertIsNone(ReadingBuffer().slope(101))
+
+
+if __name__ == '__main__':
+    unittest.main()
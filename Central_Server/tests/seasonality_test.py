@@ -0,0 +1,95 @@
+import unittest
+import sqlite3
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+from helpers import DatabaseTestCase
+
+from db_handler import DataBaseHandler
+from migrations import migrate
+from seasonality import HOURLY_SLOTS
+from data_loader import load_seasonality_cube, load_hourly_series, decode_timestamps
+
+
+class SeasonalityTest(DatabaseTestCase):
+    test_db_name = "test_seasonality_plant_data.db"
+
+    def setUp(self):
+        super().setUp()
+        self.db = DataBaseHandler(self.test_db_name)
+        self.rng = np.random.default_rng(5)
+
+    def tearDown(self):
+        self.db.close()
+        super().tearDown()
+
+    def store(self, plant_id, hours, start=datetime(2025, 4, 1), every=timedelta(minutes=20)):
+        rows = []
+        moment = start
+        while moment < start + timedelta(hours=hours):
+            rows.append((plant_id, {
+                'moisture': self.rng.uniform(20, 80),
+                'temperature': 20 + 5 * np.sin(moment.hour / 24 * 2 * np.pi),
+                'humidity': 50.0,
+                'light_level': self.rng.uniform(0, 1000)
+            }, moment))
+            moment += every
+        # Two batches so the upserts add to existing cells
+        half = len(rows) // 2
+        self.db.store_sensor_data_batch(rows[:half])
+        self.db.store_sensor_data_batch(rows[half:])
+
+    def raw_frame(self, conn):
+        df = pd.read_sql_query("SELECT plant_id, temperature, timestamp FROM sensor_data", conn)
+        df['timestamp'] = decode_timestamps(df['timestamp'])
+        return df
+
+    def test_cube_matches_groupby(self):
+        """Test the cube at ingest matches a pandas hour x weekday groupby over the raw readings"""
+        self.store(101, 24 * 10)
+        self.store(102, 24 * 3)
+        conn = sqlite3.connect(self.test_db_name)
+        df = self.raw_frame(conn)
+        for plant_id, frame in (('101', df[df['plant_id'] == '101']), (None, df)):
+            sums, counts = load_seasonality_cube(conn, plant_id)['temperature']
+            expected = frame.groupby([frame['timestamp'].dt.hour, frame['timestamp'].dt.dayofweek])['temperature'].mean()
+            for (hour, weekday), mean in expected.items():
+                self.assertAlmostEqual(sums[hour, weekday] / counts[hour, weekday], mean)
+            self.assertEqual(counts.sum(), len(frame))
+        conn.close()
+
+    def test_hourly_ring_keeps_last_hours(self):
+        """Test the hourly ring wraps around and only the last HOURLY_SLOTS hours come back"""
+        hours = HOURLY_SLOTS + 50
+        self.store(101, hours, every=timedelta(minutes=30))
+        conn = sqlite3.connect(self.test_db_name)
+        series = load_hourly_series(conn, '101')['temperature']
+        df = self.raw_frame(conn)
+        conn.close()
+
+        expected = df.set_index('timestamp')['temperature'].resample('h').mean().to_numpy()[-HOURLY_SLOTS:]
+        self.assertEqual(len(series), HOURLY_SLOTS)
+        np.testing.assert_allclose(series, expected)
+
+    def test_migration_backfills_from_rollups(self):
+        """Test upgrading rebuilds the same cube and ring from the hourly rollups"""
+        self.store(101, 24 * 9)
+        conn = sqlite3.connect(self.test_db_name)
+        before_cube = load_seasonality_cube(conn, '101')['moisture']
+        before_series = load_hourly_series(conn, '101')['moisture']
+        conn.execute("DROP TABLE seasonality_cube")
+        conn.execute("DROP TABLE seasonality_hourly")
+        conn.execute("PRAGMA user_version = 8")
+        conn.commit()
+        migrate(conn)
+
+        after_cube = load_seasonality_cube(conn, '101')['moisture']
+        np.testing.assert_allclose(after_cube[0], before_cube[0])
+        np.testing.assert_array_equal(after_cube[1], before_cube[1])
+        np.testing.assert_allclose(load_hourly_series(conn, '101')['moisture'], before_series)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import sqlite3
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+import numpy as np
+from unittest.mock import Mock, patch
+
+from helpers import DatabaseTestCase
+
+from db_handler import DataBaseHandler
+from ML_Service.ml_db_handler import MLDataBaseHandler
+from ML_Service.train import dataset, main
+from ML_Service.feature_store import FEATURES
+from MLInference import MLInference
+from mqtt_server import MQTTServer
+
+
+class TrainTest(DatabaseTestCase):
+    test_db_name = "test_train_plant_data.db"
+
+    def setUp(self):
+        super().setUp()
+        self.model_dir = tempfile.mkdtemp()
+        self.db = DataBaseHandler(self.test_db_name)
+        self.ml_db = MLDataBaseHandler(self.test_db_name)
+        self.rng = np.random.default_rng(11)
+        self.waterings = 0
+        for plant_id in ('101', '102'):
+            self.grow(plant_id)
+        self.db.set_plant_settings('101', 'herbs')
+        self.db.set_plant_settings('102', 'herbs')
+
+    def tearDown(self):
+        self.db.close()
+        self.ml_db.close()
+        shutil.rmtree(self.model_dir)
+        super().tearDown()
+
+    def grow(self, plant_id):
+        """ Four days of readings every 10 minutes, moisture dries out and is watered back up below 30 """
+        moisture, moment = 80.0, datetime(2025, 6, 1)
+        rows = []
+        conn = sqlite3.connect(self.test_db_name)
+        for _ in range(4 * 24 * 6):
+            rows.append((plant_id, {'moisture': moisture, 'temperature': 22 + self.rng.normal(),
+                                    'humidity': 50.0, 'light_level': 300.0}, moment))
+            moisture -= self.rng.uniform(0.5, 1.5)
+            if moisture < 30:
+                conn.execute('INSERT INTO watering_events (plant_id, watering_duration, moisture_before, timestamp) VALUES (?, 10, ?, ?)',
+                             (plant_id, moisture, str(moment + timedelta(minutes=5))))
+                self.waterings += 1
+                moisture = 80.0
+            moment += timedelta(minutes=10)
+        conn.commit()
+        conn.close()
+        self.db.store_sensor_data_batch(rows)
+
+    def test_dataset_streams_in_chunks(self):
+        """Test chunks stay within chunk_size and the readings right before a watering are labeled"""
+        conn = sqlite3.connect(self.test_db_name)
+        chunks = list(dataset(conn, ['101', '102'], chunk_size=300, label_hours=0.2))
+        conn.close()
+        self.assertTrue(all(len(X) <= 300 and X.shape[1] == len(FEATURES) for X, _ in chunks))
+        self.assertEqual(sum(len(X) for X, _ in chunks), 2 * 4 * 24 * 6)
+        # Only the reading 5 minutes before each watering, the one 15 minutes before is past 12 minutes
+        self.assertEqual(sum(int(y.sum()) for _, y in chunks), self.waterings)
+
+    def test_trained_model_served_by_inference(self):
+        """Test the CLI writes a type model MLInference loads from its .npz export and that it learned dry means water"""
+        path = main(['--plant-type', 'herbs', '--db', self.test_db_name, '--model-dir', self.model_dir,
+                     '--epochs', '3', '--chunk-size', '500'])
+        self.assertTrue(path.endswith('type_herbs.pkl'))
+
+        ml = MLInference(self.model_dir)
+        # The server loads the .npz export, not the pickle
+        self.assertTrue(ml.registry.resolve('101', 'herbs').endswith('type_herbs.npz'))
+        reading = {'temperature': 22.0, 'humidity': 50.0, 'light_level': 300.0}
+        settings = [{'plant_id': '101', 'plant_type': 'herbs'}, {'plant_id': '102', 'plant_type': 'herbs'}]
+        predictions = ml.predict_batch([dict(reading, moisture=31.0), dict(reading, moisture=75.0)], settings)
+        self.assertTrue(predictions['101']['needs_water'])
+        self.assertFalse(predictions['102']['needs_water'])
+        self.assertGreater(predictions['101']['water_probability'], predictions['102']['water_probability'])
+
+    def test_trained_model_changes_published_decisions(self):
+        """Test the server waters by the trained model where the moisture threshold alone wouldn't"""
+        main(['--plant-type', 'herbs', '--db', self.test_db_name, '--model-dir', self.model_dir,
+              '--epochs', '3', '--chunk-size', '500'])
+        client = Mock()
+        with patch('paho.mqtt.client.Client', return_value=client), \
+                patch('mqtt_server.DataBaseHandler'), patch('mqtt_server.MLDataBaseHandler'):
+            server = MQTTServer()
+        server.ml = MLInference(self.model_dir)
+        server.db.get_plant_settings.side_effect = lambda plant_id: {
+            'plant_id': str(plant_id), 'plant_type': 'herbs', 'moisture_threshold': 10,
+            'watering_duration': 4, 'ml_enabled': True
+        }
+        reading = {'temperature': 22.0, 'humidity': 50.0, 'light_level': 300.0}
+
+        dry = server.decide(101, dict(reading, moisture=31.0))
+        wet = server.decide(102, dict(reading, moisture=75.0))
+        self.assertEqual(dry[0]['water_pump'], {'active': True, 'duration': 4})
+        self.assertEqual(wet[0]['water_pump'], {'active': False, 'duration': 0})
+        # The model has no needs_light output, light stays rule based
+        self.assertTrue(dry[0]['grow_light']['active'])
+        server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
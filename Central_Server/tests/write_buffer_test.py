@@ -0,0 +1,152 @@
+import unittest
+import sqlite3
+import time
+import threading
+from unittest.mock import Mock
+
+from helpers import DatabaseTestCase
+
+from db_handler import DataBaseHandler
+from write_buffer import SensorWriteBuffer
+
+
+class WriteBufferTest(DatabaseTestCase):
+    test_db_name = "test_write_buffer.db"
+
+    def setUp(self):
+        super().setUp()
+        self.db_handler = DataBaseHandler(self.test_db_name)
+        self.reading = {
+            'moisture': 0.5,
+            'temperature': 25.0,
+            'humidity': 60.0,
+            'light_level': 800
+        }
+
+    def tearDown(self):
+        self.db_handler.close()
+        super().tearDown()
+
+    def count_rows(self):
+        conn = sqlite3.connect(self.test_db_name)
+        count = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_flush_on_size(self):
+        """Test a full batch is handed to the database in one call"""
+        db = Mock()
+        buffer = SensorWriteBuffer(db, max_rows=3, max_delay=60)
+        for _ in range(3):
+            buffer.add('plant1', self.reading)
+
+        deadline = time.time() + 2
+        while buffer.pending() and time.time() < deadline:
+            time.sleep(0.01)
+        buffer.close()
+
+        db.store_sensor_data_batch.assert_called_once()
+        self.assertEqual(len(db.store_sensor_data_batch.call_args[0][0]), 3)
+
+    def test_flush_on_time(self):
+        """Test readings are written once max_delay passes even if the batch is small"""
+        buffer = SensorWriteBuffer(self.db_handler, max_rows=500, max_delay=0.05)
+        buffer.add('plant1', self.reading)
+
+        deadline = time.time() + 2
+        while self.count_rows() == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        buffer.close()
+
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_close_flushes(self):
+        """Test close writes whatever is still waiting"""
+        buffer = SensorWriteBuffer(self.db_handler, max_rows=500, max_delay=60)
+        for _ in range(10):
+            buffer.add('plant1', self.reading)
+        buffer.close()
+
+        self.assertEqual(self.count_rows(), 10)
+        with self.assertRaises(RuntimeError):
+            buffer.add('plant1', self.reading)
+
+    def test_failed_writes_are_bounded(self):
+        """Test failed batches are kept for retry but never more than max_pending"""
+        db = Mock()
+        db.store_sensor_data_batch.side_effect = sqlite3.OperationalError("disk I/O error")
+        buffer = SensorWriteBuffer(db, max_rows=500, max_delay=60, max_pending=500)
+        for _ in range(600):
+            buffer.add('plant1', self.reading)
+        buffer.flush()
+
+        self.assertEqual(buffer.pending(), 500)
+        self.assertEqual(buffer.dropped, 100)
+        db.store_sensor_data_batch.side_effect = None
+        buffer.close()
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_bad_reading_rejected_on_add(self):
+        """Test a reading missing a sensor is refused by add() and numeric strings are stored as numbers"""
+        buffer = SensorWriteBuffer(self.db_handler, max_rows=500, max_delay=60)
+        reading = dict(self.reading)
+        del reading['temperature']
+        with self.assertRaises(ValueError):
+            buffer.add('plant1', reading)
+        with self.assertRaises(ValueError):
+            buffer.add('plant1', dict(self.reading, moisture='wet'))
+        buffer.add('plant1', dict(self.reading, moisture='0.5'))
+        buffer.add('plant1', self.reading)
+        buffer.close()
+
+        conn = sqlite3.connect(self.test_db_name)
+        rows = conn.execute("SELECT moisture, typeof(moisture) FROM sensor_data").fetchall()
+        conn.close()
+        self.assertEqual(rows, [(0.5, 'real'), (0.5, 'real')])
+
+    def test_failed_batch_written_one_at_a_time(self):
+        """Test a batch failing on one row still stores the others instead of retrying all of them"""
+        stored = []
+
+        def store(rows):
+            if any(plant_id == 'bad' for plant_id, _, _ in rows):
+                raise KeyError('temperature')
+            stored.extend(rows)
+        db = Mock()
+        db.store_sensor_data_batch.side_effect = store
+        buffer = SensorWriteBuffer(db, max_rows=500, max_delay=60)
+        for plant_id in ['plant1'] * 10 + ['bad'] + ['plant2'] * 10:
+            buffer.add(plant_id, self.reading)
+
+        self.assertEqual(buffer.flush(), 20)
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual([row[0] for row in stored], ['plant1'] * 10 + ['plant2'] * 10)
+        buffer.close()
+
+    def test_add_is_bounded(self):
+        """Test add() itself drops the oldest readings past max_pending while the writer is stuck"""
+        db = Mock()
+        started = threading.Event()
+        release = threading.Event()
+
+        def stuck(rows):
+            started.set()
+            release.wait(2)
+        db.store_sensor_data_batch.side_effect = stuck
+        buffer = SensorWriteBuffer(db, max_rows=10, max_delay=60, max_pending=10)
+        for moisture in range(10):
+            buffer.add('plant1', dict(self.reading, moisture=moisture))
+        started.wait(2)
+        for moisture in range(10, 35):
+            buffer.add('plant1', dict(self.reading, moisture=moisture))
+
+        self.assertEqual(buffer.pending(), 10)
+        self.assertEqual(buffer.dropped, 15)
+        release.set()
+        buffer.close()
+        written = [row[1]['moisture'] for call in db.store_sensor_data_batch.call_args_list for row in call[0][0]]
+        self.assertEqual(written, list(range(10)) + list(range(25, 35)))
+
+
+if __name__ == '__main__':
+    unittest.main()
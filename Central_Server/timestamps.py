@@ -0,0 +1,34 @@
+'''
+Reading timestamps are stored as integer epoch milliseconds (UTC), so loading them is a vectorized
+pd.to_datetime(unit='ms') instead of parsing a string per row, and range scans compare integers.
+sensor_rollups bucket keys stay local time text, the buckets follow the Pi's calendar day.
+'''
+from datetime import datetime
+
+# Text layout timestamps had before migration 5, still used for rollup bucket keys
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def to_epoch_ms(value):
+    """
+    :param value: datetime (naive ones are the Pi's local time), epoch milliseconds, or old style text
+    :return: epoch milliseconds as int
+    """
+    if isinstance(value, datetime):
+        # Whole seconds and milliseconds separately, float math could push .999999 into the next second
+        return int(value.replace(microsecond=0).timestamp()) * 1000 + value.microsecond // 1000
+    if isinstance(value, str):
+        return to_epoch_ms(datetime.fromisoformat(value))
+    return int(value)
+
+
+def from_epoch_ms(ms):
+    """ Local naive datetime for epoch milliseconds """
+    return datetime.fromtimestamp(ms / 1000)
+
+
+def local_text(value):
+    """ Local time text in TIMESTAMP_FORMAT for epoch milliseconds, text is passed through """
+    if isinstance(value, str):
+        return value
+    return from_epoch_ms(value).strftime(TIMESTAMP_FORMAT)
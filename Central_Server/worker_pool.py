@@ -0,0 +1,72 @@
+import os
+import queue
+import threading
+
+# Put on a worker's queue to tell it to finish up
+_STOP = object()
+
+
+class PlantWorkerPool:
+    """
+    Fixed set of worker threads, each with its own bounded queue. Work for a plant always lands on
+    the same worker (chosen from the plant key), so messages for one plant are processed one at a time
+    in arrival order while different plants are spread over all the workers.
+    The queues are bounded, when a worker falls behind submit() drops the item (counted in dropped) instead
+    of letting memory grow. It never blocks, it runs on paho's network thread and blocking there stops
+    keepalives and every other plant's messages too.
+    """
+    def __init__(self, handler, workers=None, queue_size=1000):
+        """
+        :param handler: Called with each submitted item, from a worker thread
+        :param workers: Number of worker threads, defaults to the number of cores
+        :param queue_size: Most items waiting per worker before submit() drops new ones
+        """
+        self.handler = handler
+        self.workers = workers or os.cpu_count() or 1
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        # Items dropped because their worker's queue was full
+        self.dropped = 0
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"plant-worker-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, item):
+        """
+        Queue an item for the worker that owns key.
+        :param key: Plant key, items with the same key are handled in the order they are submitted
+        :param item: Passed to the handler
+        :return: False if the worker's queue was full and the item was dropped
+        """
+        try:
+            self._queues[hash(key) % self.workers].put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            # Once at the start of an overload and then every 1000, not once per message
+            if self.dropped % 1000 == 1:
+                print(f"Worker queue full, dropped {self.dropped} items so far")
+            return False
+        return True
+
+    def pending(self):
+        """ Items waiting across all workers """
+        return sum(q.qsize() for q in self._queues)
+
+    def stop(self):
+        """ Let the workers finish what is already queued, then stop them """
+        for q in self._queues:
+            q.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is _STOP:
+                return
+            try:
+                self.handler(item)
+            except Exception as e:
+                print(f"Worker failed to process item {e}")
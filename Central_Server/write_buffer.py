@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+SENSORS = ('moisture', 'temperature', 'humidity', 'light_level')
+
+
+def clean_reading(data):
+    """
+    Copy of a reading with its sensor values as floats, None kept for a sensor that sent null. Checked before a
+    reading is queued so it can't fail the batch it would be written with.
+    :param data: Sensor reading dict
+    :return: the cleaned reading dict
+    :raises ValueError: a sensor is missing or its value isn't a number
+    """
+    cleaned = dict(data)
+    for sensor in SENSORS:
+        if sensor not in data:
+            raise ValueError(f"Reading has no {sensor}")
+        value = data[sensor]
+        if value is None:
+            continue
+        try:
+            cleaned[sensor] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{sensor} is not a number: {value!r}")
+    return cleaned
+
+
+class SensorWriteBuffer:
+    """
+    Write-behind buffer for sensor readings. on_message hands readings to add() and a background
+    thread writes them with one executemany transaction when max_rows readings are waiting or
+    max_delay seconds have passed, so we pay one commit per batch instead of one per reading.
+
+    What can be lost if the process dies is bounded: normally at most max_rows readings or max_delay
+    seconds worth, and if the database keeps failing or can't keep up at most max_pending readings are
+    held (the oldest get dropped after that, dropped counts them).
+    """
+    def __init__(self, db, max_rows=500, max_delay=0.2, max_pending=5000):
+        """
+        :param db: DataBaseHandler used for the batch writes
+        :param max_rows: Flush as soon as this many readings are waiting
+        :param max_delay: Flush at least this often (seconds)
+        :param max_pending: Most readings held while writes are failing or falling behind
+        """
+        self.db = db
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, max_rows)
+        self._rows = []
+        # Readings dropped to stay under max_pending, and how many of those have been reported
+        self.dropped = 0
+        self._reported = 0
+        self._lock = threading.Lock()
+        # Only one flush writes at a time so batches land in the order they were collected
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sensor-write-buffer", daemon=True)
+        self._thread.start()
+
+    def add(self, plant_id, data, timestamp=None):
+        """
+        Queue a reading for the next batch. Unless given, the timestamp is taken now, not when the batch is written.
+        :param plant_id: The id of the plant the reading is from
+        :param data: Sensor reading dict (moisture, temperature, humidity, light_level)
+        :param timestamp: When the reading was taken if the edge node sent it, defaults to now
+        :raises ValueError: the reading is missing a sensor or has a value that isn't a number, see clean_reading
+        """
+        data = clean_reading(data)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write buffer is closed")
+            if len(self._rows) >= self.max_pending:
+                # Never block the caller (the MQTT network thread), make room by dropping the oldest
+                del self._rows[:len(self._rows) - self.max_pending + 1]
+                self.dropped += 1
+            self._rows.append((plant_id, data, timestamp or datetime.now()))
+            full = len(self._rows) >= self.max_rows
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        """ Number of readings waiting to be written """
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self):
+        """
+        Write everything that is waiting in a single transaction.
+        :return: Number of readings written
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                dropped, self._reported = self.dropped - self._reported, self.dropped
+            if dropped:
+                # Reported here rather than in add() so a flood doesn't print once per reading
+                print(f"Write buffer full, dropped {dropped} oldest readings")
+            if not rows:
+                return 0
+            try:
+                self.db.store_sensor_data_batch(rows)
+            except sqlite3.OperationalError as e:
+                # The database itself is failing (locked, disk full), the same rows can go in once it is back
+                print(f"Failed to write {len(rows)} buffered readings {e}")
+                self._retry(rows)
+                return 0
+            except Exception as e:
+                # Something in the rows, write them one at a time so only the bad one is lost
+                print(f"Failed to write {len(rows)} buffered readings {e}, writing them one at a time")
+                return self._write_each(rows)
+            return len(rows)
+
+    def _write_each(self, rows):
+        written = 0
+        for i, row in enumerate(rows):
+            try:
+                self.db.store_sensor_data_batch([row])
+            except sqlite3.OperationalError as e:
+                print(f"Failed to write {len(rows) - i} buffered readings {e}")
+                self._retry(rows[i:])
+                break
+            except Exception as e:
+                print(f"Dropping buffered reading for plant id {row[0]} that can't be stored {e}")
+                continue
+            written += 1
+        return written
+
+    def _retry(self, rows):
+        # Put them back in front for the next flush, but never hold more than max_pending
+        with self._lock:
+            retry = rows + self._rows
+            dropped = len(retry) - self.max_pending
+            if dropped > 0:
+                print(f"Write buffer full, dropping {dropped} oldest readings")
+                retry = retry[dropped:]
+                self.dropped += dropped
+                self._reported += dropped
+            self._rows = retry
+
+    def close(self):
+        """ Stop the background thread and write whatever is left, call on shutdown """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            self.flush()